@@ -0,0 +1,33 @@
+import heapq
+import datetime
+import itertools
+from zoneinfo import ZoneInfo
+
+
+class simClock:
+    """Simulated replay clock: time moves only when advanced, scheduled callbacks run in time order"""
+    def __init__(self, start: datetime.datetime, tz = "US/Eastern"):
+        self.tz = ZoneInfo(tz)
+        self.now = start if start.tzinfo else start.replace(tzinfo = self.tz)
+        self._queue = [] # (time, seq, callback, args)
+        self._seq = itertools.count()
+
+    def today(self) -> str:
+        """yyyymmdd of the simulated time (same format as get_date_today)"""
+        return self.now.astimezone(self.tz).strftime("%Y%m%d")
+
+    def at(self, hour, minute = 0, date: datetime.date = None) -> datetime.datetime:
+        """time of day on date (default: simulated today)"""
+        date = date or self.now.astimezone(self.tz).date()
+        return datetime.datetime(date.year, date.month, date.day, hour, minute, tzinfo = self.tz)
+
+    def schedule(self, time: datetime.datetime, callback, *args):
+        heapq.heappush(self._queue, (time, next(self._seq), callback, args))
+
+    def advance_to(self, time: datetime.datetime):
+        """run every callback scheduled up to time (in order), then set the clock to time"""
+        while self._queue and self._queue[0][0] <= time:
+            when, _, callback, args = heapq.heappop(self._queue)
+            self.now = max(self.now, when)
+            callback(*args)
+        self.now = max(self.now, time)
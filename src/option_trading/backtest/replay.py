@@ -0,0 +1,208 @@
+"""Replay backtest of the 90DTE short put / long put strategy
+
+Feeds daily chain snapshots (see backtest/sources.py) through the same leg selection
+(utils/selection.py), order builders (brokerage/orders.py), orderBook and positionManager
+as the live strategy, with a simulated broker and clock instead of IB.
+
+Each replayed day (simulated US/Eastern time):
+    10:28  select legs from the snapshot and place the orders (like ninetyDTE.run_strategy)
+    16:00  match working orders (brackets: take profit / stop loss) against the snapshot,
+           settle expiring options at intrinsic value and mark the book to market
+
+Run from src/option_trading:
+    python -m backtest.replay --days 1260
+"""
+import time
+import argparse
+import pandas as pd
+from ib_insync import *
+from utils.option_utils import expiryResolver, convert_str_date
+from utils.chain_index import ChainIndex
+from utils.greeks import fill_missing_greeks
+from utils.selection import select_short_put, hedge_credit_target, select_long_put
+from brokerage.orders import entry_orders, bracketOrderException
+from brokerage.order_book import orderBook
+from portfolio.position_manager import positionManager
+from backtest.clock import simClock
+from backtest.sim_broker import simBroker
+from backtest.sources import syntheticChainSource
+
+DEFAULT_PARAMS = {
+    'STRATEGY_NAME': "90DTE",
+    'HEDGE_RATIO': 2,
+    'DAILY_PREMIUM': 500,
+    'SHORT_DELTA_TARGET': -0.15,
+    'SHORT_DELTA_TOLERANCE': 0.03,
+    'HEDGE_CREDIT_TARGET': 0.5,
+    'HEDGE_CREDIT_TOLERANCE': 0.05,
+    'SHORT_DTE': 90,
+    'HEDGE_DTE': 7,
+    'RISK_FREE_RATE': 0.05,
+    'DIVIDEND_YIELD': 0.013,
+    'COMBO_ORDER': True,
+    'STOPLOSS': 2,
+    'TAKEPROFIT': 0.5,
+}
+
+
+class dayQuotes:
+    """quotes of one snapshot day, expirations are loaded from the source on first use"""
+    def __init__(self, source, date: str):
+        self.source = source
+        self.date = date
+        self.frames = dict()  # expiry: DataFrame
+        self.quotes = dict()  # conId: (bid, ask)
+
+    def frame(self, expiry: str) -> pd.DataFrame:
+        if expiry not in self.frames:
+            df = self.source.chain(self.date, [expiry])
+            self.frames[expiry] = df
+            self.quotes.update(zip(df['conId'].to_numpy(), zip(df['bid'].to_numpy(), df['ask'].to_numpy())))
+        return self.frames[expiry]
+
+    def __call__(self, contract: Contract):
+        expiry = contract.lastTradeDateOrContractMonth
+        if not expiry or expiry < self.date:
+            return None
+        if expiry not in self.frames:
+            self.frame(expiry)
+        return self.quotes.get(contract.conId)
+
+
+class replayEngine:
+    """Replays the strategy over a chain snapshot source (see module docstring)"""
+    def __init__(self, source, params: dict = None, commission = 0.65, multiplier = 100, symbol = 'SPY', logger = None):
+        self.source = source
+        self.params = {**DEFAULT_PARAMS, **(params or {})}
+        self.multiplier = multiplier
+        self.symbol = symbol
+        self.logger = logger
+        self.broker = simBroker(commission = commission)
+        self.positions = positionManager()
+        self.broker.positionEvent += self.positions.apply
+        self.order_book = orderBook(self.broker)
+        self.clock = None
+        self.quotes = None
+        self.entries = []  # dict per day an entry was placed
+        self.skipped = []  # (date, reason)
+        self.equity = []   # dict per day
+
+    def _log(self, message):
+        if self.logger is not None:
+            self.logger.info(message)
+
+    def run(self):
+        dates = self.source.dates()
+        self.clock = simClock(convert_str_date(dates[0]))
+        for date in dates:
+            day = convert_str_date(date).date()
+            self.clock.schedule(self.clock.at(10, 28, day), self.on_entry, date)
+            self.clock.schedule(self.clock.at(16, 0, day), self.on_close, date)
+            self.quotes = dayQuotes(self.source, date)
+            self.clock.advance_to(self.clock.at(23, 59, day))
+        return self
+
+    def option_contract(self, row) -> Option:
+        return Option(self.symbol, row['expiration'], float(row['strike']), row['right'], 'SMART', multiplier = str(self.multiplier),
+                      currency = 'USD', conId = int(row['conId']), localSymbol = row['index'], tradingClass = self.symbol)
+
+    def chain(self, date, expiry):
+        df = self.quotes.frame(expiry)
+        df = df[df['right'] == 'P'].sort_values('strike').reset_index(drop = True)
+        if not df['has_greeks'].all():
+            df = fill_missing_greeks(df, self.source.und_price(date), self.params['RISK_FREE_RATE'], self.params['DIVIDEND_YIELD'], today = date)
+        return df
+
+    def on_entry(self, date):
+        params = self.params
+        self.broker.time = self.clock.now
+        short_expiry, hedge_expiry = expiryResolver(self.source.expirations(date)).resolve([params['SHORT_DTE'], params['HEDGE_DTE']], today = date)
+        short_df = self.chain(date, short_expiry)
+        hedge_df = self.chain(date, hedge_expiry)
+
+        short_put = select_short_put(ChainIndex(short_df), params)
+        if short_put is None:
+            self.skipped.append((date, 'short delta'))
+            return
+        target = hedge_credit_target(short_put, params)
+        long_put = select_long_put(ChainIndex(hedge_df), target, params)
+        if long_put is None:
+            self.skipped.append((date, 'hedge credit'))
+            return
+        short_contract, long_contract = self.broker.qualifyContracts(self.option_contract(short_put), self.option_contract(long_put))
+        # the same order plan as the live strategy (ninetyDTE.place_orders_async)
+        try:
+            plan = entry_orders(self.broker, short_contract, long_contract, short_put, long_put, params, self.positions,
+                                order_book = self.order_book, multiplier = self.multiplier)
+        except bracketOrderException:
+            self.skipped.append((date, 'bracket not resized'))
+            return
+        if not plan['stages']:
+            self.skipped.append((date, 'no credit'))
+            return
+        for stage, contract, orders in plan['stages']:
+            if stage == 'short_put':
+                for order in plan['cancel']:
+                    self.broker.cancelOrder(order)
+            for order in orders:
+                self.broker.placeOrder(contract, order)
+        short_qty, hedge_qty, modify_position = plan['short_qty'], plan['hedge_qty'], plan['modify_position']
+        self.broker.process(self.quotes, self.clock.now)
+        self.entries.append({'date': date, 'short': short_put['index'], 'short_bid': short_put['bid'], 'short_delta': short_put['delta'],
+                             'long': long_put['index'], 'long_ask': long_put['ask'], 'short_qty': short_qty, 'hedge_qty': hedge_qty,
+                             'modify_position': modify_position})
+
+    def on_close(self, date):
+        self.broker.process(self.quotes, self.clock.now)
+        und_price = self.source.und_price(date)
+        self.broker.settle_expired(date, und_price)
+        self.equity.append({'date': date, 'und_price': und_price, 'equity': self.broker.equity(self.quotes),
+                            'realized': self.broker.realized, 'commissions': self.broker.commissions,
+                            'positions': len(self.positions), 'working_orders': len(self.order_book)})
+
+    # results
+    def equity_curve(self) -> pd.DataFrame:
+        return pd.DataFrame(self.equity).set_index('date')
+
+    def entries_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.entries)
+
+    def fills_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.broker.fills)
+
+    def summary(self) -> dict:
+        curve = self.equity_curve()['equity']
+        daily = curve.diff().dropna()
+        drawdown = curve - curve.cummax()
+        return {
+            'days': len(curve),
+            'entries': len(self.entries),
+            'skipped': len(self.skipped),
+            'fills': len(self.broker.fills),
+            'pnl': float(curve.iloc[-1]),
+            'realized': self.broker.realized,
+            'commissions': self.broker.commissions,
+            'max_drawdown': float(drawdown.min()),
+            'daily_pnl_sharpe': float(daily.mean() / daily.std() * 252 ** 0.5) if daily.std() > 0 else float('nan'),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type = int, default = 252 * 5)
+    parser.add_argument('--start', default = '20180102')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--legs', action = 'store_true', help = 'leg by leg orders instead of the combo order')
+    args = parser.parse_args()
+
+    source = syntheticChainSource(start = args.start, days = args.days, seed = args.seed)
+    start = time.perf_counter()
+    engine = replayEngine(source, {'COMBO_ORDER': not args.legs}).run()
+    elapsed = time.perf_counter() - start
+    for k, v in engine.summary().items():
+        print(f"{k:>18}: {v:,.2f}" if isinstance(v, float) else f"{k:>18}: {v}")
+    print(f"replayed {args.days} days in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
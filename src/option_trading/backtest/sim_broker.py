@@ -0,0 +1,230 @@
+import datetime
+import itertools
+from eventkit import Event
+from ib_insync import *
+
+
+class simClient:
+    """the part of ib.client / ib.wrapper the order builders use"""
+    def __init__(self, clientId = 0):
+        self.clientId = clientId
+        self._reqIds = itertools.count(1)
+
+    def getReqId(self) -> int:
+        return next(self._reqIds)
+
+
+class simBroker:
+    """Simulated broker with the IB API subset of the order path (brokerage/orders.py, orderBook and positionManager
+    run on it unchanged). Orders fill against quote snapshots in process(quote), expired options settle at intrinsic value"""
+    def __init__(self, account = 'SIM', commission = 0.65, clientId = 0):
+        self.account = account
+        self.commission = commission # per option contract
+        self.client = self.wrapper = simClient(clientId)
+        self.contracts = dict()      # conId: Contract (legs of combos)
+        self.trades_by_id = dict()   # orderId: Trade
+        self.working = dict()        # orderId: Trade not done yet
+        self.held = dict()           # parent orderId: [orderIds] placed with transmit = False
+        self.position_dict = dict()  # conId: Position
+        self.cash = 0.0
+        self.realized = 0.0
+        self.commissions = 0.0
+        self.fills = []              # fill records (dict)
+        self.time = datetime.datetime.now(datetime.timezone.utc)
+        self.newOrderEvent = Event('newOrderEvent')
+        self.openOrderEvent = Event('openOrderEvent')
+        self.orderStatusEvent = Event('orderStatusEvent')
+        self.execDetailsEvent = Event('execDetailsEvent')
+        self.positionEvent = Event('positionEvent')
+
+    # IB API subset
+    def placeOrder(self, contract: Contract, order: Order) -> Trade:
+        if not order.orderId:
+            order.orderId = self.client.getReqId()
+        order.clientId = self.client.clientId
+        if contract.secType != 'BAG':
+            self.contracts[contract.conId] = contract
+        trade = self.trades_by_id.get(order.orderId)
+        if trade is not None:
+            # modification of a working order
+            trade.order = order
+            trade.orderStatus.remaining = order.totalQuantity - trade.orderStatus.filled
+            self.openOrderEvent.emit(trade)
+            return trade
+        trade = Trade(contract, order, OrderStatus(orderId = order.orderId, status = 'PendingSubmit', remaining = order.totalQuantity),
+                      [], [TradeLogEntry(self.time, 'PendingSubmit')])
+        self.trades_by_id[order.orderId] = trade
+        self.working[order.orderId] = trade
+        self.newOrderEvent.emit(trade)
+        if not order.transmit:
+            self.held.setdefault(order.parentId or order.orderId, []).append(order.orderId)
+            return trade
+        for orderId in self.held.pop(order.parentId or order.orderId, []) + [order.orderId]:
+            self._set_status(self.trades_by_id[orderId], 'Submitted')
+        return trade
+
+    def qualifyContracts(self, *contracts: Contract) -> list[Contract]:
+        """contracts must already carry their conId, they are registered so combo legs can be priced"""
+        for contract in contracts:
+            self.contracts[contract.conId] = contract
+        return list(contracts)
+
+    def cancelOrder(self, order: Order):
+        trade = self.trades_by_id.get(order.orderId)
+        if trade is not None and not trade.isDone():
+            self._set_status(trade, 'Cancelled')
+        return trade
+
+    def positions(self) -> list[Position]:
+        return list(self.position_dict.values())
+
+    def trades(self) -> list[Trade]:
+        return list(self.trades_by_id.values())
+
+    def openTrades(self) -> list[Trade]:
+        return list(self.working.values())
+
+    # matching
+    def _set_status(self, trade: Trade, status, message = ''):
+        trade.orderStatus.status = status
+        trade.log.append(TradeLogEntry(self.time, status, message))
+        if trade.isDone():
+            self.working.pop(trade.order.orderId, None)
+        if status == 'Submitted':
+            self.openOrderEvent.emit(trade)
+        self.orderStatusEvent.emit(trade)
+        trade.statusEvent.emit(trade)
+        if status == 'Cancelled':
+            trade.cancelledEvent.emit(trade)
+
+    def _legs(self, contract: Contract):
+        """(leg contract, signed ratio) with +1 for the BUY side of the order"""
+        if contract.secType != 'BAG':
+            return [(contract, 1)]
+        return [(self.contracts[leg.conId], leg.ratio if leg.action == 'BUY' else -leg.ratio) for leg in contract.comboLegs]
+
+    def _quote(self, contract, quote):
+        """(bid, ask, leg fill prices for BUY, leg fill prices for SELL) or None if any leg has no quote"""
+        legs = self._legs(contract)
+        quotes = [quote(leg) for leg, _ in legs]
+        if any(q is None for q in quotes):
+            return None
+        bid = sum(r * (b if r > 0 else a) for (_, r), (b, a) in zip(legs, quotes))
+        ask = sum(r * (a if r > 0 else b) for (_, r), (b, a) in zip(legs, quotes))
+        buy_prices = [a if r > 0 else b for (_, r), (b, a) in zip(legs, quotes)]
+        sell_prices = [b if r > 0 else a for (_, r), (b, a) in zip(legs, quotes)]
+        return bid, ask, buy_prices, sell_prices
+
+    def _match(self, order: Order, bid, ask):
+        """fill price of the order against bid/ask, None if it does not fill"""
+        buy = order.action == 'BUY'
+        if order.orderType == 'MKT':
+            return ask if buy else bid
+        if order.orderType == 'LMT':
+            if buy:
+                return ask if ask <= order.lmtPrice else (order.lmtPrice if bid <= order.lmtPrice else None)
+            return bid if bid >= order.lmtPrice else (order.lmtPrice if ask >= order.lmtPrice else None)
+        if order.orderType == 'STP':
+            if buy:
+                return ask if ask >= order.auxPrice else None
+            return bid if bid <= order.auxPrice else None
+        return None
+
+    def process(self, quote, time: datetime.datetime = None):
+        """match working orders against quote(contract) -> (bid, ask) or None"""
+        if time is not None:
+            self.time = time
+        for trade in list(self.working.values()):
+            if trade.orderStatus.status != 'Submitted':
+                continue
+            parent = self.trades_by_id.get(trade.order.parentId)
+            if parent is not None and parent.orderStatus.status != 'Filled':
+                if parent.isDone():
+                    self._set_status(trade, 'Cancelled', 'parent not filled')
+                continue
+            q = self._quote(trade.contract, quote)
+            if q is None:
+                continue
+            bid, ask, buy_prices, sell_prices = q
+            price = self._match(trade.order, bid, ask)
+            if price is None:
+                continue
+            leg_prices = buy_prices if trade.order.action == 'BUY' else sell_prices
+            if trade.contract.secType == 'BAG' and (price - (ask if trade.order.action == 'BUY' else bid)) != 0:
+                # filled at the limit inside the spread, give the improvement to the first leg
+                leg_prices = list(leg_prices)
+                first_ratio = self._legs(trade.contract)[0][1]
+                leg_prices[0] += (price - (ask if trade.order.action == 'BUY' else bid)) / first_ratio
+            self._fill(trade, price, leg_prices)
+
+    def _fill(self, trade: Trade, price, leg_prices):
+        order = trade.order
+        qty = order.totalQuantity - trade.orderStatus.filled
+        side = 1 if order.action == 'BUY' else -1
+        for (leg, ratio), leg_price in zip(self._legs(trade.contract), leg_prices):
+            self._update_position(leg, side * ratio * qty, leg_price, order.orderId)
+        trade.orderStatus.filled = order.totalQuantity
+        trade.orderStatus.remaining = 0.0
+        trade.orderStatus.avgFillPrice = price
+        trade.orderStatus.lastFillPrice = price
+        execution = Execution(execId = f"sim.{order.orderId}", time = self.time, acctNumber = self.account,
+                              side = 'BOT' if side > 0 else 'SLD', shares = qty, price = price,
+                              orderId = order.orderId, clientId = order.clientId, cumQty = qty, avgPrice = price)
+        fill = Fill(trade.contract, execution, CommissionReport(), self.time)
+        trade.fills.append(fill)
+        self.execDetailsEvent.emit(trade, fill)
+        self._set_status(trade, 'Filled')
+        trade.filledEvent.emit(trade)
+        # bracket children are one cancels all
+        if order.parentId:
+            for sibling in list(self.working.values()):
+                if sibling.order.parentId == order.parentId and sibling is not trade:
+                    self._set_status(sibling, 'Cancelled', 'oca')
+
+    def _update_position(self, contract: Contract, qty, price, orderId = 0, reason = 'fill'):
+        multiplier = float(contract.multiplier or 1)
+        fee = self.commission * abs(qty) if reason == 'fill' else 0.0
+        self.cash -= qty * price * multiplier + fee
+        self.commissions += fee
+        current = self.position_dict.get(contract.conId)
+        pos, avg_cost = (current.position, current.avgCost) if current else (0.0, 0.0)
+        new_pos = pos + qty
+        realized = 0.0
+        if pos != 0 and (pos > 0) != (qty > 0):
+            # closing (part of) the position
+            closed = min(abs(qty), abs(pos)) * (1 if pos > 0 else -1)
+            realized = closed * (price * multiplier - avg_cost)
+            self.realized += realized
+            if abs(qty) > abs(pos): # flipped
+                avg_cost = price * multiplier
+        elif new_pos != 0:
+            avg_cost = (pos * avg_cost + qty * price * multiplier) / new_pos
+        position = Position(self.account, contract, new_pos, avg_cost if new_pos else 0.0)
+        if new_pos == 0:
+            self.position_dict.pop(contract.conId, None)
+        else:
+            self.position_dict[contract.conId] = position
+        self.fills.append({'time': self.time, 'orderId': orderId, 'localSymbol': contract.localSymbol, 'conId': contract.conId,
+                           'qty': qty, 'price': price, 'realized': realized, 'reason': reason})
+        self.positionEvent.emit(position)
+
+    def settle_expired(self, today: str, und_price: float):
+        """close options expiring on or before today at intrinsic value and cancel their orders"""
+        for position in list(self.position_dict.values()):
+            contract = position.contract
+            if contract.secType != 'OPT' or contract.lastTradeDateOrContractMonth > today:
+                continue
+            intrinsic = max(contract.strike - und_price, 0.0) if contract.right == 'P' else max(und_price - contract.strike, 0.0)
+            self._update_position(contract, -position.position, intrinsic, reason = 'expiry')
+        for trade in self.openTrades():
+            if any(leg.secType == 'OPT' and leg.lastTradeDateOrContractMonth <= today for leg, _ in self._legs(trade.contract)):
+                self._set_status(trade, 'Cancelled', 'expired')
+
+    def equity(self, quote) -> float:
+        """cash + positions marked at mid (at the last fill price if there is no quote)"""
+        value = self.cash
+        for position in self.position_dict.values():
+            q = quote(position.contract)
+            mid = 0.5 * (q[0] + q[1]) if q is not None else position.avgCost / float(position.contract.multiplier or 1)
+            value += position.position * mid * float(position.contract.multiplier or 1)
+        return value
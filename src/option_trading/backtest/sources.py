@@ -0,0 +1,138 @@
+"""Chain snapshot sources for the replay engine
+
+A source provides, for each replayed day:
+    dates() -> list[str]                              yyyymmdd trading days
+    expirations(date) -> list[str]                    listed expirations on that day
+    chain(date, expirations) -> pd.DataFrame          chain snapshot (CHAIN_COLUMNS) of those expirations
+                                                      (recorded chains also carry greeks_source)
+    und_price(date) -> float
+"""
+import numpy as np
+import pandas as pd
+from utils.option_utils import CHAIN_COLUMNS
+from utils.greeks import bs_price, bs_greeks, year_fraction
+from services.chain_recorder import chainStore, RECORDED_COLUMNS
+
+
+def option_conId(expiry: str, strike: float, right: str) -> int:
+    """deterministic conId of a synthetic option (same contract -> same conId on every day)"""
+    return int(expiry) * 10**9 + int(round(strike * 1000)) * 10 + (1 if right == 'C' else 0)
+
+def occ_local_symbol(symbol: str, expiry: str, right: str, strike: float) -> str:
+    """OCC style localSymbol e.g. 'SPY   240119P00400000'"""
+    return f"{symbol:<6}{expiry[2:]}{right}{int(round(strike * 1000)):08d}"
+
+def synthetic_chain(spot: float, expirations: list[str], strikes, today: str, rights = ('P',), vol = 0.2, rate = 0.0,
+                    dividend = 0.0, skew = 0.0, spread = 0.02, symbol = 'SPY') -> pd.DataFrame:
+    """Chain snapshot (CHAIN_COLUMNS) of every expiration x right x strike, priced with utils.greeks Black-Scholes
+    on a flat vol with a log-moneyness skew. Shared by the replay source and the benchmark markets"""
+    expirations, rights, strikes = list(expirations), list(rights), np.asarray(strikes, dtype = float)
+    # expiration x right x strike, strikes vary fastest
+    per_expiry = len(rights) * len(strikes)
+    K = np.tile(strikes, len(expirations) * len(rights))
+    expiration = np.repeat(np.array(expirations, dtype = object), per_expiry)
+    right = np.tile(np.repeat(np.array(rights, dtype = object), len(strikes)), len(expirations))
+    T = np.repeat(year_fraction(expirations, today), per_expiry)
+    is_call = right == 'C'
+    iv = np.maximum(vol + skew * np.log(K / spot), 0.05)
+    price = bs_price(spot, K, T, rate, dividend, iv, is_call)
+    greeks = bs_greeks(spot, K, T, rate, dividend, iv, is_call)
+    half_spread = np.maximum(price * spread / 2, 0.01)
+    # option_conId and occ_local_symbol, formatted once per strike
+    milli = np.rint(strikes * 1000).astype(np.int64)
+    conId = np.repeat(np.array([int(e) for e in expirations], dtype = np.int64), per_expiry) * 10**9 + np.tile(milli, len(expirations) * len(rights)) * 10 + is_call
+    codes = [f"{m:08d}" for m in milli.tolist()]
+    columns = {
+        'index': [f"{symbol:<6}{e[2:]}{r}{code}" for e in expirations for r in rights for code in codes],
+        'conId': conId,
+        'strike': K,
+        'right': right,
+        'expiration': expiration,
+        'bid': np.maximum(np.round(price - half_spread, 2), 0.0),
+        'ask': np.round(price + half_spread, 2),
+        'bid_size': 10.0,
+        'ask_size': 10.0,
+        'volume': np.nan,
+        'IV': iv,
+        **greeks,
+        'undprice': spot,
+        'has_greeks': True,
+    }
+    return pd.DataFrame({c: columns[c] for c in CHAIN_COLUMNS})
+
+
+class syntheticChainSource:
+    """Daily chains of a geometric brownian motion underlying priced with Black-Scholes (weekly expirations, skewed flat vol)"""
+    def __init__(self, start = '20180102', days = 252 * 5, spot = 270.0, vol = 0.18, drift = 0.07, rate = 0.03,
+                 dividend = 0.013, skew = -0.15, spread = 0.02, strike_step = 1.0, strike_range = 0.4,
+                 max_dte = 400, symbol = 'SPY', seed = 0):
+        self.vol, self.rate, self.dividend, self.skew = vol, rate, dividend, skew
+        self.spread, self.strike_step, self.strike_range = spread, strike_step, strike_range
+        self.max_dte, self.symbol = max_dte, symbol
+        days_index = pd.bdate_range(pd.Timestamp(start), periods = days)
+        rng = np.random.default_rng(seed)
+        dt = 1 / 252
+        returns = (drift - dividend - 0.5 * vol ** 2) * dt + vol * np.sqrt(dt) * rng.standard_normal(days)
+        returns[0] = 0.0
+        self.prices = dict(zip(days_index.strftime("%Y%m%d"), spot * np.exp(np.cumsum(returns))))
+
+    def dates(self) -> list[str]:
+        return list(self.prices)
+
+    def und_price(self, date: str) -> float:
+        return float(self.prices[date])
+
+    def expirations(self, date: str) -> list[str]:
+        today = pd.Timestamp(date)
+        fridays = pd.date_range(today, today + pd.Timedelta(days = self.max_dte), freq = 'W-FRI')
+        return list(fridays.strftime("%Y%m%d"))
+
+    def chain(self, date: str, expirations: list[str], rights = ('P',)) -> pd.DataFrame:
+        spot = self.und_price(date)
+        strikes = np.arange(np.ceil(spot * (1 - self.strike_range)), np.floor(spot * (1 + self.strike_range)) + self.strike_step, self.strike_step)
+        return synthetic_chain(spot, expirations, strikes, date, rights = rights, vol = self.vol, rate = self.rate,
+                               dividend = self.dividend, skew = self.skew, spread = self.spread, symbol = self.symbol)
+
+
+class frameSource:
+    """Source over already loaded chain snapshots {date: DataFrame of all expirations}"""
+    def __init__(self, frames: dict):
+        self.frames = dict(sorted(frames.items()))
+
+    def dates(self) -> list[str]:
+        return list(self.frames)
+
+    def und_price(self, date: str) -> float:
+        return float(self.frames[date]['undprice'].median())
+
+    def expirations(self, date: str) -> list[str]:
+        return sorted(self.frames[date]['expiration'].unique())
+
+    def chain(self, date: str, expirations: list[str]) -> pd.DataFrame:
+        df = self.frames[date]
+        return df[df['expiration'].isin(expirations)].reset_index(drop = True)
+
+
+class recordedChainSource:
+    """Source over the snapshots recorded by the live strategy, the last snapshot of each expiration on a day"""
+    def __init__(self, root: str, label = None, start = None, end = None):
+        self.store = chainStore(root)
+        self.latest = dict() # date: {expiry: index entry}
+        for entry in self.store.entries(start = start, end = end, label = label):
+            day = self.latest.setdefault(entry['date'], dict())
+            if entry['expiry'] not in day or entry['time'] >= day[entry['expiry']]['time']:
+                day[entry['expiry']] = entry
+
+    def dates(self) -> list[str]:
+        return sorted(self.latest)
+
+    def und_price(self, date: str) -> float:
+        prices = [e['und_price'] for e in self.latest[date].values() if e['und_price'] is not None]
+        return float(np.median(prices)) if prices else float('nan')
+
+    def expirations(self, date: str) -> list[str]:
+        return sorted(self.latest[date])
+
+    def chain(self, date: str, expirations: list[str]) -> pd.DataFrame:
+        entries = [self.latest[date][e] for e in expirations if e in self.latest[date]]
+        return self.store.frame(entries = entries)[RECORDED_COLUMNS]
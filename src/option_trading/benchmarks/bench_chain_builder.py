@@ -0,0 +1,73 @@
+"""Benchmark: columnar chain builder vs the previous dict-of-dicts implementation
+
+Run from src/option_trading:
+    python -m benchmarks.bench_chain_builder --strikes 300 1000 5000
+"""
+import argparse
+import timeit
+import pandas as pd
+from ib_insync import *
+from utils.option_utils import convert_tickers_to_full_chain
+from benchmarks.synthetic import synthetic_put_tickers
+
+
+def legacy_convert_tickers_to_full_chain(tickers: list[Ticker]):
+    """previous implementation (nested dict -> object dtype frame) kept for comparison"""
+    full_chain = {}
+    for ticker in tickers:
+        if ticker.contract.localSymbol not in full_chain:
+            full_chain[ticker.contract.localSymbol] = {}
+            full_chain[ticker.contract.localSymbol]['strike'] = ticker.contract.strike
+            full_chain[ticker.contract.localSymbol]['right'] = ticker.contract.right
+            full_chain[ticker.contract.localSymbol]['expiration'] = ticker.contract.lastTradeDateOrContractMonth
+            full_chain[ticker.contract.localSymbol]['bid'] = ticker.bid
+            full_chain[ticker.contract.localSymbol]['ask'] = ticker.ask
+            full_chain[ticker.contract.localSymbol]['bid_size'] = ticker.bidSize
+            full_chain[ticker.contract.localSymbol]['ask_size'] = ticker.askSize
+            full_chain[ticker.contract.localSymbol]['volume'] = ticker.volume
+            full_chain[ticker.contract.localSymbol]['IV'] = ticker.modelGreeks.impliedVol
+            full_chain[ticker.contract.localSymbol]['delta'] = ticker.modelGreeks.delta
+            full_chain[ticker.contract.localSymbol]['gamma'] = ticker.modelGreeks.gamma
+            full_chain[ticker.contract.localSymbol]['vega'] = ticker.modelGreeks.vega
+            full_chain[ticker.contract.localSymbol]['theta'] = ticker.modelGreeks.theta
+            full_chain[ticker.contract.localSymbol]['undprice'] = ticker.modelGreeks.undPrice
+    return pd.DataFrame(full_chain).T.reset_index()
+
+
+def best_of(fn, repeat = 5):
+    """best wall time (seconds) of a single call"""
+    number = 3
+    return min(timeit.repeat(fn, number = number, repeat = repeat)) / number
+
+
+def run(strikes):
+    rows = []
+    for n in strikes:
+        tickers = synthetic_put_tickers(n_strikes = n)
+        legacy_df = legacy_convert_tickers_to_full_chain(tickers)
+        columnar_df = convert_tickers_to_full_chain(tickers)
+        # downstream hot path: sort by strike + delta lookup
+        legacy_select = lambda: legacy_df.sort_values('strike').reset_index(drop = True)['delta'].sub(-0.15).abs().argsort()
+        columnar_select = lambda: columnar_df.sort_values('strike').reset_index(drop = True)['delta'].sub(-0.15).abs().argsort()
+        rows.append({
+            'strikes': n,
+            'legacy_build_ms': best_of(lambda: legacy_convert_tickers_to_full_chain(tickers)) * 1e3,
+            'columnar_build_ms': best_of(lambda: convert_tickers_to_full_chain(tickers)) * 1e3,
+            'legacy_select_ms': best_of(legacy_select) * 1e3,
+            'columnar_select_ms': best_of(columnar_select) * 1e3,
+            'legacy_mem_kb': legacy_df.memory_usage(deep = True).sum() / 1024,
+            'columnar_mem_kb': columnar_df.memory_usage(deep = True).sum() / 1024,
+        })
+    result = pd.DataFrame(rows).set_index('strikes')
+    result['build_speedup'] = result['legacy_build_ms'] / result['columnar_build_ms']
+    result['select_speedup'] = result['legacy_select_ms'] / result['columnar_select_ms']
+    result['mem_ratio'] = result['legacy_mem_kb'] / result['columnar_mem_kb']
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--strikes', type = int, nargs = '+', default = [300, 1000, 5000])
+    args = parser.parse_args()
+    with pd.option_context('display.float_format', '{:.2f}'.format, 'display.width', 250, 'display.max_columns', None):
+        print(run(args.strikes))
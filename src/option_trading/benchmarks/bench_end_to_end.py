@@ -0,0 +1,190 @@
+"""Benchmark: end to end ninetyDTE run_strategy against the local fake IB gateway
+
+Drives the real strategy (contracts, underlying price, both option chains, leg selection,
+order placement until Submitted) against benchmarks/fake_ib.py with configurable per-request
+latency and error injection, and reports per-stage timings and IB request counts.
+
+Run from src/option_trading:
+    python -m benchmarks.bench_end_to_end --runs 5
+    python -m benchmarks.bench_end_to_end --latency-scale 2 --missing-greeks 0.05 --legs
+    python -m benchmarks.bench_end_to_end --runs 1 --metrics /tmp/90dte.prom --profile /tmp/profiles
+    python -m benchmarks.bench_end_to_end --strategies 4   # strategy_runner.py, 4 strategies on one connection
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from collections import defaultdict
+from ib_insync import *
+from ninety_dte_strategy import ninetyDTE
+from strategy_runner import strategyRunner
+from services.alerts import alertsManager
+from services.logging_service import loggerService
+from services.metrics import metrics
+from benchmarks.fake_ib import fakeIB, fakeMarket, DEFAULT_LATENCY
+
+BENCH_PARAMS = {
+    'STRATEGY_NAME': "90DTE",
+    'HEDGE_RATIO': 2,
+    'DAILY_PREMIUM': 500,
+    'SHORT_DELTA_TARGET': -0.15,
+    'SHORT_DELTA_TOLERANCE': 0.03,
+    'HEDGE_CREDIT_TARGET': 0.5,
+    'HEDGE_CREDIT_TOLERANCE': 0.1,
+    'SHORT_DTE': 90,
+    'HEDGE_DTE': 7,
+    'RISK_FREE_RATE': 0.05,
+    'DIVIDEND_YIELD': 0.0,
+    'IV_ESTIMATE': 0.2,
+    'COMBO_ORDER': True,
+    'STOPLOSS': 2,
+    'TAKEPROFIT': 0.5,
+}
+
+
+class memoryCollection:
+    """collection stand-in for the strategy's write-behind trade journal"""
+    def __init__(self):
+        self.documents = []
+
+    def insert_one(self, document):
+        self.documents.append(document)
+
+    def insert_many(self, documents, ordered = True):
+        self.documents.extend(documents)
+
+
+class memoryDB(dict):
+    def __missing__(self, name):
+        self[name] = memoryCollection()
+        return self[name]
+
+
+class stageTimer:
+    """wall time of instance coroutine methods, keyed by stage name"""
+    def __init__(self):
+        self.timings = defaultdict(list) # stage: [seconds]
+
+    def wrap(self, obj, method, stage = None):
+        """stage is a name or a function of the call arguments returning one"""
+        fn = getattr(obj, method)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                name = stage(*args, **kwargs) if callable(stage) else (stage or method)
+                self.timings[name].append(time.perf_counter() - start)
+        setattr(obj, method, timed)
+
+    def add(self, stage, seconds):
+        self.timings[stage].append(seconds)
+
+
+def chain_stage(contracts, column, *args, **kwargs):
+    return 'short_chain' if column == 'delta' else 'hedge_chain'
+
+
+def strategy_params(params: dict, n: int) -> list[dict]:
+    """n strategies on the same underlying with staggered short delta targets (overlapping chains)"""
+    return [{**params, 'STRATEGY_NAME': f"{params['STRATEGY_NAME']}-{i}", 'SHORT_DELTA_TARGET': params['SHORT_DELTA_TARGET'] - 0.01 * i}
+            for i in range(n)]
+
+
+def run_once(timer: stageTimer, latency: dict, errors: dict, params: dict, seed = 0, metrics_file = None, profile_dir = None,
+             strategies = 1) -> dict:
+    """one strategy run (or strategies runs on one connection) on a fresh fake gateway,
+    returns IB request counts and order states"""
+    ib = fakeIB(fakeMarket(), latency = latency, errors = errors, seed = seed)
+    services = {'db': memoryDB(), 'logger': loggerService(name = 'bench_end_to_end'), 'alerts': alertsManager([])}
+    auth_config = {'TWS_HOST': '127.0.0.1', 'TWS_PORT': 7497}
+    start = time.perf_counter()
+    if strategies == 1:
+        runner = app = ninetyDTE(auth_config, services, params, ib = ib)
+        apps, run = [app], app.run_strategy
+    else:
+        runner = strategyRunner(auth_config, services, strategy_params(params, strategies), ib = ib)
+        apps, run = runner.strategies, runner.run_strategies
+        timer.wrap(runner, 'gather_async', 'run_strategies')
+    timer.add('init', time.perf_counter() - start)
+
+    for app in apps:
+        timer.wrap(app, 'get_all_contracts_async', 'contracts')
+        timer.wrap(app, 'get_underlying_price_async', 'und_price')
+        timer.wrap(app, 'get_bracketed_chain_async', chain_stage)
+        timer.wrap(app, 'place_orders_async', 'orders_submitted')
+        timer.wrap(app, 'run_strategy_async', 'run_strategy')
+    runner.metrics_file = metrics_file
+    runner.profile_dir = profile_dir
+    run()
+    util.run(asyncio.sleep(latency.get('fill', DEFAULT_LATENCY['fill']) * 2 + 0.1)) # let marketable orders fill
+    session = apps[0].session
+    result = {
+        'requests': dict(ib.client.request_counts),
+        'market_data': dict(session.market_data.stats),
+        'orders': [(t.order.orderRef, t.contract.localSymbol or t.contract.secType, t.order.action, t.order.orderType, t.orderStatus.status)
+                   for t in ib.trades()],
+        'positions': len(ib.positions()),
+    }
+    apps[0].chain_recorder.close()
+    apps[0].db_trades.close()
+    session.stop()
+    return result
+
+
+def summarize(timings: dict) -> list[dict]:
+    rows = []
+    for stage, values in timings.items():
+        rows.append({'stage': stage, 'n': len(values), 'p50_ms': statistics.median(values) * 1e3,
+                     'max_ms': max(values) * 1e3, 'min_ms': min(values) * 1e3})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type = int, default = 3)
+    parser.add_argument('--latency-scale', type = float, default = 1.0, help = 'multiply every fake request latency')
+    parser.add_argument('--missing-greeks', type = float, default = 0.0, help = 'probability a ticker never gets greeks')
+    parser.add_argument('--missing-quote', type = float, default = 0.0, help = 'probability a ticker never gets bid/ask')
+    parser.add_argument('--contract-errors', type = float, default = 0.0, help = 'probability a contract details request fails')
+    parser.add_argument('--legs', action = 'store_true', help = 'leg by leg orders instead of the combo order')
+    parser.add_argument('--strategies', type = int, default = 1, help = 'strategies sharing one connection (strategy_runner.py)')
+    parser.add_argument('--workdir', default = None, help = 'cwd of the strategy (.cache), a fresh temp dir by default')
+    parser.add_argument('--json', default = None, help = 'write the stage summary to this file')
+    parser.add_argument('--metrics', default = None, help = 'enable services/metrics.py and write the prometheus text file here')
+    parser.add_argument('--profile', default = None, help = 'write a sampled flame graph (folded stacks) of each run to this directory')
+    args = parser.parse_args()
+
+    latency = {k: v * args.latency_scale for k, v in DEFAULT_LATENCY.items()}
+    errors = {'missing_greeks': args.missing_greeks, 'missing_quote': args.missing_quote, 'contractDetails': args.contract_errors}
+    params = {**BENCH_PARAMS, 'COMBO_ORDER': not args.legs}
+    json_path = os.path.abspath(args.json) if args.json else None
+    metrics_file = os.path.abspath(args.metrics) if args.metrics else None
+    profile_dir = os.path.abspath(args.profile) if args.profile else None
+    if metrics_file:
+        metrics.enable()
+    # contract cache, chain history and journals go under .cache of the working directory
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix = 'bench_e2e_'))
+
+    timer = stageTimer()
+    for i in range(args.runs):
+        result = run_once(timer, latency, errors, params, seed = i, metrics_file = metrics_file, profile_dir = profile_dir,
+                          strategies = args.strategies)
+        print(f"run {i}: requests {result['requests']} market data {result['market_data']} positions {result['positions']}")
+        for order in result['orders']:
+            print(f"    {order}")
+
+    rows = summarize(timer.timings)
+    print(f"{'stage':<18}{'n':>4}{'p50_ms':>10}{'min_ms':>10}{'max_ms':>10}")
+    for row in rows:
+        print(f"{row['stage']:<18}{row['n']:>4}{row['p50_ms']:>10.1f}{row['min_ms']:>10.1f}{row['max_ms']:>10.1f}")
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(rows, f, indent = 2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Benchmark: telegram alert enqueue latency and throughput against a local stub Bot API
+
+The stub answers sendMessage after --delay seconds and replies 429 (retry_after) once every
+--rate-limit-every requests, so coalescing and rate limit handling are exercised without network.
+
+Run from src/option_trading:
+    python -m benchmarks.bench_telegram --alerts 200 --delay 0.15
+"""
+import json
+import time
+import argparse
+import threading
+import statistics
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from services.telegram_service import telegram
+
+
+class stubBotAPI(ThreadingHTTPServer):
+    """local sendMessage endpoint recording every received message"""
+    daemon_threads = True
+
+    def __init__(self, delay = 0.15, rate_limit_every = 0, retry_after = 1):
+        super().__init__(('127.0.0.1', 0), stubHandler)
+        self.delay = delay
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.received = [] # message texts
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target = self.serve_forever, daemon = True).start()
+        return self
+
+
+class stubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, so connection reuse is measured
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.requests += 1
+            limited = self.server.rate_limit_every and self.server.requests % self.server.rate_limit_every == 0
+            if not limited:
+                self.server.received.append(body['text'])
+        if limited:
+            self.reply(429, {'ok': False, 'error_code': 429, 'parameters': {'retry_after': self.server.retry_after}})
+        else:
+            self.reply(200, {'ok': True, 'result': {}})
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def bench_blocking(server, n):
+    """previous implementation: one requests.post per alert on the caller's thread"""
+    url = f"{server.api_url}/botTOKEN/sendMessage"
+    latencies = []
+    for i in range(n):
+        t = time.perf_counter()
+        requests.post(url, json = {'chat_id': '1', 'parse_mode': 'markdown', 'disable_notification': False, 'text': f"alert {i}"})
+        latencies.append(time.perf_counter() - t)
+    return latencies
+
+
+def bench_queued(server, n, coalesce_window, min_interval):
+    tlg = telegram('1', 'TOKEN', api_url = server.api_url, coalesce_window = coalesce_window, min_interval = min_interval)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(n):
+        t = time.perf_counter()
+        tlg.info(f"alert {i}")
+        latencies.append(time.perf_counter() - t)
+    tlg.flush(timeout = 120)
+    delivered = time.perf_counter() - start
+    tlg.close()
+    return latencies, delivered, tlg.stats
+
+
+def summary(name, latencies, total):
+    return {
+        'impl': name,
+        'alerts': len(latencies),
+        'enqueue_p50_us': statistics.median(latencies) * 1e6,
+        'enqueue_p99_us': percentile(latencies, 0.99) * 1e6,
+        'caller_blocked_s': sum(latencies),
+        'all_delivered_s': total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--alerts', type = int, default = 200)
+    parser.add_argument('--delay', type = float, default = 0.15, help = 'stub server response time (s)')
+    parser.add_argument('--coalesce-window', type = float, default = 0.5)
+    parser.add_argument('--min-interval', type = float, default = 1.0)
+    parser.add_argument('--rate-limit-every', type = int, default = 3, help = 'reply 429 every n requests (0 = never)')
+    parser.add_argument('--skip-blocking', action = 'store_true')
+    args = parser.parse_args()
+
+    rows = []
+    if not args.skip_blocking:
+        server = stubBotAPI(args.delay).start()
+        latencies = bench_blocking(server, args.alerts)
+        rows.append(summary('blocking requests.post', latencies, sum(latencies)))
+        server.shutdown()
+
+    server = stubBotAPI(args.delay, args.rate_limit_every).start()
+    latencies, delivered, stats = bench_queued(server, args.alerts, args.coalesce_window, args.min_interval)
+    rows.append(summary('queued + coalesced', latencies, delivered))
+    server.shutdown()
+    received = sum(len(text.split("\n")) for text in server.received)
+
+    for row in rows:
+        print("  ".join(f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}" for k, v in row.items()))
+    print(f"sender stats: {stats}")
+    print(f"stub received {len(server.received)} requests carrying {received}/{args.alerts} alerts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""Local stand-in for TWS / IB gateway
+
+fakeIB is a drop-in IB whose Client answers requests from a synthetic market instead of a socket.
+Responses are fed through the real ib_insync Wrapper callbacks (contractDetails, tickPrice,
+tickOptionComputation, openOrder, orderStatus, execDetails, position, ...) so Tickers, Trades,
+events and waitOnUpdate behave exactly as with a live connection.
+
+Per-request latency and error injection are configurable:
+    ib = fakeIB(market = fakeMarket(spot = 450),
+                latency = {'mktData': 0.2, 'greeks': 0.5},
+                errors = {'missing_greeks': 0.05, 'contractDetails': 0.0, 'order': 0.0})
+    ib.connect('127.0.0.1', 7497, clientId = 0)
+"""
+import random
+import asyncio
+import datetime
+import itertools
+import numpy as np
+from ib_insync import *
+from ib_insync.client import Client
+from backtest.sources import option_conId, occ_local_symbol, synthetic_chain
+
+DEFAULT_LATENCY = {
+    'default': 0.005,       # bookkeeping requests (positions, open orders, ...)
+    'contractDetails': 0.05,
+    'secDefOptParams': 0.05,
+    'mktData': 0.05,        # first bid/ask
+    'greeks': 0.1,          # model greeks after bid/ask
+    'order': 0.02,          # order acknowledgement
+    'fill': 0.05,           # market order fill after acknowledgement
+}
+
+DEFAULT_ERRORS = {
+    'contractDetails': 0.0, # request fails (error 200)
+    'missing_greeks': 0.0,  # ticker never gets modelGreeks
+    'missing_quote': 0.0,   # ticker never gets bid/ask
+    'order': 0.0,           # order rejected (error 201)
+}
+
+
+class fakeMarket:
+    """Synthetic underlying with a flat vol surface, weekly expirations and a strike grid"""
+    def __init__(self, symbol = 'SPY', spot = 450.0, vol = 0.2, rate = 0.05, dividend = 0.0,
+                 dtes = (0, 1, 2, 7, 14, 30, 60, 90, 120, 180, 270, 365), strike_step = 1.0,
+                 strike_range = 0.5, today: datetime.date = None, liquid_hours = None):
+        self.symbol = symbol
+        self.spot = spot
+        self.vol = vol
+        self.rate = rate
+        self.dividend = dividend
+        self.today = today or datetime.date.today()
+        self.expirations = sorted({(self.today + datetime.timedelta(days = d)).strftime("%Y%m%d") for d in dtes})
+        lo, hi = spot * (1 - strike_range), spot * (1 + strike_range)
+        self.strikes = [float(k) for k in np.arange(np.ceil(lo), np.floor(hi) + strike_step, strike_step)]
+        self.underlying = Stock(symbol, 'SMART', 'USD', primaryExchange = 'ARCA', conId = 1, localSymbol = symbol, tradingClass = symbol)
+        self.liquid_hours = liquid_hours or f"{self.today.strftime('%Y%m%d')}:0930-{self.today.strftime('%Y%m%d')}:1600"
+        self._options = dict() # (expiry, strike, right): Option
+        self._quotes = dict()  # conId: (bid, ask, OptionComputation), priced per expiration
+
+    def option(self, expiry, strike, right) -> Option:
+        key = (expiry, float(strike), right)
+        if key not in self._options:
+            self._options[key] = Option(self.symbol, expiry, float(strike), right, 'SMART', multiplier = '100',
+                                        currency = 'USD', conId = option_conId(expiry, strike, right),
+                                        localSymbol = occ_local_symbol(self.symbol, expiry, right, strike),
+                                        tradingClass = self.symbol)
+        return self._options[key]
+
+    def option_contracts(self, expiry = '', right = '', strike = 0.0) -> list[Option]:
+        """all options matching the (partially specified) request"""
+        expiries = [e for e in self.expirations if not expiry or e == expiry]
+        rights = [right] if right else ['P', 'C']
+        strikes = [k for k in self.strikes if not strike or k == strike]
+        return [self.option(e, k, r) for e in expiries for r in rights for k in strikes]
+
+    def by_conId(self, conId) -> Contract:
+        """conIds are deterministic (see option_conId), so contracts cached by an earlier fake market resolve too"""
+        if conId == self.underlying.conId:
+            return self.underlying
+        expiry, rest = divmod(conId, 10**9)
+        if str(expiry) not in self.expirations:
+            return None
+        return self.option(str(expiry), rest // 10 / 1000, 'C' if rest % 10 else 'P')
+
+    def quote(self, contract: Contract):
+        """bid, ask and model greeks (OptionComputation or None for the underlying)"""
+        if contract.secType != 'OPT':
+            return self.spot - 0.01, self.spot + 0.01, None
+        conId = option_conId(contract.lastTradeDateOrContractMonth, contract.strike, contract.right)
+        if conId not in self._quotes:
+            self._price_expiry(contract.lastTradeDateOrContractMonth, [contract.strike])
+        return self._quotes[conId]
+
+    def _price_expiry(self, expiry, strikes = ()):
+        """quote the whole strike grid of an expiration at once (plus off-grid strikes asked for)"""
+        strikes = sorted(set(self.strikes) | {float(k) for k in strikes})
+        df = synthetic_chain(self.spot, [expiry], strikes, self.today.strftime("%Y%m%d"), rights = ('P', 'C'),
+                             vol = self.vol, rate = self.rate, dividend = self.dividend, symbol = self.symbol)
+        mid = (df['bid'] + df['ask']) / 2
+        for row, price in zip(df.itertuples(index = False), mid):
+            comp = OptionComputation(0, row.IV, row.delta, price, 0.0, row.gamma, row.vega, row.theta, self.spot)
+            self._quotes[row.conId] = (row.bid, row.ask, comp)
+
+    def mid(self, contract: Contract):
+        bid, ask, _ = self.quote(contract)
+        return 0.5 * (bid + ask)
+
+
+class fakeClient(Client):
+    """Client that answers API requests locally (see module docstring)"""
+    def __init__(self, wrapper, market: fakeMarket, latency: dict = None, errors: dict = None,
+                 account = 'DU0000000', seed = 0):
+        super().__init__(wrapper)
+        self.market = market
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.errors = {**DEFAULT_ERRORS, **(errors or {})}
+        self.account = account
+        self.random = random.Random(seed)
+        self.positions = dict() # conId: [contract, position, avgCost]
+        self.orders = dict()    # orderId: (contract, order)
+        self.held = dict()      # parentId: [(orderId, contract, order)] waiting for transmit
+        self._handles = dict()  # reqId: [asyncio.TimerHandle] of streaming market data
+        self._permIds = itertools.count(10000)
+        self._execIds = itertools.count(1)
+        self.request_counts = dict()
+
+    # connection
+    async def connectAsync(self, host, port, clientId, timeout = 2.0):
+        self.host, self.port, self.clientId = host, port, clientId
+        self.connState = Client.CONNECTED
+        self._serverVersion = self.MaxClientVersion
+        self._accounts = [self.account]
+        self._reqIdSeq = 1
+        self._apiReady = True
+        self.apiStart.emit()
+
+    def disconnect(self):
+        for handles in self._handles.values():
+            for h in handles:
+                h.cancel()
+        self._handles.clear()
+        self.reset()
+
+    def send(self, *fields):
+        """requests that are not simulated are silently dropped"""
+        self._count('unsupported')
+
+    # helpers
+    def _count(self, name):
+        self.request_counts[name] = self.request_counts.get(name, 0) + 1
+
+    def _fails(self, name):
+        return self.errors.get(name, 0) > 0 and self.random.random() < self.errors[name]
+
+    def _later(self, delay, fn, *args):
+        """deliver fn(*args) after delay as one batch of incoming messages"""
+        def deliver():
+            self.wrapper.tcpDataArrived()
+            fn(*args)
+            self.wrapper.tcpDataProcessed()
+        return asyncio.get_event_loop().call_later(delay, deliver)
+
+    # bookkeeping requests answered with an End message
+    def reqPositions(self):
+        self._count('positions')
+        def respond():
+            for contract, position, avg_cost in self.positions.values():
+                self.wrapper.position(self.account, contract, position, avg_cost)
+            self.wrapper.positionEnd()
+        self._later(self.latency['default'], respond)
+
+    def reqOpenOrders(self):
+        self._later(self.latency['default'], self.wrapper.openOrderEnd)
+
+    def reqAllOpenOrders(self):
+        self._later(self.latency['default'], self.wrapper.openOrderEnd)
+
+    def reqCompletedOrders(self, apiOnly):
+        self._later(self.latency['default'], self.wrapper.completedOrdersEnd)
+
+    def reqAccountUpdates(self, subscribe, acctCode):
+        self._later(self.latency['default'], self.wrapper.accountDownloadEnd, acctCode)
+
+    def reqAccountUpdatesMulti(self, reqId, account, modelCode, ledgerAndNLV):
+        self._later(self.latency['default'], self.wrapper.accountUpdateMultiEnd, reqId)
+
+    def reqExecutions(self, reqId, execFilter):
+        self._later(self.latency['default'], self.wrapper.execDetailsEnd, reqId)
+
+    def reqAutoOpenOrders(self, bAutoBind):
+        pass
+
+    def reqMarketDataType(self, marketDataType):
+        pass
+
+    def reqIds(self, numIds):
+        pass
+
+    # reference data
+    def reqContractDetails(self, reqId, contract):
+        self._count('contractDetails')
+        def respond():
+            if self._fails('contractDetails'):
+                self.wrapper.error(reqId, 200, 'No security definition has been found for the request', '')
+                return
+            if contract.secType == 'OPT':
+                matches = self.market.option_contracts(contract.lastTradeDateOrContractMonth, contract.right, contract.strike)
+            elif contract.symbol == self.market.symbol or contract.conId == self.market.underlying.conId:
+                matches = [self.market.underlying]
+            else:
+                matches = []
+            for c in matches:
+                self.wrapper.contractDetails(reqId, ContractDetails(contract = Contract.create(**util.dataclassAsDict(c)),
+                                                                    liquidHours = self.market.liquid_hours,
+                                                                    tradingHours = self.market.liquid_hours))
+            self.wrapper.contractDetailsEnd(reqId)
+        self._later(self.latency['contractDetails'], respond)
+
+    def reqSecDefOptParams(self, reqId, underlyingSymbol, futFopExchange, underlyingSecType, underlyingConId):
+        self._count('secDefOptParams')
+        def respond():
+            self.wrapper.securityDefinitionOptionParameter(reqId, 'SMART', underlyingConId, self.market.symbol,
+                                                           '100', list(self.market.expirations), list(self.market.strikes))
+            self.wrapper.securityDefinitionOptionParameterEnd(reqId)
+        self._later(self.latency['secDefOptParams'], respond)
+
+    # market data
+    def reqMktData(self, reqId, contract, genericTickList, snapshot, regulatorySnapshot, mktDataOptions):
+        self._count('mktData')
+        bid, ask, comp = self.market.quote(contract)
+        handles = self._handles.setdefault(reqId, [])
+        if not self._fails('missing_quote'):
+            def quote():
+                self.wrapper.priceSizeTick(reqId, 1, bid, 10.0)
+                self.wrapper.priceSizeTick(reqId, 2, ask, 10.0)
+                if contract.secType != 'OPT':
+                    self.wrapper.priceSizeTick(reqId, 4, 0.5 * (bid + ask), 100.0)
+                    self.wrapper.priceSizeTick(reqId, 9, self.market.spot, 0.0)
+            handles.append(self._later(self.latency['mktData'], quote))
+        if comp is not None and not self._fails('missing_greeks'):
+            handles.append(self._later(self.latency['mktData'] + self.latency['greeks'], self.wrapper.tickOptionComputation,
+                                       reqId, 13, 0, *comp[1:]))
+        if snapshot:
+            handles.append(self._later(self.latency['mktData'] + self.latency['greeks'], self.wrapper.tickSnapshotEnd, reqId))
+
+    def cancelMktData(self, reqId):
+        for h in self._handles.pop(reqId, []):
+            h.cancel()
+
+    # orders
+    def placeOrder(self, orderId, contract, order):
+        self._count('placeOrder')
+        if orderId in self.orders:
+            # modification of an open order
+            self.orders[orderId] = (contract, order)
+            self._later(self.latency['order'], self._ack, orderId, contract, order)
+            return
+        self.orders[orderId] = (contract, order)
+        if not order.transmit:
+            # bracket orders are held until the last child is transmitted
+            if order.parentId in self.held:
+                self.held[order.parentId].append((orderId, contract, order))
+            else:
+                self.held.setdefault(orderId, [])
+            return
+        if order.parentId in self.held:
+            to_send = [(order.parentId, *self.orders[order.parentId])] + self.held.pop(order.parentId) + [(orderId, contract, order)]
+        elif order.parentId:
+            to_send = [(orderId, contract, order)]
+        else:
+            to_send = [(orderId, contract, order)]
+        # transmit=False children are queued with their parent
+        for oid, c, o in to_send:
+            self._later(self.latency['order'], self._ack, oid, c, o)
+
+    def _ack(self, orderId, contract, order):
+        if self._fails('order'):
+            self.wrapper.error(orderId, 201, 'Order rejected - reason: simulated rejection', '')
+            return
+        if order.permId == 0:
+            order.permId = next(self._permIds)
+        order.clientId = self.clientId
+        self.wrapper.openOrder(orderId, contract, order, OrderState(status = 'Submitted'))
+        self.wrapper.orderStatus(orderId, 'Submitted', 0.0, order.totalQuantity, 0.0, order.permId, order.parentId, 0.0, self.clientId, '', 0.0)
+        if self._is_marketable(contract, order) and not order.parentId:
+            self._later(self.latency['fill'], self._fill, orderId, contract, order)
+
+    def _is_marketable(self, contract, order):
+        if order.orderType == 'MKT':
+            return True
+        if order.orderType == 'LMT':
+            bid, ask = self._combo_quote(contract)
+            return order.lmtPrice >= ask if order.action == 'BUY' else order.lmtPrice <= bid
+        return False
+
+    def _combo_quote(self, contract):
+        if contract.secType != 'BAG':
+            bid, ask, _ = self.market.quote(self._resolve(contract))
+            return bid, ask
+        bid = ask = 0.0
+        for leg in contract.comboLegs:
+            b, a, _ = self.market.quote(self.market.by_conId(leg.conId))
+            if leg.action == 'BUY':
+                bid, ask = bid + leg.ratio * b, ask + leg.ratio * a
+            else:
+                bid, ask = bid - leg.ratio * a, ask - leg.ratio * b
+        return bid, ask
+
+    def _resolve(self, contract):
+        return self.market.by_conId(contract.conId) or contract
+
+    def _fill(self, orderId, contract, order):
+        if orderId not in self.orders:
+            return
+        bid, ask = self._combo_quote(contract)
+        price = ask if order.action == 'BUY' else bid
+        if order.orderType == 'LMT':
+            price = order.lmtPrice
+        qty = order.totalQuantity
+        execution = Execution(execId = f"fake.{next(self._execIds)}", time = datetime.datetime.now(datetime.timezone.utc),
+                              acctNumber = self.account, exchange = 'SMART', side = 'BOT' if order.action == 'BUY' else 'SLD',
+                              shares = qty, price = price, permId = order.permId, clientId = self.clientId,
+                              orderId = orderId, cumQty = qty, avgPrice = price)
+        self.wrapper.execDetails(-1, contract, execution)
+        self.wrapper.orderStatus(orderId, 'Filled', qty, 0.0, price, order.permId, order.parentId, price, self.clientId, '', 0.0)
+        sign = 1 if order.action == 'BUY' else -1
+        # leg quantity per combo: +ratio for BUY legs, -ratio for SELL legs (as simBroker._legs)
+        legs = [(self.market.by_conId(l.conId), sign * l.ratio * (1 if l.action == 'BUY' else -1)) for l in contract.comboLegs] if contract.secType == 'BAG' else [(self._resolve(contract), sign)]
+        for leg_contract, leg_sign in legs:
+            leg_price = self.market.mid(leg_contract)
+            held, pos, avg = self.positions.get(leg_contract.conId, [leg_contract, 0.0, 0.0])
+            new_pos = pos + leg_sign * qty
+            multiplier = float(leg_contract.multiplier or 1)
+            avg = 0.0 if new_pos == 0 else (avg * pos + leg_price * multiplier * leg_sign * qty) / new_pos
+            self.positions[leg_contract.conId] = [leg_contract, new_pos, avg]
+            self.wrapper.position(self.account, leg_contract, new_pos, avg)
+        del self.orders[orderId]
+
+    def cancelOrder(self, orderId, manualCancelOrderTime = ''):
+        self._count('cancelOrder')
+        if orderId not in self.orders:
+            return
+        contract, order = self.orders.pop(orderId)
+        self.held.pop(orderId, None)
+        self._later(self.latency['order'], self.wrapper.orderStatus, orderId, 'Cancelled', 0.0, order.totalQuantity,
+                    0.0, order.permId, order.parentId, 0.0, self.clientId, '', 0.0)
+
+    def set_position(self, contract, position, avg_cost):
+        """seed an existing position (reported on connect)"""
+        self.positions[contract.conId] = [contract, position, avg_cost]
+
+
+class fakeIB(IB):
+    """IB connected to a fakeClient instead of TWS"""
+    def __init__(self, market: fakeMarket = None, latency: dict = None, errors: dict = None, seed = 0):
+        super().__init__()
+        self.market = market or fakeMarket()
+        self.client = fakeClient(self.wrapper, self.market, latency, errors, seed = seed)
+        self.client.apiEnd += self.disconnectedEvent
@@ -0,0 +1,217 @@
+"""Micro-benchmark suite of the chain, selection and order construction hot paths
+
+Every case is timed at each chain size (cases that do not depend on the chain run once),
+best and median per-call time over repeats are reported and written as JSON.
+Results are compared with a baseline and cases slower than baseline * (1 + threshold)
+are flagged (exit code 1), so the suite can gate a change.
+
+Run from src/option_trading:
+    python -m benchmarks.run_benchmarks --save-baseline          # on the reference commit
+    python -m benchmarks.run_benchmarks --threshold 0.2          # compare with the baseline
+    python -m benchmarks.run_benchmarks --sizes 100 1000 --filter bracket --json out.json
+
+Baselines are machine specific, compare runs of the same machine only.
+"""
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import datetime
+import statistics
+import numpy as np
+import pandas as pd
+from ib_insync import *
+from utils.option_utils import convert_tickers_to_full_chain, get_nearest_expiry, expiryResolver, round_to, get_date_today
+from utils.chain_index import ChainIndex
+from brokerage.orders import single_leg_bracket_order, replace_bracket_order
+from backtest.sim_broker import simClient
+from benchmarks.synthetic import synthetic_put_tickers, synthetic_expiry
+from ninety_dte_strategy import find_closest_delta, find_closest_credit
+
+DEFAULT_BASELINE = '.cache/benchmarks/baseline.json'
+DEFAULT_SIZES = [100, 1000, 5000]
+
+
+class orderStub:
+    """the part of IB / orderBook the order builders use, without side effects"""
+    def __init__(self, trades: list[Trade] = None):
+        self.client = simClient()
+        self.trades = trades or []
+
+    def cancelOrder(self, order: Order):
+        pass
+
+    def openTrades(self) -> list[Trade]:
+        return self.trades
+
+    def open_orders(self, contract: Contract) -> list[Trade]:
+        return self.trades
+
+
+def bracket_position(qty = 5, avg_price = 3.2):
+    """short put position with its working take profit / stop loss children"""
+    contract = Option('SPY', synthetic_expiry(90), 400.0, 'P', 'SMART', multiplier = '100', currency = 'USD',
+                      localSymbol = 'SPY   400P', conId = 1)
+    position = Position('DU0000000', contract, -qty, avg_price * 100)
+    children = [Trade(contract, LimitOrder('BUY', qty, 1.6, orderId = 2, parentId = 1)),
+                Trade(contract, StopOrder('BUY', qty, 9.6, orderId = 3, parentId = 1))]
+    return position, orderStub(children)
+
+
+# case name: setup(size) -> zero argument callable (size is None for cases independent of the chain size)
+def case_convert_tickers(size):
+    tickers = synthetic_put_tickers(n_strikes = size)
+    return lambda: convert_tickers_to_full_chain(tickers)
+
+def case_chain_index(size):
+    df = convert_tickers_to_full_chain(synthetic_put_tickers(n_strikes = size))
+    return lambda: ChainIndex(df)
+
+def case_find_closest_delta(size):
+    df = convert_tickers_to_full_chain(synthetic_put_tickers(n_strikes = size))
+    return lambda: find_closest_delta(df, -0.15)
+
+def case_find_closest_credit(size):
+    df = convert_tickers_to_full_chain(synthetic_put_tickers(n_strikes = size))
+    target = float(df['ask'].median())
+    return lambda: find_closest_credit(df, target, side = 'ask')
+
+def case_nearest_delta_indexed(size):
+    index = ChainIndex(convert_tickers_to_full_chain(synthetic_put_tickers(n_strikes = size)))
+    index.nearest_delta(-0.15) # key built once, as in the strategy
+    return lambda: index.nearest_delta(-0.15)
+
+def case_get_nearest_expiry(size):
+    today = get_date_today()
+    expiries = [synthetic_expiry(d) for d in range(0, 2 * size, 2)] # size listed expirations
+    return lambda: get_nearest_expiry(expiries, 90, today = today)
+
+def case_expiry_resolver(size):
+    today = get_date_today()
+    resolver = expiryResolver([synthetic_expiry(d) for d in range(0, 2 * size, 2)])
+    return lambda: resolver.resolve([90, 7], today = today)
+
+def case_round_to(size):
+    return lambda: round_to(3.14159, 0.05)
+
+def case_single_leg_bracket_order(size):
+    ib = orderStub()
+    return lambda: single_leg_bracket_order(ib, 'SELL', 5, 3.2, 2, 0.5, parent_order_type = 'LMT', rounding = 0.01)
+
+def case_replace_bracket_order(size):
+    position, ib = bracket_position()
+    return lambda: replace_bracket_order(ib, position, 2, 3.5, 2, 0.5, rounding = 0.01, order_book = ib)
+
+CASES = {
+    # name: (setup, scales with chain size)
+    'convert_tickers_to_full_chain': (case_convert_tickers, True),
+    'ChainIndex': (case_chain_index, True),
+    'find_closest_delta': (case_find_closest_delta, True),
+    'find_closest_credit': (case_find_closest_credit, True),
+    'ChainIndex.nearest_delta': (case_nearest_delta_indexed, True),
+    'get_nearest_expiry': (case_get_nearest_expiry, True),
+    'expiryResolver.resolve': (case_expiry_resolver, True),
+    'round_to': (case_round_to, False),
+    'single_leg_bracket_order': (case_single_leg_bracket_order, False),
+    'replace_bracket_order': (case_replace_bracket_order, False),
+}
+
+
+def measure(fn, repeat = 7, min_time = 0.05):
+    """(best, median) seconds per call, each repeat runs fn long enough to reach min_time"""
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    number = max(int(number * min_time / max(elapsed, 1e-9)), 1) if elapsed < min_time else number
+    per_call = [t / number for t in timer.repeat(repeat = repeat, number = number)]
+    return min(per_call), statistics.median(per_call)
+
+
+def run(sizes, name_filter = None, repeat = 7) -> dict:
+    results = dict()
+    for name, (setup, scales) in CASES.items():
+        if name_filter and name_filter not in name:
+            continue
+        for size in (sizes if scales else [None]):
+            key = f"{name}[n={size}]" if scales else name
+            best, median = measure(setup(size), repeat = repeat)
+            results[key] = {'best_us': best * 1e6, 'median_us': median * 1e6}
+    return results
+
+
+def metadata() -> dict:
+    return {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'node': platform.node(),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[dict]:
+    """per case change vs the baseline (best time), regression if slower by more than threshold"""
+    rows = []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if base is None:
+            rows.append({'case': key, 'best_us': current['best_us'], 'baseline_us': None, 'change': None, 'status': 'new'})
+            continue
+        change = current['best_us'] / base['best_us'] - 1
+        status = 'REGRESSION' if change > threshold else ('improved' if change < -threshold else 'ok')
+        rows.append({'case': key, 'best_us': current['best_us'], 'baseline_us': base['best_us'], 'change': change, 'status': status})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type = int, nargs = '+', default = DEFAULT_SIZES, help = 'chain sizes (strikes)')
+    parser.add_argument('--filter', default = None, help = 'only cases whose name contains this')
+    parser.add_argument('--repeat', type = int, default = 7)
+    parser.add_argument('--baseline', default = DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action = 'store_true', help = 'write the results as the new baseline')
+    parser.add_argument('--threshold', type = float, default = 0.2, help = 'relative slowdown flagged as a regression')
+    parser.add_argument('--json', default = None, help = 'also write the results to this file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run(args.sizes, args.filter, args.repeat)
+    report = {'meta': metadata(), 'results': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent = 2)
+
+    baseline = dict()
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    rows = compare(results, baseline, args.threshold)
+    print(f"{'case':<42}{'best_us':>12}{'baseline_us':>13}{'change':>9}  status")
+    for row in rows:
+        base = f"{row['baseline_us']:.2f}" if row['baseline_us'] is not None else '-'
+        change = f"{row['change']:+.1%}" if row['change'] is not None else '-'
+        print(f"{row['case']:<42}{row['best_us']:>12.2f}{base:>13}{change:>9}  {row['status']}")
+    print(f"{len(rows)} cases in {time.perf_counter() - start:.1f}s")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok = True)
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent = 2)
+        print(f"baseline written to {args.baseline}")
+        return 0
+    if not baseline:
+        print(f"no baseline at {args.baseline}, run with --save-baseline first")
+        return 0
+    regressions = [row['case'] for row in rows if row['status'] == 'REGRESSION']
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
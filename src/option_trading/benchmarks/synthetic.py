@@ -0,0 +1,42 @@
+"""Synthetic option chain generator for benchmarks
+Builds ib_insync Tickers for a put chain around a spot price from backtest.sources.synthetic_chain
+(the utils.greeks Black-Scholes prices and greeks the replay and fake market use too)
+"""
+import datetime
+import numpy as np
+from ib_insync import *
+from backtest.sources import synthetic_chain, occ_local_symbol
+
+
+def synthetic_expiry(dte, today = None):
+    today = today or datetime.date.today()
+    return (today + datetime.timedelta(days = dte)).strftime("%Y%m%d")
+
+def synthetic_put_tickers(n_strikes = 300, spot = 450.0, dte = 90, vol = 0.2, rate = 0.05,
+                          strike_step = None, symbol = 'SPY', expiry = None, missing_greeks = 0,
+                          conId_start = 1):
+    """Generate n_strikes put tickers centred around spot
+    
+    Args:
+        strike_step (float): strike spacing, defaults to 1.0 (narrower if the chain would reach 0 strike)
+        missing_greeks (int): number of tickers (spread across the chain) left without modelGreeks
+    """
+    expiry = expiry or synthetic_expiry(dte)
+    today = (datetime.datetime.strptime(expiry, "%Y%m%d") - datetime.timedelta(days = dte)).strftime("%Y%m%d")
+    strike_step = strike_step or min(1.0, round(spot / (n_strikes + 1), 2))
+    lowest = spot - strike_step * (n_strikes // 2)
+    strikes = np.round(lowest + np.arange(n_strikes) * strike_step, 2)
+    df = synthetic_chain(spot, [expiry], strikes, today, vol = vol, rate = rate, symbol = symbol)
+    skip_every = n_strikes // missing_greeks if missing_greeks else 0
+    tickers = []
+    for i, row in enumerate(df.itertuples(index = False)):
+        contract = Option(symbol, expiry, row.strike, 'P', 'SMART', multiplier = '100', currency = 'USD',
+                          localSymbol = row.index, tradingClass = symbol, conId = conId_start + i)
+        ticker = Ticker(contract = contract, bid = row.bid, ask = row.ask,
+                        bidSize = 10.0, askSize = 12.0, volume = float(100 + i))
+        if not (skip_every and i % skip_every == 0):
+            ticker.modelGreeks = OptionComputation(
+                tickAttrib = 0, impliedVol = row.IV, delta = row.delta, optPrice = (row.bid + row.ask) / 2,
+                pvDividend = 0.0, gamma = row.gamma, vega = row.vega, theta = row.theta, undPrice = spot)
+        tickers.append(ticker)
+    return tickers
@@ -0,0 +1,87 @@
+import os
+import json
+import datetime
+from ib_insync import *
+from utils.option_utils import get_date_today, convert_str_date
+
+CONTRACT_FIELDS = ['conId', 'symbol', 'lastTradeDateOrContractMonth', 'strike', 'right',
+                   'multiplier', 'exchange', 'currency', 'localSymbol', 'tradingClass']
+
+
+def option_to_dict(contract: Contract) -> dict:
+    return {f: getattr(contract, f) for f in CONTRACT_FIELDS}
+
+def option_from_dict(d: dict) -> Option:
+    return Option(**d)
+
+
+class contractCache:
+    """On-disk cache of qualified option contracts (per symbol/tradingClass/right/expiry), expirations and strikes.
+    Entries are valid max_age_days (0 = today only), expired expirations are purged on start"""
+    def __init__(self, cache_dir = '.cache/contracts', max_age_days = 0, today: str = None):
+        self.cache_dir = cache_dir
+        self.max_age_days = max_age_days
+        self.today = today or get_date_today()
+        self.memory = dict() # filename: entry
+        os.makedirs(self.cache_dir, exist_ok = True)
+        self.purge_expired()
+
+    def _path(self, *key):
+        return os.path.join(self.cache_dir, "_".join(str(k) for k in key) + ".json")
+
+    def _is_fresh(self, entry):
+        age = convert_str_date(self.today) - convert_str_date(entry['date'])
+        return age <= datetime.timedelta(days = self.max_age_days)
+
+    def _read(self, path):
+        if path not in self.memory:
+            if not os.path.exists(path):
+                return None
+            try:
+                with open(path) as f:
+                    self.memory[path] = json.load(f)
+            except (OSError, ValueError):
+                return None
+        entry = self.memory[path]
+        return entry if self._is_fresh(entry) else None
+
+    def _write(self, path, data):
+        entry = {'date': self.today, 'data': data}
+        tmp = path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path) # atomic so a crash never leaves a half written cache
+        self.memory[path] = entry
+
+    def get(self, symbol, trading_class, expiry, right) -> list[Option]:
+        """qualified contracts (puts or calls) for the expiry or None if not cached / stale"""
+        entry = self._read(self._path(symbol, trading_class, right, expiry))
+        if entry is None:
+            return None
+        return [option_from_dict(d) for d in entry['data']]
+
+    def put(self, symbol, trading_class, expiry, right, contracts: list[Contract]):
+        # expiry last in the file name, purge_expired reads it from there
+        self._write(self._path(symbol, trading_class, right, expiry), [option_to_dict(c) for c in contracts])
+
+    def get_expirations(self, symbol, trading_class) -> list[str]:
+        entry = self._read(self._path(symbol, trading_class, 'expirations'))
+        return None if entry is None else entry['data']
+
+    def put_expirations(self, symbol, trading_class, expirations: list[str]):
+        self._write(self._path(symbol, trading_class, 'expirations'), sorted(expirations))
+
+    def get_strikes(self, symbol, trading_class) -> list[float]:
+        """listed strikes of the option chain (reqSecDefOptParams)"""
+        entry = self._read(self._path(symbol, trading_class, 'strikes'))
+        return None if entry is None else entry['data']
+
+    def put_strikes(self, symbol, trading_class, strikes: list[float]):
+        self._write(self._path(symbol, trading_class, 'strikes'), sorted(strikes))
+
+    def purge_expired(self):
+        """remove cached contracts of expirations before today"""
+        for filename in os.listdir(self.cache_dir):
+            expiry = filename.rsplit('_', 1)[-1].removesuffix('.json')
+            if expiry.isdigit() and expiry < self.today:
+                os.remove(os.path.join(self.cache_dir, filename))
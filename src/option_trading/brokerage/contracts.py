@@ -1,3 +1,4 @@
+from functools import lru_cache
 from ib_insync import *
 
 # def us_equity_contract(ticker, sec_type = "STK", currency="USD",exchange = "SMART"):
@@ -17,15 +18,21 @@ from ib_insync import *
 #     return contract
     
     
+@lru_cache(maxsize = 1024)
+def parse_option_symbol(localSymbol):
+    """OCC local symbol (e.g. 'SPY   240119P00450000') to (symbol, expiry, right, strike)"""
+    con_details = localSymbol.split()
+    symbol = con_details[0]
+    expiry = "20"+con_details[1][:6]
+    right = con_details[1][6]
+    strike = float(con_details[1][7:])/1000
+    return symbol, expiry, right, strike
+
+
 def specific_option_contract(localSymbol):
+    """unqualified Option from the local symbol (fallback when no qualified contract is at hand)"""
     try:
-        con_details = localSymbol.split()
-        symbol = con_details[0]
-        expiry = "20"+con_details[1][:6]
-        right = con_details[1][6]
-        strike = float(con_details[1][7:])/1000
+        symbol, expiry, right, strike = parse_option_symbol(localSymbol)
         return Option(symbol, expiry, strike, right, 'SMART', tradingClass = symbol)
     except:
         return None
-    
-    
\ No newline at end of file
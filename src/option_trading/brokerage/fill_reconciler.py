@@ -0,0 +1,95 @@
+import time
+import asyncio
+from ib_insync import *
+from brokerage.order_book import orderBook
+from portfolio.position_manager import positionManager
+from services.metrics import metrics
+
+
+class fillReconciler:
+    """Resizes bracket children to the position once a watched parent fills, debounced on positionEvent"""
+    def __init__(self, ib: IB, positions: positionManager, order_book: orderBook,
+                 debounce = 0.25, max_wait = 5.0, logger = None, alerts = None, name = ''):
+        self.ib = ib
+        self.positions = positions
+        self.order_book = order_book
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.logger = logger
+        self.alerts = alerts
+        self.name = name
+        self.parents = dict()   # parent orderId: conId
+        self.pending = dict()   # conId: {'parent': orderId, 'first_fill': t, 'position_seen': bool, 'timer': handle}
+        self.latencies = []     # fill -> re-bracket (seconds)
+        self.resized = 0
+        ib.execDetailsEvent += self.on_exec_details
+        ib.positionEvent += self.on_position
+
+    def close(self):
+        self.ib.execDetailsEvent -= self.on_exec_details
+        self.ib.positionEvent -= self.on_position
+        for state in self.pending.values():
+            state['timer'].cancel()
+        self.pending.clear()
+
+    def watch(self, parent_trade: Trade):
+        """resize the children of this parent whenever it (partially) fills"""
+        self.parents[parent_trade.order.orderId] = parent_trade.contract.conId
+
+    def _schedule(self, conId, delay):
+        state = self.pending[conId]
+        if state.get('timer') is not None:
+            state['timer'].cancel()
+        state['timer'] = asyncio.get_event_loop().call_later(max(delay, 0), self.reconcile, conId)
+
+    def on_exec_details(self, trade: Trade, fill: Fill):
+        conId = self.parents.get(trade.order.orderId)
+        if conId is None:
+            return
+        now = time.perf_counter()
+        state = self.pending.get(conId)
+        if state is None:
+            state = self.pending[conId] = {'parent': trade.order.orderId, 'first_fill': now, 'position_seen': False, 'timer': None}
+        state['position_seen'] = False # wait for the position that includes this fill
+        # fallback if the position update never arrives
+        self._schedule(conId, state['first_fill'] + self.max_wait - now)
+
+    def on_position(self, position: Position):
+        conId = position.contract.conId
+        state = self.pending.get(conId)
+        if state is None:
+            return
+        state['position_seen'] = True
+        deadline = state['first_fill'] + self.max_wait - time.perf_counter()
+        self._schedule(conId, min(self.debounce, deadline))
+
+    def reconcile(self, conId):
+        state = self.pending.pop(conId, None)
+        if state is None:
+            return
+        pos = self.positions.get(Contract(conId = conId))
+        if pos is None:
+            self._log("%s: No position for conId %s after parent %s fill. Children not resized", self.name, conId, state['parent'])
+            return
+        if not state['position_seen']:
+            self._log("%s: No position update within %ss of parent %s fill, using last known position", self.name, self.max_wait, state['parent'])
+        qty = abs(pos.position)
+        for t in self.order_book.children(state['parent']):
+            if t.order.totalQuantity == qty: # if it's the same then don't update child order
+                continue
+            if self.alerts is not None:
+                self.alerts.info(f"{self.name}: {t.contract.localSymbol} Update child order qty from {t.order.totalQuantity} to {qty}")
+            new_order = t.order
+            new_order.totalQuantity = qty
+            new_order.transmit = True
+            self.ib.placeOrder(t.contract, new_order)
+            self.resized += 1
+        latency = time.perf_counter() - state['first_fill']
+        self.latencies.append(latency)
+        metrics.observe('fill_to_rebracket', latency)
+        self._log("%s: Bracket of parent %s reconciled to %s in %.0fms", self.name, state['parent'], qty, latency * 1e3)
+
+    def _log(self, msg, *args):
+        # %-style arguments, formatted only if the record is emitted (called on the fill path)
+        if self.logger is not None:
+            self.logger.info(msg, *args)
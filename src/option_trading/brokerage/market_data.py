@@ -0,0 +1,185 @@
+import time
+import asyncio
+from ib_insync import *
+
+
+def is_ticker_ready(ticker: Ticker, need_greeks = True) -> bool:
+    """ticker has a two sided quote (and model greeks if needed)"""
+    if util.isNan(ticker.bid) or util.isNan(ticker.ask):
+        return False
+    if need_greeks and ticker.modelGreeks is None:
+        return False
+    return True
+
+
+class marketDataHub:
+    """Reference counted streaming market data by conId, strategies sharing a connection share one ticker and line"""
+    def __init__(self, ib: IB):
+        self.ib = ib
+        self.subscriptions = dict() # conId: [contract, ticker, subscribers]
+        self.stats = {'requested': 0, 'shared': 0, 'cancelled': 0}
+        ib.disconnectedEvent.connect(self.reset, keep_ref = True) # lives as long as the IB it multiplexes
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def reset(self):
+        """connection lost: every line is gone"""
+        self.subscriptions.clear()
+
+    def subscribe(self, contract: Contract) -> Ticker:
+        sub = self.subscriptions.get(contract.conId)
+        if sub is not None:
+            sub[2] += 1
+            self.stats['shared'] += 1
+            return sub[1]
+        ticker = self.ib.reqMktData(contract, '', False, False)
+        self.subscriptions[contract.conId] = [contract, ticker, 1]
+        self.stats['requested'] += 1
+        return ticker
+
+    def resubscribe(self, contract: Contract) -> Ticker:
+        sub = self.subscriptions.get(contract.conId)
+        if sub is None:
+            return self.subscribe(contract)
+        self.ib.cancelMktData(sub[0])
+        sub[1] = self.ib.reqMktData(sub[0], '', False, False)
+        self.stats['requested'] += 1
+        return sub[1]
+
+    def unsubscribe(self, contract: Contract):
+        sub = self.subscriptions.get(contract.conId)
+        if sub is None:
+            return
+        sub[2] -= 1
+        if sub[2] <= 0:
+            del self.subscriptions[contract.conId]
+            self.ib.cancelMktData(sub[0])
+            self.stats['cancelled'] += 1
+
+
+class chainSnapshot:
+    """Streams market data of option contracts until every ticker is ready (bid/ask/modelGreeks).
+    With a pacing governor ready tickers give their line back, with a marketDataHub tickers are shared"""
+    def __init__(self, ib: IB, contracts: list[Contract], need_greeks = True, pacing = None, market_data: marketDataHub = None):
+        self.ib = ib
+        self.market_data = market_data
+        self.contracts = {c.conId: c for c in contracts}
+        self.need_greeks = need_greeks
+        self.pacing = pacing
+        self.ticker_dict = dict()   # conId: Ticker
+        self.ready = set()          # conIds with complete data
+        self.released = set()       # conIds of ready tickers whose market data line was cancelled
+        self.resubscribed = 0
+        # progress counters (perf_counter timestamps)
+        self.start_time = None
+        self.first_ready_time = None
+        self.last_ready_time = None
+        self._complete = None # asyncio.Event while a coroutine waits
+
+    @property
+    def total(self):
+        return len(self.contracts)
+
+    @property
+    def tickers(self) -> list[Ticker]:
+        return list(self.ticker_dict.values())
+
+    @property
+    def missing(self) -> list[Contract]:
+        return [c for conId, c in self.contracts.items() if conId not in self.ready]
+
+    def is_complete(self):
+        return len(self.ready) == self.total
+
+    def subscribe(self):
+        """stream market data for all contracts"""
+        self.start_time = time.perf_counter()
+        self.ib.pendingTickersEvent += self.on_pending_tickers
+        for conId, contract in self.contracts.items():
+            self.ticker_dict[conId] = self._request(contract)
+        # tickers shared with another snapshot may already be complete
+        self.on_pending_tickers(self.tickers)
+
+    def resubscribe_missing(self):
+        """cancel and re-request only the contracts that are still missing data"""
+        for contract in self.missing:
+            if self.market_data is not None:
+                self.ticker_dict[contract.conId] = self.market_data.resubscribe(contract)
+            else:
+                self.ib.cancelMktData(contract)
+                self.ticker_dict[contract.conId] = self.ib.reqMktData(contract, '', False, False)
+            self.resubscribed += 1
+
+    def cancel(self):
+        """stop streaming, tickers keep their last values"""
+        self.ib.pendingTickersEvent -= self.on_pending_tickers
+        for conId, contract in self.contracts.items():
+            if conId not in self.released:
+                self._release(contract)
+
+    def _request(self, contract: Contract) -> Ticker:
+        if self.market_data is not None:
+            return self.market_data.subscribe(contract)
+        return self.ib.reqMktData(contract, '', False, False)
+
+    def _release(self, contract: Contract):
+        if self.market_data is not None:
+            self.market_data.unsubscribe(contract)
+        else:
+            self.ib.cancelMktData(contract)
+
+    def on_pending_tickers(self, tickers):
+        for ticker in tickers:
+            conId = ticker.contract.conId
+            if conId not in self.contracts or conId in self.ready:
+                continue
+            if is_ticker_ready(ticker, self.need_greeks):
+                now = time.perf_counter()
+                if self.first_ready_time is None:
+                    self.first_ready_time = now
+                self.last_ready_time = now
+                self.ready.add(conId)
+                if self.pacing is not None and self.pacing.lines_waiting():
+                    self._release(self.contracts[conId])
+                    self.released.add(conId)
+        if self._complete is not None and self.is_complete():
+            self._complete.set()
+
+    def wait(self, timeout: float) -> bool:
+        """Block (while processing IB events) until every ticker is ready or the deadline passes.
+        Returns True if the snapshot is complete"""
+        deadline = time.perf_counter() + timeout
+        while not self.is_complete():
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            self.ib.waitOnUpdate(timeout = remaining)
+        return self.is_complete()
+
+    async def wait_async(self, timeout: float) -> bool:
+        """Wait (without blocking the event loop) until every ticker is ready or the timeout passes.
+        Returns True if the snapshot is complete"""
+        if not self.is_complete() and timeout > 0:
+            self._complete = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._complete.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._complete = None
+        return self.is_complete()
+
+    def progress(self) -> dict:
+        """ready/total and latency (in seconds, relative to subscribe) of the first and last ready ticker"""
+        def since_start(t):
+            return None if (t is None or self.start_time is None) else round(t - self.start_time, 3)
+        return {
+            'ready': len(self.ready),
+            'total': self.total,
+            'resubscribed': self.resubscribed,
+            'released': len(self.released),
+            'elapsed': since_start(time.perf_counter()),
+            'first_ready': since_start(self.first_ready_time),
+            'last_ready': since_start(self.last_ready_time),
+        }
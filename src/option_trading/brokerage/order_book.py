@@ -0,0 +1,93 @@
+from ib_insync import *
+
+
+class orderBook:
+    """Live (not done) trades indexed by conId and by bracket parentId, maintained from order events"""
+    def __init__(self, ib: IB = None):
+        self.trades = dict()    # key: Trade
+        self.by_conId = dict()  # conId: {key: Trade}
+        self.by_parent = dict() # parentId: {key: Trade}
+        self.version = 0
+        self.ib = None
+        if ib is not None:
+            self.subscribe(ib)
+
+    def subscribe(self, ib: IB):
+        self.ib = ib
+        for trade in ib.openTrades():
+            self.update(trade)
+        ib.newOrderEvent += self.update
+        ib.openOrderEvent += self.update
+        ib.orderStatusEvent += self.update
+
+    def reload(self):
+        """rebuild from ib.openTrades() (after a reconnect), the book stays the same object"""
+        self.trades.clear()
+        self.by_conId.clear()
+        self.by_parent.clear()
+        for trade in self.ib.openTrades():
+            self.update(trade)
+        self.version += 1
+
+    def unsubscribe(self):
+        if self.ib is not None:
+            self.ib.newOrderEvent -= self.update
+            self.ib.openOrderEvent -= self.update
+            self.ib.orderStatusEvent -= self.update
+            self.ib = None
+
+    def __len__(self):
+        return len(self.trades)
+
+    def __iter__(self):
+        return iter(list(self.trades.values()))
+
+    @staticmethod
+    def _key(trade: Trade):
+        # orders of other clients (or placed in TWS) may have orderId 0 but always get a permId
+        order = trade.order
+        return (order.clientId, order.orderId) if order.orderId > 0 else ('perm', order.permId)
+
+    def update(self, trade: Trade):
+        """add / refresh a trade, drop it once it is done (filled, cancelled) or inactive (rejected, not working)"""
+        key = self._key(trade)
+        if trade.isDone() or trade.orderStatus.status == OrderStatus.Inactive:
+            self.remove(trade)
+            return
+        current = self.trades.get(key)
+        if current is not None and current.contract.conId != trade.contract.conId:
+            self._unindex(key, current)
+        self.trades[key] = trade
+        self.by_conId.setdefault(trade.contract.conId, dict())[key] = trade
+        if trade.order.parentId:
+            self.by_parent.setdefault(trade.order.parentId, dict())[key] = trade
+        if current is None:
+            self.version += 1
+
+    def remove(self, trade: Trade):
+        key = self._key(trade)
+        current = self.trades.pop(key, None)
+        if current is not None:
+            self._unindex(key, current)
+            self.version += 1
+
+    def _unindex(self, key, trade):
+        for index, k in ((self.by_conId, trade.contract.conId), (self.by_parent, trade.order.parentId)):
+            bucket = index.get(k)
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del index[k]
+
+    # queries
+    def open_orders(self, contract: Contract) -> list[Trade]:
+        """live trades on the contract"""
+        return list(self.by_conId.get(contract.conId, {}).values())
+
+    def children(self, parent_order_id: int) -> list[Trade]:
+        """live child orders (take profit / stop loss) of a bracket parent"""
+        return list(self.by_parent.get(parent_order_id, {}).values())
+
+    def get(self, order_id: int, client_id: int = None) -> Trade:
+        client_id = self.ib.wrapper.clientId if client_id is None and self.ib is not None else client_id
+        return self.trades.get((client_id, order_id))
@@ -0,0 +1,66 @@
+import asyncio
+from ib_insync import *
+
+CANCELLED_STATES = ('Cancelled', 'ApiCancelled')
+
+# target state: order status reached (or passed)
+ORDER_STATES = {
+    'Submitted': lambda t: t.orderStatus.status in ('PreSubmitted', 'Submitted', 'Filled'),
+    'Active': lambda t: t.isActive() or t.orderStatus.status == 'Filled',
+    'Filled': lambda t: t.orderStatus.status == 'Filled',
+    'Cancelled': lambda t: t.orderStatus.status in CANCELLED_STATES,
+}
+
+
+class orderStateException(Exception):
+    """order did not reach the target state (timed out or ended in another state)"""
+    def __init__(self, trade: Trade, state: str, reason: str):
+        self.trade = trade
+        self.state = state
+        self.reason = reason
+        super().__init__(f"{trade.order.orderId} {trade.order.action} {trade.order.totalQuantity} {trade.contract.localSymbol}: "
+                         f"{reason} waiting for {state} (status {trade.orderStatus.status})")
+
+
+def order_state_future(trade: Trade, state = 'Submitted') -> asyncio.Future:
+    """Future resolved with the trade once it reaches state,
+    or failed with orderStateException if the order is done in any other state"""
+    reached = ORDER_STATES[state]
+    future = asyncio.get_event_loop().create_future()
+
+    def check(trade):
+        if future.done():
+            return
+        if reached(trade):
+            future.set_result(trade)
+        elif trade.isDone():
+            future.set_exception(orderStateException(trade, state, 'order ended'))
+
+    check(trade)
+    if not future.done():
+        trade.statusEvent += check
+        future.add_done_callback(lambda _: trade.statusEvent.disconnect(check))
+    return future
+
+
+async def wait_for_order_state(trade: Trade, state = 'Submitted', timeout: float = 10) -> Trade:
+    """await one order reaching state, raises orderStateException on timeout or if it ends in another state"""
+    try:
+        return await asyncio.wait_for(order_state_future(trade, state), timeout)
+    except asyncio.TimeoutError:
+        raise orderStateException(trade, state, f"timeout after {timeout}s") from None
+
+
+async def wait_for_orders(trades: list[Trade], state = 'Submitted', timeout: float = 10):
+    """await several orders together (one shared timeout)
+
+    Returns:
+        (reached, stuck): trades that reached state and orderStateException of the others
+    """
+    results = await asyncio.gather(*[wait_for_order_state(t, state, timeout) for t in trades], return_exceptions = True)
+    reached = [r for r in results if isinstance(r, Trade)]
+    stuck = [r for r in results if isinstance(r, orderStateException)]
+    errors = [r for r in results if isinstance(r, BaseException) and not isinstance(r, orderStateException)]
+    if errors:
+        raise errors[0]
+    return reached, stuck
@@ -1,7 +1,12 @@
 from utils.option_utils import round_to
+from utils.selection import order_quantities, spread_credit
 from ib_insync import *
 
 
+class bracketOrderException(Exception):
+    pass
+
+
 def single_leg_bracket_order(ib, action, qty, price, SL, TP, slippage_adj = 0, parent_order_type = 'MKT', rounding = 0.05):
     """Generate bracket order for short leg
     SPX has to be rounded to nearest 0.05 if not order will not be submitted
@@ -62,9 +67,23 @@ def single_leg_bracket_order(ib, action, qty, price, SL, TP, slippage_adj = 0, p
                         stopLoss = stop_loss_order)
 
 
-def replace_bracket_order(ib: IB, target_pos: Position, add_qty, price, SL, TP, slippage_adj = 0, parent_order_type = 'MKT', rounding = 0.05):
+def previous_bracket_orders(ib: IB, contract: Contract, order_book = None) -> list[Trade]:
+    """working orders on the contract itself (children of a combo bracket are on the BAG contract)"""
+    if order_book is not None:
+        return order_book.open_orders(contract)
+    # using openTrades need master clientId
+    return [t for t in ib.openTrades() if t.contract.localSymbol == contract.localSymbol]
+
+def has_single_leg_bracket(ib: IB, contract: Contract, order_book = None) -> bool:
+    return any(t.order.parentId for t in previous_bracket_orders(ib, contract, order_book))
+
+def replace_bracket_order(ib: IB, target_pos: Position, add_qty, price, SL, TP, slippage_adj = 0, parent_order_type = 'MKT', rounding = 0.05, order_book = None,
+                          cancel_previous = True):
     """ 
-    If bracket order exists, """
+    If bracket order exists, 
+    order_book (orderBook, optional): look up open orders on the contract by conId instead of scanning ib.openTrades()
+    cancel_previous: cancel the working bracket here (False: the caller cancels it before placing the new one)
+    Raises bracketOrderException (before anything is cancelled) unless the working children have one quantity"""
     target_contract= target_pos.contract
     target_contract.exchange = "SMART"
     # position.contract need an exchange information
@@ -75,15 +94,14 @@ def replace_bracket_order(ib: IB, target_pos: Position, add_qty, price, SL, TP,
     # test this (replace duplicated position)
     action = "SELL" if target_pos.position < 0 else "BUY"
     
-    prev_bracket_orders = []
-    # using openTrades need master clientId
-    for t in ib.openTrades():
-        if t.contract.localSymbol == target_contract.localSymbol:
-            prev_bracket_orders.append(t)
+    prev_bracket_orders = previous_bracket_orders(ib, target_contract, order_book)
+    child_qty = set([p.order.totalQuantity for p in prev_bracket_orders])
+    if len(child_qty) != 1:
+        raise bracketOrderException(f"{target_contract.localSymbol}: no single working bracket to resize (child quantities {sorted(child_qty)})")
+    if cancel_previous:
+        for t in prev_bracket_orders:
             # cancel openTrades
             ib.cancelOrder(t.order)
-    child_qty = set([p.order.totalQuantity for p in prev_bracket_orders])
-    assert len(child_qty) == 1
     # new parent order
     parent_order_id =  ib.client.getReqId()
     parent_order = MarketOrder(action, add_qty, orderId = parent_order_id,tif="GTC", transmit = False)
@@ -127,4 +145,109 @@ def replace_bracket_order(ib: IB, target_pos: Position, add_qty, price, SL, TP,
 
 
 def rel_pegged_to_primary():
-    """Not implemented"""
\ No newline at end of file
+    """Not implemented"""
+
+def credit_spread_contract(short_contract: Contract, long_contract: Contract, hedge_ratio = 1):
+    """BAG contract selling 1 short_contract and buying hedge_ratio long_contract (both qualified)"""
+    return Contract(
+        symbol = short_contract.symbol,
+        secType = 'BAG',
+        currency = short_contract.currency or 'USD',
+        exchange = 'SMART',
+        comboLegs = [
+            ComboLeg(conId = short_contract.conId, ratio = 1, action = 'SELL', exchange = 'SMART'),
+            ComboLeg(conId = long_contract.conId, ratio = int(hedge_ratio), action = 'BUY', exchange = 'SMART'),
+        ])
+
+
+def combo_bracket_order(ib, qty, credit, SL, TP, rounding = 0.01):
+    """Generate bracket order for a credit spread combo (see credit_spread_contract)
+    Buying the combo at a negative limit price receives the credit.
+    
+    Args:
+        ib: ib client
+        qty (int): number of combos (short leg quantity)
+        credit (float): net credit per combo (short bid - ratio * long ask)
+        SL (float): close when the spread costs credit * (1 + SL), None for no stop loss
+        TP (float): close when the spread costs credit * (1 - TP), None for no take profit
+        rounding (float, optional): Defaults to 0.01.
+
+    Returns:
+       list of ib orders [parent (LMT), take profit (LMT), stop loss (STP)]
+    """
+    parent_order_id = ib.client.getReqId()
+    has_children = TP is not None or SL is not None
+    parent_order = LimitOrder('BUY', qty, -round_to(credit, rounding), orderId = parent_order_id, tif = "GTC",
+                              transmit = not has_children)
+    if TP is not None:
+        take_profit_order = LimitOrder(
+            action = 'SELL',
+            totalQuantity = qty,
+            lmtPrice = -round_to(credit * (1 - TP), rounding),
+            tif = "GTC",
+            orderId = ib.client.getReqId(),
+            transmit = SL is None,
+            parentId = parent_order_id,
+        )
+    else:
+        take_profit_order = None
+    if SL is not None:
+        stop_loss_order = StopOrder(
+            action = 'SELL',
+            totalQuantity = qty,
+            stopPrice = -round_to(credit * (1 + SL), rounding),
+            tif = "GTC",
+            orderId = ib.client.getReqId(),
+            transmit = True,
+            parentId = parent_order_id
+        )
+    else:
+        stop_loss_order = None
+
+    return BracketOrder(parent= parent_order, 
+                        takeProfit = take_profit_order, 
+                        stopLoss = stop_loss_order)
+
+
+def entry_orders(ib, short_contract: Contract, long_contract: Contract, short_put, long_put, params, positions,
+                 order_book = None, multiplier = 100) -> dict:
+    """Orders of one entry, built by the live strategy and the backtest replay alike.
+
+    An existing short put position is added to (its bracket resized) only if it has a working
+    single-leg bracket. A position opened by a combo order has its children on the BAG contract
+    and gets a new spread instead. Every order id is reserved here in placement order, and
+    bracketOrderException is raised before any order is placed.
+
+    Returns {'modify_position', 'existing_position', 'short_qty', 'hedge_qty', 'credit', 'cancel', 'stages'}
+    stages: [(name, contract, orders)] placed in this order ('spread', or 'long_put' then 'short_put'),
+    cancel: working orders to cancel right before the 'short_put' stage (bracket being resized).
+    No stages if the spread has no credit."""
+    short_qty, hedge_qty = order_quantities(short_put, params, multiplier)
+    existing_pos = positions.get(short_contract)
+    modify_position = existing_pos is not None and has_single_leg_bracket(ib, short_contract, order_book)
+    plan = {'modify_position': modify_position, 'existing_position': existing_pos, 'short_qty': short_qty,
+            'hedge_qty': hedge_qty, 'credit': None, 'cancel': [], 'stages': []}
+
+    # new spread as one combo order (both legs fill together, one submission)
+    if params['COMBO_ORDER'] and not modify_position and float(params['HEDGE_RATIO']).is_integer():
+        plan['credit'] = spread_credit(short_put, long_put, params)
+        if plan['credit'] > 0:
+            spread_orders = combo_bracket_order(ib, short_qty, plan['credit'], params['STOPLOSS'], params['TAKEPROFIT'], rounding = 0.01)
+            plan['stages'].append(('spread', credit_spread_contract(short_contract, long_contract, params['HEDGE_RATIO']),
+                                   [o for o in spread_orders if o is not None]))
+        return plan
+
+    # long put first (if naked puts not allowed in trading account level)
+    long_put_order = MarketOrder('BUY', hedge_qty, orderId = ib.client.getReqId())
+    if modify_position:
+        plan['cancel'] = [t.order for t in previous_bracket_orders(ib, short_contract, order_book)]
+        bracket = replace_bracket_order(ib = ib, target_pos = existing_pos, add_qty = short_qty, price = short_put['ask'],
+                                        SL = params['STOPLOSS'], TP = params['TAKEPROFIT'], parent_order_type = "MKT",
+                                        order_book = order_book, cancel_previous = False)
+    else:
+        bracket = single_leg_bracket_order(ib = ib, action = 'SELL', qty = short_qty, price = short_put['ask'],
+                                           SL = params['STOPLOSS'], TP = params['TAKEPROFIT'],
+                                           parent_order_type = "LMT", rounding = 0.01)
+    plan['stages'] = [('long_put', long_contract, [long_put_order]),
+                      ('short_put', short_contract, [o for o in bracket if o is not None])]
+    return plan
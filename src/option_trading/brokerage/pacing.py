@@ -0,0 +1,164 @@
+import heapq
+import asyncio
+import itertools
+from ib_insync import *
+from services.metrics import metrics
+
+# priority classes, lower is sent first
+ORDER = 0    # placing / cancelling orders
+CONTROL = 1  # cancelling market data, account and position requests
+BULK = 2     # contract details, option parameters, market data of whole chains
+
+REQUEST_PRIORITY = {
+    'placeOrder': ORDER,
+    'cancelOrder': ORDER,
+    'reqGlobalCancel': ORDER,
+    'cancelMktData': CONTROL,
+    'reqPositions': CONTROL,
+    'reqOpenOrders': CONTROL,
+    'reqAllOpenOrders': CONTROL,
+    'reqAccountUpdates': CONTROL,
+    'reqAccountUpdatesMulti': CONTROL,
+    'reqExecutions': CONTROL,
+    'reqIds': CONTROL,
+    'reqContractDetails': BULK,
+    'reqSecDefOptParams': BULK,
+    'reqMktData': BULK,
+    'reqHistoricalData': BULK,
+    'reqMatchingSymbols': BULK,
+    'calculateImpliedVolatility': BULK,
+    'calculateOptionPrice': BULK,
+}
+
+
+class pacingGovernor:
+    """Pacing in front of ib.client: msg_rate token bucket, at most max_lines market data lines and a priority
+    queue so orders (with order_reserve messages of headroom) go before queued chain requests"""
+    def __init__(self, ib: IB, msg_rate = 40, burst = None, order_reserve = 10, max_lines = 100, snapshot_hold = 11.0):
+        self.ib = ib
+        self.msg_rate = msg_rate
+        self.order_reserve = order_reserve
+        self.burst = burst or msg_rate
+        self.max_lines = max_lines
+        self.snapshot_hold = snapshot_hold
+        self.tokens = float(self.burst)
+        self.lines = set()          # reqIds holding a market data line
+        self.queue = []             # heap of (priority, seq, enqueued, method, args, kwargs)
+        self.line_waiters = []      # heap of reqMktData waiting for a line
+        self.pending_mkt_data = set() # reqIds of queued reqMktData (cancel before send drops them)
+        self.stats = {'sent': 0, 'delayed': 0, 'line_waits': 0, 'dropped_cancels': 0}
+        self._seq = itertools.count()
+        self._last_refill = None
+        self._timer = None
+        self._originals = dict()    # method name: bound client method
+        for name, priority in REQUEST_PRIORITY.items():
+            original = getattr(ib.client, name, None)
+            if original is None:
+                continue
+            self._originals[name] = original
+            setattr(ib.client, name, self._paced(name, priority))
+        ib.disconnectedEvent.connect(self.reset, keep_ref = True) # lives as long as the IB it paces
+
+    def close(self):
+        """restore the client methods (queued requests are dropped)"""
+        for name, original in self._originals.items():
+            setattr(self.ib.client, name, original)
+        self.ib.disconnectedEvent -= self.reset
+        self.reset()
+
+    def reset(self):
+        """connection lost: queued requests and lines are gone"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.queue.clear()
+        self.line_waiters.clear()
+        self.pending_mkt_data.clear()
+        self.lines.clear()
+        self.tokens = float(self.burst)
+
+    def queued(self) -> int:
+        return len(self.queue) + len(self.line_waiters)
+
+    def lines_waiting(self) -> int:
+        """market data requests waiting for a free line"""
+        return len(self.line_waiters)
+
+    def _loop(self):
+        return asyncio.get_event_loop()
+
+    def _refill(self):
+        now = self._loop().time()
+        if self._last_refill is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self._last_refill) * self.msg_rate)
+        self._last_refill = now
+
+    def _paced(self, name, priority):
+        def request(*args, **kwargs):
+            if name == 'cancelMktData' and self._drop_queued_mkt_data(args[0]):
+                return
+            if name == 'reqMktData':
+                self.pending_mkt_data.add(args[0])
+            heapq.heappush(self.queue, (priority, next(self._seq), self._loop().time(), name, args, kwargs))
+            self._dispatch()
+        request.__name__ = name
+        return request
+
+    def _drop_queued_mkt_data(self, reqId) -> bool:
+        """a cancel of market data that was never sent removes the request instead"""
+        if reqId not in self.pending_mkt_data:
+            return False
+        self.pending_mkt_data.discard(reqId)
+        self.queue = [item for item in self.queue if not (item[3] == 'reqMktData' and item[4][0] == reqId)]
+        self.line_waiters = [item for item in self.line_waiters if item[4][0] != reqId]
+        heapq.heapify(self.queue)
+        heapq.heapify(self.line_waiters)
+        self.stats['dropped_cancels'] += 1
+        return True
+
+    def _sendable(self) -> bool:
+        return bool(self.queue) or (bool(self.line_waiters) and len(self.lines) < self.max_lines)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._sendable():
+            if self.tokens < 1 and not (self.queue and self.queue[0][0] == ORDER and self.tokens >= 1 - self.order_reserve):
+                break
+            # a freed line goes to the oldest waiting market data request of the highest priority
+            if self.line_waiters and len(self.lines) < self.max_lines and (not self.queue or self.line_waiters[0] <= self.queue[0]):
+                item = heapq.heappop(self.line_waiters)
+            else:
+                item = heapq.heappop(self.queue)
+                if item[3] == 'reqMktData' and len(self.lines) >= self.max_lines:
+                    heapq.heappush(self.line_waiters, item)
+                    self.stats['line_waits'] += 1
+                    continue
+            self._send(*item)
+        if self._sendable() and self.tokens < 1:
+            self._timer = self._loop().call_later((1 - self.tokens) / self.msg_rate, self._dispatch)
+
+    def _send(self, priority, seq, enqueued, name, args, kwargs):
+        self.tokens -= 1
+        waited = self._loop().time() - enqueued
+        if waited > 0.001:
+            self.stats['delayed'] += 1
+            metrics.observe('pacing_wait', waited, priority = priority)
+        if name == 'reqMktData':
+            reqId, snapshot = args[0], args[3]
+            self.pending_mkt_data.discard(reqId)
+            self.lines.add(reqId)
+            if snapshot:
+                self._loop().call_later(self.snapshot_hold, self._release_line, reqId)
+        elif name == 'cancelMktData':
+            self._release_line(args[0], dispatch = False)
+        self.stats['sent'] += 1
+        self._originals[name](*args, **kwargs)
+
+    def _release_line(self, reqId, dispatch = True):
+        if reqId in self.lines:
+            self.lines.discard(reqId)
+            if dispatch and self.line_waiters:
+                self._dispatch()
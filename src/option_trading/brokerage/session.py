@@ -0,0 +1,117 @@
+import sys
+import asyncio
+from ib_insync import *
+from brokerage.pacing import pacingGovernor
+from brokerage.market_data import marketDataHub
+from brokerage.contract_cache import contractCache
+from brokerage.order_book import orderBook
+from portfolio.position_manager import positionManager
+
+
+class ibSession:
+    """One IB connection and the state its strategies share (pacing, market data, contracts, positions, orders),
+    other shared objects are created once with shared(key, factory). Reconnects unless stopped"""
+    def __init__(self, host: str, port: int, clientId = 0, ib: IB = None, logger = None, alerts = None,
+                 contract_cache_dir = '.cache/contracts', msg_rate = 40, max_lines = 100, connect_attempt = 10):
+        self.host = host
+        self.port = int(port)
+        self.clientId = clientId
+        self.logger = logger
+        self.alerts = alerts
+        self.connect_attempt = connect_attempt
+        self.reconnect = True
+        # IB Client (an already constructed IB can be injected, e.g. benchmarks/fake_ib.py)
+        self.ib = ib if ib is not None else IB()
+        # message rate / market data line limits, orders are sent ahead of queued chain requests
+        self.pacing = pacingGovernor(self.ib, msg_rate = msg_rate, max_lines = max_lines)
+        self.market_data = marketDataHub(self.ib)
+        self.contract_cache = contractCache(contract_cache_dir)
+        self.positions = positionManager()
+        self.order_book = None
+        self.underlyings = dict() # (symbol, exchange, primary exchange, currency): qualified Stock
+        self.resources = dict()   # key: object shared by the strategies
+        self.inflight = dict()    # key: asyncio.Task of a request shared by concurrent callers
+        self.symbol_owners = dict() # symbol: name of the strategy handling untagged orders on it
+        self.ib.disconnectedEvent += self.on_disconnection
+
+    def connect(self):
+        curr_reconnect = 0
+        delay = 30
+        while True:
+            try:
+                self.ib.connect(self.host, self.port, self.clientId)
+                if self.ib.isConnected():
+                    break
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.warning(f"Connection attempt {curr_reconnect + 1} failed: {e!r}")
+            # raised or returned without a connection
+            if curr_reconnect < self.connect_attempt:
+                curr_reconnect += 1
+                self.ib.sleep(delay)
+            else:
+                if self.logger is not None:
+                    self.logger.error(f"Reconnect failure after {self.connect_attempt} tries")
+                sys.exit()
+        if self.order_book is None:
+            self.start()
+        else:
+            self.resync()
+
+    def start(self):
+        """once connected: delayed data fallback, positions and open orders"""
+        self.ib.reqMarketDataType(3)
+        self.positions.load(self.ib.positions())
+        self.ib.positionEvent += self.positions.apply
+        self.order_book = orderBook(self.ib)
+
+    def resync(self):
+        """after a reconnect: positions and open orders may have changed while disconnected"""
+        self.positions.load(self.ib.positions())
+        self.order_book.reload()
+        if self.logger is not None:
+            self.logger.info(f"Reconnected: {len(self.positions)} positions, {len(self.order_book)} open orders reloaded")
+
+    def stop(self):
+        self.reconnect = False
+        self.ib.disconnect()
+        if self.alerts is not None:
+            self.alerts.info("Initiated disconnection from IB...")
+
+    def run(self):
+        self.ib.run()
+
+    def underlying(self, symbol: str, exchange = 'SMART', currency = 'USD', primary_exchange = '') -> Stock:
+        """qualified stock contract, requested once per connection"""
+        key = (symbol, exchange, primary_exchange, currency)
+        contract = self.underlyings.get(key)
+        if contract is None:
+            contract = Stock(symbol, exchange, currency, primaryExchange = primary_exchange)
+            self.ib.qualifyContracts(contract)
+            self.underlyings[key] = contract
+        return contract
+
+    def register(self, symbol: str, name: str):
+        """the first strategy registered for a symbol owns its untagged orders (placed in TWS, other clients)"""
+        self.symbol_owners.setdefault(symbol, name)
+
+    def shared(self, key, factory):
+        """object registered under key, created with factory() on first use"""
+        if key not in self.resources:
+            self.resources[key] = factory()
+        return self.resources[key]
+
+    async def request_once(self, key, factory):
+        """result of factory() (a coroutine function), concurrent callers with the same key
+        await the same request instead of sending their own"""
+        task = self.inflight.get(key)
+        if task is None:
+            task = self.inflight[key] = asyncio.ensure_future(factory())
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def on_disconnection(self):
+        if not self.reconnect:
+            return
+        self.logger.warning("Disconnect Event: Attempting reconnection...")
+        self.connect()
@@ -2,30 +2,71 @@
 Ref:
 https://pypi.org/project/pandas-market-calendars/
 """
-import math
+import os
 import sys
+import time
+import asyncio
 import datetime
 from ib_insync import *
 from dotenv import dotenv_values
 from zoneinfo import ZoneInfo
-from utils.option_utils import get_date_today, get_nearest_expiry, convert_tickers_to_full_chain, noChainFoundException
+import pandas as pd
+from utils.option_utils import get_date_today, expiryResolver, convert_tickers_to_full_chain, filter_strike_window, noChainFoundException
+from utils.chain_index import ChainIndex, chain_index
+from utils.selection import select_short_put, hedge_credit_target, select_long_put
+from utils.greeks import fill_missing_greeks, year_fraction, bs_price, strike_for_delta, delta_strike_window, premium_strike_window, widen_strike_window
+from utils.trading_calendar import tradingCalendar, load_halt_days
 from utils.trade_utils import is_market_open_today
-from brokerage.orders import single_leg_bracket_order, replace_bracket_order
+from brokerage.orders import entry_orders, bracketOrderException
 from brokerage.contracts import specific_option_contract
-from services.db_service import DBService
+from brokerage.market_data import chainSnapshot
+from brokerage.session import ibSession
+from brokerage.fill_reconciler import fillReconciler
+from brokerage.order_state import wait_for_order_state, wait_for_orders, orderStateException
+from services.db_service import DBService, writeBehindCollection
+from services.chain_recorder import chainRecorder
+from services.metrics import metrics, samplingProfiler
 from services.logging_service import loggerService
 from services.telegram_service import telegram
 
-def find_closest_credit(df, target_credit, side = 'ask'):
+def find_closest_credit(chain, target_credit, side = 'ask'):
+    """chain: ChainIndex (or a chain DataFrame, indexed for this call only)"""
     if side not in ['bid','ask']:
         return
-    return df.iloc[(df[side] - target_credit).abs().argsort()[0]]
+    return chain_index(chain).nearest_premium(target_credit, side = side)
 
-def find_closest_delta(df, target_delta = -0.15):
-    return df.iloc[(df['delta'] - target_delta).abs().argsort()[0]]
+def find_closest_delta(chain, target_delta = -0.15):
+    return chain_index(chain).nearest_delta(target_delta)
+    
+def params_from_config(config: dict) -> dict:
+    """strategy params of a 90dte document of the configs collection"""
+    symbol = config.get('symbol', 'SPY')
+    return {
+        'STRATEGY_NAME': config.get('name', "90DTE"), # unique per strategy sharing a connection (orderRef)
+        'SYMBOL': symbol,
+        'EXCHANGE': config.get('exchange', 'SMART'),
+        'PRIMARY_EXCHANGE': config.get('primary_exchange', 'ARCA'),
+        'CURRENCY': config.get('currency', 'USD'),
+        'TRADING_CLASS': config.get('trading_class', symbol),
+        'MULTIPLIER': config.get('multiplier', 100),
+        'HEDGE_RATIO': config['hedge_ratio'], # no. of hedges vs shorts
+        'DAILY_PREMIUM': config['daily_premium'],
+        'SHORT_DELTA_TARGET': config['short_delta_target'],
+        'SHORT_DELTA_TOLERANCE': 0.03, # delta
+        'HEDGE_CREDIT_TARGET': config['hedge_credit_target'], 
+        'HEDGE_CREDIT_TOLERANCE':0.05, #dollar
+        'SHORT_DTE': config['short_dte'],
+        'HEDGE_DTE': config['hedge_dte'],
+        'RISK_FREE_RATE': config.get('risk_free_rate', 0.05), # for local greeks fallback
+        'DIVIDEND_YIELD': config.get('dividend_yield', 0.013),
+        'IV_ESTIMATE': config.get('iv_estimate', 0.2), # for strike window of chain requests
+        'COMBO_ORDER': config.get('combo_order', True), # new spreads as one BAG order instead of leg by leg
+        'STOPLOSS': config['stop_loss'],
+        'TAKEPROFIT': config['take_profit'],
+    }
     
 class ninetyDTE:
-    def __init__(self, auth_config, services, params):
+    def __init__(self, auth_config, services, params, ib: IB = None, session: ibSession = None):
         # strategy details
         self.today = get_date_today()
         self.params = params
@@ -33,66 +74,69 @@ class ninetyDTE:
         # Other services
         self.services = services
         self.db = self.services['db']
-        self.db_trades = self.db['ninety-dte-trades']
         self.logger = self.services['logger']
         self.alerts: telegram = self.services['alerts']
-        # IB Client
-        self.ib = IB()
+        # IB connection, pacing, market data lines, contract cache, positions and order book
+        # are shared by every strategy of a session (strategy_runner.py), one is opened if none is given
+        if session is None:
+            session = ibSession(auth_config['TWS_HOST'], auth_config['TWS_PORT'], clientId = 0, ib = ib,
+                                logger = self.logger, alerts = self.alerts)
+            session.connect()
+        self.session = session
+        self.ib = session.ib
+        self.pacing = session.pacing
         self.subscribe_events()
-        self.host = auth_config['TWS_HOST']
-        self.port = int(auth_config['TWS_PORT'])
-        self.clientId = 0
-        self.connect()
 
         # other params: MAX attempts
         self.replace_cancelled_orders_attempt = 3
         self.get_option_chain_attempt = 3
-        self.connect_attempt = 10
+        self.option_chain_timeout = 30 # seconds to wait for a complete chain per attempt
+        self.local_greeks_fallback = True # compute missing greeks locally instead of waiting for IB
+        self.greeks_max_und_drift = 0.005 # IB greeks off by more than 0.5% in underlying price are stale
+        self.delta_window_margin = 0.05 # request strikes within delta target +/- (tolerance + margin)
+        self.premium_window_band = 0.5 # request strikes with model premium within +/- 50% of hedge target
+        self.strike_window_widen_attempt = 3
+        self.chain_deadline = 90 # seconds for contracts + both option chains
+        self.order_submit_timeout = 10 # seconds for an order to be acknowledged (Submitted) before it is reported as stuck
+        self.metrics_file = None # prometheus text file written after each run_strategy (services/metrics.py)
+        self.profile_dir = None # opt-in: sampled flame graph (folded stacks) of each run_strategy
         
         # symbol
-        self.symbol = 'SPY'
-        self.exchange = 'SMART'
-        self.primary_exchange = 'ARCA'
-        self.ccy = 'USD'
-        self.trading_class = 'SPY'
-        self.multiplier = 100
-        self.underlying_contract = Stock(self.symbol, self.exchange, self.ccy, primaryExchange = self.primary_exchange)
-        self.ib.qualifyContracts(self.underlying_contract)
-        self.ib.reqMarketDataType(3)
-        self.ib.sleep(3)
-        # check market open
-        if not is_market_open_today(self.ib, self.underlying_contract):
-            self.logger(f"{self.strategy_name}: Not trading day today. Program skipped")
-            self.stop()
-            sys.exit()
-            
+        self.symbol = self.params.get('SYMBOL', 'SPY')
+        self.exchange = self.params.get('EXCHANGE', 'SMART')
+        self.primary_exchange = self.params.get('PRIMARY_EXCHANGE', 'ARCA')
+        self.ccy = self.params.get('CURRENCY', 'USD')
+        self.trading_class = self.params.get('TRADING_CLASS', self.symbol)
+        self.multiplier = self.params.get('MULTIPLIER', 100)
+        # every chain snapshot, see services/chain_recorder.py (one store per underlying)
+        self.chain_history_dir = '.cache/chains' if self.symbol == 'SPY' else f'.cache/chains/{self.symbol}'
+        self.underlying_contract = session.underlying(self.symbol, self.exchange, self.ccy, self.primary_exchange)
+        session.register(self.symbol, self.strategy_name)
+        self.contract_cache = session.contract_cache
+        self.chain_recorder = session.shared(('chains', self.chain_history_dir),
+                                             lambda: chainRecorder(self.chain_history_dir, logger = self.logger))
+        # fills are persisted by a background writer so order handling never waits on MongoDB
+        self.db_trades = session.shared(('journal', 'ninety-dte-trades'),
+                                        lambda: writeBehindCollection(self.db['ninety-dte-trades'], 
+                                                                      journal_path = '.cache/journal/ninety-dte-trades.jsonl',
+                                                                      logger = self.logger))
         # States - Orders, order statuses, trades, contracts etc.
         self.filtered_contracts = dict()
-        self.positions = self.ib.positions()
+        self.contracts_by_conId = dict() # conId: qualified option contract of the current chains
+        self.und_price = None
+        self.expiries = None # expiryResolver of the chain
+        self.positions = session.positions
+        self.order_book = session.order_book
+        self.fill_reconciler = fillReconciler(self.ib, self.positions, self.order_book,
+                                              logger = self.logger, alerts = self.alerts, name = self.strategy_name)
         self.trade_dict = dict()
-        
-    def connect(self):
-        curr_reconnect = 0 
-        delay = 30
-        while True:
-            try:
-                self.ib.connect(self.host, self.port,self.clientId)
-                if self.ib.isConnected():
-                    break
-            except Exception as e:
-                if curr_reconnect < self.connect_attempt:
-                    curr_reconnect += 1
-                    self.ib.sleep(delay)
-                else:
-                    self.logger.error(f"Reconnect failure after {self.connect_attempt} tries")
-                    sys.exit()
+    
         
     def run(self):
         self.ib.run()
     
     def stop(self):
-        self.ib.disconnect()
-        self.alerts.info("Initiated disconnection from IB...")
+        self.session.stop()
         
     def exit_program(self):
         self.alerts.info(f"{self.strategy_name}: Program exited at market close")
@@ -100,112 +144,305 @@ class ninetyDTE:
     
     def subscribe_events(self):
         """subscribe to callbacks to listen to events"""
+        # reconnection and positions are handled by the session
         self.ib.orderStatusEvent += self.on_order_status_event
-        self.ib.disconnectedEvent += self.on_disconnection
-        self.ib.positionEvent += self.on_position
 
     
     ##################
     # STRATEGY LOGIC #
     ##################
-    def get_all_expirations(self):
-            chains = self.ib.reqSecDefOptParams(self.underlying_contract.symbol, 
-                                                '', 
-                                                self.underlying_contract.secType, 
-                                                self.underlying_contract.conId)
-            chain = next(c for c in chains if c.tradingClass == self.trading_class and c.exchange == self.exchange)
-            all_expirations = sorted(exp for exp in chain.expirations)
-            return all_expirations
+    async def get_all_expirations_async(self):
+        all_expirations = self.contract_cache.get_expirations(self.symbol, self.trading_class)
+        if all_expirations is None:
+            all_expirations = await self.session.request_once(('expirations', self.symbol, self.trading_class),
+                                                              self.request_expirations_async)
+        return all_expirations
     
-    def get_all_contracts(self):
-        exp_list = self.get_all_expirations()
-        
-        short_put_expiration = get_nearest_expiry(exp_list, params['SHORT_DTE'])
-        hedge_expiration = get_nearest_expiry(exp_list, params['HEDGE_DTE'])
-        ## SHORT LEG
-        short_cds = self.ib.reqContractDetails(
-            Option(
-                symbol = self.underlying_contract.symbol, 
-                lastTradeDateOrContractMonth=short_put_expiration, 
-                right = "P",
-                exchange = self.exchange, 
-                tradingClass = self.trading_class)
-            )
-        short_contracts = [cd.contract for cd in short_cds]
-        self.short_contracts = self.ib.qualifyContracts(*short_contracts)
-        self.ib.sleep(15)
-        ## HEDGE LEG
-        hedge_cds = self.ib.reqContractDetails(
+    async def request_expirations_async(self):
+        chains = await self.ib.reqSecDefOptParamsAsync(self.underlying_contract.symbol, 
+                                                       '', 
+                                                       self.underlying_contract.secType, 
+                                                       self.underlying_contract.conId)
+        chain = next(c for c in chains if c.tradingClass == self.trading_class and c.exchange == self.exchange)
+        all_expirations = sorted(exp for exp in chain.expirations)
+        self.contract_cache.put_expirations(self.symbol, self.trading_class, all_expirations)
+        self.contract_cache.put_strikes(self.symbol, self.trading_class, list(chain.strikes))
+        return all_expirations
+    
+    async def get_expiry_resolver_async(self) -> expiryResolver:
+        """expirations and strike grid of the chain, parsed once per day and session"""
+        exp_list = await self.get_all_expirations_async()
+        return self.session.shared(('expiries', self.symbol, self.trading_class, self.today),
+                                   lambda: expiryResolver(exp_list, strikes = self.contract_cache.get_strikes(self.symbol, self.trading_class)))
+    
+    async def get_option_contracts_async(self, expiration, right = "P"):
+        """qualified option contracts of an expiration (from the contract cache if seen today)"""
+        contracts = self.contract_cache.get(self.symbol, self.trading_class, expiration, right)
+        if contracts is None:
+            # strategies of the session asking for the same expiration wait for one request
+            contracts = await self.session.request_once(('contracts', self.symbol, self.trading_class, expiration, right),
+                                                        lambda: self.request_option_contracts_async(expiration, right))
+        return contracts
+    
+    async def request_option_contracts_async(self, expiration, right = "P"):
+        # contract details are already fully qualified (conId, localSymbol, multiplier)
+        cds = await self.ib.reqContractDetailsAsync(
             Option(
                 symbol = self.underlying_contract.symbol, 
-                lastTradeDateOrContractMonth=hedge_expiration, 
-                right = "P",
+                lastTradeDateOrContractMonth = expiration, 
+                right = right,
                 exchange = self.exchange, 
                 tradingClass = self.trading_class)
             )
-        hedge_contracts = [cd.contract for cd in hedge_cds]
-        self.hedge_contracts = self.ib.qualifyContracts(*hedge_contracts)
-        self.ib.sleep(15)
+        contracts = [cd.contract for cd in cds]
+        self.contract_cache.put(self.symbol, self.trading_class, expiration, right, contracts)
+        return contracts
     
+    @metrics.timed('contracts')
+    async def get_all_contracts_async(self):
+        self.expiries = await self.get_expiry_resolver_async()
+        short_put_expiration, hedge_expiration = self.expiries.resolve([self.params['SHORT_DTE'], self.params['HEDGE_DTE']], today = self.today)
+        # SHORT LEG and HEDGE LEG concurrently
+        self.short_contracts, self.hedge_contracts = await asyncio.gather(
+            self.get_option_contracts_async(short_put_expiration),
+            self.get_option_contracts_async(hedge_expiration))
+        # strikes actually listed for the two expirations (for strike windows without another request)
+        self.expiries.set_strikes(short_put_expiration, [c.strike for c in self.short_contracts])
+        self.expiries.set_strikes(hedge_expiration, [c.strike for c in self.hedge_contracts])
+        # qualified contracts by conId, chain rows point back to them (no re-qualification before ordering)
+        self.contracts_by_conId = {c.conId: c for c in self.short_contracts + self.hedge_contracts}
+    
+    def get_all_expirations(self):
+        return util.run(self.get_all_expirations_async())
     
-    def get_option_chain(self, contracts):
+    def get_all_contracts(self):
+        return util.run(self.get_all_contracts_async())
+    
+    def prewarm_contracts(self):
+        """fill the contract cache before market open so run_strategy does not wait on IB"""
+        self.get_all_contracts()
+        self.logger.info(f"{self.strategy_name}: Contract cache warmed ({len(self.short_contracts)} short, {len(self.hedge_contracts)} hedge contracts)")
+    
+    @metrics.timed('und_price')
+    async def get_underlying_price_async(self):
+        ticker = (await self.ib.reqTickersAsync(self.underlying_contract))[0]
+        price = ticker.marketPrice()
+        return ticker.close if util.isNan(price) else price
+    
+    def get_underlying_price(self):
+        return util.run(self.get_underlying_price_async())
+    
+    @metrics.timed('option_chain')
+    async def get_option_chain_async(self, contracts, strike_window = None, deadline = None):
+        """option chain of contracts (only strikes inside strike_window if given)
+        deadline (time.perf_counter) is shared between chains collected concurrently"""
+        contracts = filter_strike_window(contracts, strike_window)
         attempts = 1
-        # aggregate full chain (reattempt in 30s if failed for 3 attempts)
+        # stream the chain until every ticker has bid/ask/greeks (re-request missing tickers if deadline passes)
+        # with local greeks fallback, only bid/ask are waited for
+        snapshot = chainSnapshot(self.ib, contracts, need_greeks = not self.local_greeks_fallback, pacing = self.pacing,
+                                 market_data = self.session.market_data)
+        snapshot.subscribe()
         while attempts <= self.get_option_chain_attempt:
             self.alerts.info(f"Attempt {attempts}: Requesting option chain...")
-            tickers = self.ib.reqTickers(*contracts)
-            self.ib.sleep(30)
-            try:
-                df = convert_tickers_to_full_chain(tickers)
-            except noChainFoundException as e:
-                if attempts == self.get_option_chain_attempt:
-                    self.alerts.info(f"{self.strategy_name}: Missing data for tickers. Program exited after 3 attempts. Please troubleshoot market data subscription manually.")
-                    sys.exit()
-                self.ib.sleep(30)
-                attempts += 1
-            else: 
-                break 
-            
+            timeout = self.option_chain_timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.perf_counter())
+            with metrics.span('option_chain_attempt', attempt = attempts):
+                complete = await snapshot.wait_async(timeout)
+            if complete:
+                break
+            metrics.inc('option_chain_incomplete')
+            self.logger.info("%s: Option chain incomplete %s", self.strategy_name, snapshot.progress())
+            if attempts == self.get_option_chain_attempt or (deadline is not None and time.perf_counter() >= deadline):
+                snapshot.cancel()
+                raise noChainFoundException(f"{self.strategy_name}: Missing data for tickers after {attempts} attempts. Please troubleshoot market data subscription manually.")
+            snapshot.resubscribe_missing()
+            attempts += 1
+        snapshot.cancel()
+        self.logger.info("%s: Option chain snapshot %s", self.strategy_name, snapshot.progress())
+        df = convert_tickers_to_full_chain(snapshot.tickers, partial = self.local_greeks_fallback)
+        if self.local_greeks_fallback:
+            df = self.fill_local_greeks(df)
         return df.sort_values('strike').reset_index(drop = True)
     
+    def get_option_chain(self, contracts, strike_window = None):
+        return util.run(self.get_option_chain_async(contracts, strike_window))
+    
+    async def get_bracketed_chain_async(self, contracts, column, target, strike_window, chain: ChainIndex = None, deadline = None) -> ChainIndex:
+        """Request the chain inside strike_window only, widening the window (and requesting 
+        only the new strikes) until target is bracketed by the chain's column values.
+        Returns the chain's ChainIndex (indexed once per requested batch, .df is the chain)
+        chain: chain already collected for these contracts (extended, not requested again)"""
+        fetched = set() if chain is None else set(chain.df['conId'])
+        for attempt in range(self.strike_window_widen_attempt + 1):
+            new_contracts = [c for c in filter_strike_window(contracts, strike_window) if c.conId not in fetched]
+            if new_contracts:
+                chain = await self.extend_chain_async(chain, new_contracts, deadline)
+                fetched.update(c.conId for c in new_contracts)
+            if chain is not None and chain.brackets(column, target):
+                break
+            if len(fetched) == len(contracts):
+                break
+            self.logger.info(f"{self.strategy_name}: {column} target {target:.3f} not bracketed by strikes {strike_window[0]:.1f}-{strike_window[1]:.1f}. Widening window")
+            strike_window = widen_strike_window(strike_window)
+        remaining = [c for c in contracts if c.conId not in fetched]
+        if remaining and (chain is None or not chain.brackets(column, target)):
+            # widening ran out: fall back to the rest of the full chain
+            self.logger.info(f"{self.strategy_name}: {column} target {target:.3f} still not bracketed. Requesting the remaining {len(remaining)} contracts")
+            chain = await self.extend_chain_async(chain, remaining, deadline)
+        self.logger.info(f"{self.strategy_name}: Requested {len(chain)} of {len(contracts)} contracts")
+        return chain
+    
+    def get_bracketed_chain(self, contracts, column, target, strike_window, chain = None):
+        return util.run(self.get_bracketed_chain_async(contracts, column, target, strike_window, chain))
+    
+    async def extend_chain_async(self, chain: ChainIndex, contracts, deadline = None) -> ChainIndex:
+        """index of chain plus the chain of contracts (strike sorted)"""
+        new_df = await self.get_option_chain_async(contracts, deadline = deadline)
+        if chain is None:
+            return ChainIndex(new_df)
+        return ChainIndex(pd.concat([chain.df, new_df]).sort_values('strike').reset_index(drop = True))
+    
+    def fill_local_greeks(self, df):
+        """fill missing/stale IB greeks with the local Black-Scholes pricer, priced off the fetched underlying price"""
+        und_price = self.und_price
+        if und_price is None and not df['has_greeks'].any():
+            und_price = self.get_underlying_price()
+        df = fill_missing_greeks(df, 
+                                 und_price = und_price,
+                                 rate = self.params['RISK_FREE_RATE'], 
+                                 dividend = self.params['DIVIDEND_YIELD'],
+                                 max_und_drift = self.greeks_max_und_drift)
+        self.logger.info(f"{self.strategy_name}: Greeks source {df['greeks_source'].value_counts().to_dict()}")
+        return df
+    
     def schedule_all_tasks(self):
         """INDICATE WHAT TASKS YOU WANT TO RUN HERE"""
         # avoid PYTZ (use ZoneInfo instead)
-        self.ib.schedule(datetime.datetime(int(today[:4]),int(today[4:6]), int(today[6:8]), 10, 28, 0, tzinfo =ZoneInfo("US/Eastern")),
+        self.ib.schedule(datetime.datetime(int(self.today[:4]),int(self.today[4:6]), int(self.today[6:8]), 9, 0, 0, tzinfo =ZoneInfo("US/Eastern")),
+                         self.prewarm_contracts)
+        self.ib.schedule(datetime.datetime(int(self.today[:4]),int(self.today[4:6]), int(self.today[6:8]), 10, 28, 0, tzinfo =ZoneInfo("US/Eastern")),
                          self.run_strategy)        
-        self.ib.schedule(datetime.datetime(int(today[:4]),int(today[4:6]), int(today[6:8]), 17, 0, 0, tzinfo =ZoneInfo("US/Eastern")), 
+        self.ib.schedule(datetime.datetime(int(self.today[:4]),int(self.today[4:6]), int(self.today[6:8]), 17, 0, 0, tzinfo =ZoneInfo("US/Eastern")), 
                          self.exit_program)
         self.alerts.info(f"{self.strategy_name}: trade scheduled!")
         
+    def short_strike_window(self):
+        """strikes around the short delta target (from underlying price and IV estimate)"""
+        delta_band = self.params['SHORT_DELTA_TOLERANCE'] + self.delta_window_margin
+        return delta_strike_window(self.params['SHORT_DELTA_TARGET'] - delta_band,
+                                   self.params['SHORT_DELTA_TARGET'] + delta_band,
+                                   self.und_price, 
+                                   self.params['IV_ESTIMATE'], 
+                                   year_fraction([self.short_contracts[0].lastTradeDateOrContractMonth])[0],
+                                   self.params['RISK_FREE_RATE'],
+                                   self.params['DIVIDEND_YIELD'])
+    
+    def hedge_strike_window(self, hedge_credit_target):
+        """strikes with model premium around the hedge credit target"""
+        return premium_strike_window([c.strike for c in self.hedge_contracts],
+                                     hedge_credit_target, 
+                                     max(hedge_credit_target * self.premium_window_band, self.params['HEDGE_CREDIT_TOLERANCE']),
+                                     self.und_price, 
+                                     self.params['IV_ESTIMATE'],
+                                     year_fraction([self.hedge_contracts[0].lastTradeDateOrContractMonth])[0],
+                                     rate = self.params['RISK_FREE_RATE'],
+                                     dividend = self.params['DIVIDEND_YIELD'])
+    
+    def estimate_hedge_credit_target(self):
+        """hedge credit target from the model premium at the short delta target
+        (lets the hedge chain be requested before the short put is selected)"""
+        T = year_fraction([self.short_contracts[0].lastTradeDateOrContractMonth])[0]
+        args = (self.params['IV_ESTIMATE'], T, self.params['RISK_FREE_RATE'], self.params['DIVIDEND_YIELD'])
+        strike = strike_for_delta(self.params['SHORT_DELTA_TARGET'], self.und_price, *args)
+        short_premium = bs_price(self.und_price, strike, T, self.params['RISK_FREE_RATE'], self.params['DIVIDEND_YIELD'], self.params['IV_ESTIMATE'], False)
+        return float(short_premium) * self.params['HEDGE_CREDIT_TARGET'] / self.params['HEDGE_RATIO']
+    
+    @metrics.timed('strike_selection', leg = 'short_put')
+    def select_short_put(self):
+        self.short_put = select_short_put(self.short_chain_index, self.params)
+        if self.short_put is None:
+            self.alerts.info(f"{self.strategy_name}: No short contract found within the targeted delta range. No order placed")
+            return False
+        return True
+    
+    def hedge_credit_target(self):
+        return hedge_credit_target(self.short_put, self.params)
+    
+    @metrics.timed('strike_selection', leg = 'long_put')
+    def select_long_put(self, hedge_credit_target):
+        self.long_put = select_long_put(self.hedge_chain_index, hedge_credit_target, self.params)
+        if self.long_put is None:
+            self.alerts.info(f"{self.strategy_name}: No long put found within the targeted credit range. No order placed.")
+            return False
+        return True
     
     def run_strategy(self):
         util.startLoop()
-        # Get option chain
-        self.get_all_contracts()
-        self.alerts.info(f"{self.strategy_name}: Getting option chain for short leg:")
-        self.short_chain_df =self.get_option_chain(self.short_contracts)
-        self.alerts.info(f"{self.strategy_name}: Getting option chain for long leg (hedge):")
-        self.hedge_chain_df = self.get_option_chain(self.hedge_contracts)
+        profiler = samplingProfiler().start() if self.profile_dir else None
+        try:
+            util.run(self.run_strategy_async())
+        except noChainFoundException as e:
+            self.alerts.info(f"{e} Program exited.")
+            sys.exit()
+        finally:
+            if profiler is not None:
+                path = os.path.join(self.profile_dir, f"run_strategy-{datetime.datetime.now():%Y%m%d-%H%M%S}.folded")
+                profiler.stop().write_collapsed(path)
+                self.logger.info(f"{self.strategy_name}: run_strategy profile ({profiler.samples} samples) written to {path}")
+            if self.metrics_file:
+                metrics.write_prometheus(self.metrics_file)
+    
+    @metrics.timed('run_strategy')
+    async def run_strategy_async(self):
+        """Get contracts and both option chains concurrently (shared deadline), select legs and place orders"""
+        deadline = time.perf_counter() + self.chain_deadline
+        await self.get_all_contracts_async()
+        self.und_price = await self.get_underlying_price_async()
+        # the hedge target depends on the short put premium, request hedge strikes around a model estimate
+        hedge_credit_estimate = self.estimate_hedge_credit_target()
+        self.alerts.info(f"{self.strategy_name}: Getting option chain for short leg and long leg (hedge):")
+        self.short_chain_index, self.hedge_chain_index = await asyncio.gather(
+            self.get_bracketed_chain_async(self.short_contracts, 'delta', self.params['SHORT_DELTA_TARGET'], 
+                                           self.short_strike_window(), deadline = deadline),
+            self.get_bracketed_chain_async(self.hedge_contracts, 'ask', hedge_credit_estimate, 
+                                           self.hedge_strike_window(hedge_credit_estimate), deadline = deadline))
+        self.short_chain_df, self.hedge_chain_df = self.short_chain_index.df, self.hedge_chain_index.df
         
         # find SHORT and LONG contract
-        self.short_put = find_closest_delta(self.short_chain_df,params['SHORT_DELTA_TARGET'])
-        if abs(self.short_put['delta'] - self.params['SHORT_DELTA_TARGET']) > self.params['SHORT_DELTA_TOLERANCE']:
-            self.alerts.info(f"{self.strategy_name}: No short contract found within the targeted delta range. No order placed")
+        if not self.select_short_put():
+            self.record_chains()
             return
-        
-        hedge_credit_target = self.short_put['bid'] * params['HEDGE_CREDIT_TARGET'] / (params['HEDGE_RATIO'])
-        self.long_put = find_closest_credit(self.hedge_chain_df, hedge_credit_target, side = 'ask')
-        if abs(self.long_put['ask'] - hedge_credit_target) > self.params['HEDGE_CREDIT_TOLERANCE']:
-            self.alerts.info(f"{self.strategy_name}: No long put found within the targeted credit range. No order placed.")
+        hedge_credit_target = self.hedge_credit_target()
+        if not self.hedge_chain_index.brackets('ask', hedge_credit_target):
+            # estimate missed: extend the hedge chain around the actual target
+            self.hedge_chain_index = await self.get_bracketed_chain_async(self.hedge_contracts, 'ask', hedge_credit_target, 
+                                                                          self.hedge_strike_window(hedge_credit_target), 
+                                                                          chain = self.hedge_chain_index, deadline = deadline)
+            self.hedge_chain_df = self.hedge_chain_index.df
+        self.record_chains()
+        if not self.select_long_put(hedge_credit_target):
             return
+        await self.place_orders_async()
 
+    def record_chains(self):
+        """persist both chain snapshots (written by the recorder thread)"""
+        self.chain_recorder.record(self.short_chain_df, label = 'short')
+        self.chain_recorder.record(self.hedge_chain_df, label = 'hedge')
+    
+    async def place_orders_async(self):
+        """qualify selected contracts, place the spread (or long put then short put bracket)"""
         self.filtered_contracts = {
-            "short_put": specific_option_contract(self.short_put['index']),
-            "long_put": specific_option_contract(self.long_put['index']),
+            "short_put": self.chain_contract(self.short_put),
+            "long_put": self.chain_contract(self.long_put),
         }
-        # Qualify contracts
-        tradable_contracts = self.ib.qualifyContracts(*list(self.filtered_contracts.values()))
-        if len(tradable_contracts) == 2:
+        # Qualify only contracts that were not already qualified with the chain
+        unqualified = [c for c in self.filtered_contracts.values() if c is not None and not c.conId]
+        if unqualified:
+            with metrics.span('qualify_contracts'):
+                await self.ib.qualifyContractsAsync(*unqualified)
+        if all(c is not None and c.conId for c in self.filtered_contracts.values()):
             self.alerts.info(f"{self.strategy_name} Short leg found:  {self.filtered_contracts['short_put'].localSymbol} @ {self.short_put['bid']}")
             self.alerts.info(f"{self.strategy_name} Long leg found:  {self.filtered_contracts['long_put'].localSymbol} @ {self.long_put['ask']}")
         else:
@@ -214,70 +451,115 @@ class ninetyDTE:
             self.alerts.info(exit_msg)
             return
         
-        # Modify or add position
- 
-        if self.filtered_contracts['short_put'].localSymbol in [p.contract.localSymbol for p in self.positions]:
+        # every order is built (and checked) before the first one is sent
+        try:
+            plan = entry_orders(self.ib, self.filtered_contracts['short_put'], self.filtered_contracts['long_put'],
+                                self.short_put, self.long_put, self.params, self.positions,
+                                order_book = self.order_book, multiplier = self.multiplier)
+        except bracketOrderException as e:
+            self.logger.error(f"{self.strategy_name}: Existing bracket not resized, no order placed. {e}")
+            self.alerts.error(f"{self.strategy_name}: Existing bracket not resized, no order placed. {e}")
+            return
+        if plan['modify_position']:
             self.alerts.info(f"{self.strategy_name}: Contracts {self.filtered_contracts['short_put'].localSymbol} already exist in position.")
-            modify_position = True
-        else:
-            modify_position = False
-        
-        # Calculate positions
-        short_qty = max(math.floor(params['DAILY_PREMIUM'] / (self.short_put['bid'] * self.multiplier)),1)
-        hedge_qty = short_qty * params['HEDGE_RATIO']
+        if plan['credit'] is not None:
+            await self.place_combo_order_async(plan)
+            return
         
-        # # Place order (if naked puts not allowed in trading account level, long has to be placed first)
-        long_put_order = MarketOrder('BUY', hedge_qty)
-        long_put_trade = self.ib.placeOrder(self.filtered_contracts['long_put'], long_put_order)
+        stage, long_contract, (long_put_order,) = plan['stages'][0]
+        long_put_trade = self.place_order(long_contract, long_put_order)
         self.alerts.info(f"{self.strategy_name} Order placed (Long put): {long_put_trade.order.action} {long_put_trade.order.totalQuantity} unit of {long_put_trade.contract.localSymbol}")
         
         self.trade_dict['long_put'] = long_put_trade
-        while not long_put_trade.isActive():
-            self.ib.waitOnUpdate()
-            
-        if modify_position:
-            positions = [p for p in self.positions if p.contract.localSymbol == self.filtered_contracts['short_put'].localSymbol]
-            assert len(positions) == 1
-            target_pos = positions[0]
-
-            short_put_bracket_orders = replace_bracket_order(ib= self.ib,
-                                                             target_pos = target_pos,
-                                                             add_qty = short_qty,
-                                                             price = self.short_put['ask'], 
-                                                             SL = params['STOPLOSS'], 
-                                                             TP = params['TAKEPROFIT'],
-                                                             parent_order_type = "MKT")
-            
-
-            
-        else:
-            short_put_bracket_orders = single_leg_bracket_order(ib = self.ib, 
-                                                                    action = 'SELL', 
-                                                                    qty = short_qty,
-                                                                    price = self.short_put['ask'], 
-                                                                    SL = params['STOPLOSS'], 
-                                                                    TP = params['TAKEPROFIT'],
-                                                                    parent_order_type= "LMT",
-                                                                    rounding = 0.01)
+        try:
+            with metrics.span('order_submitted', orders = 'long_put'):
+                await wait_for_order_state(long_put_trade, 'Submitted', timeout = self.order_submit_timeout)
+        except orderStateException as e:
+            self.logger.error(f"{self.strategy_name}: Long put not submitted, short put not placed. {e}")
+            self.alerts.error(f"{self.strategy_name}: Long put not submitted, short put not placed. {e}")
+            return
         
+        # the working bracket being resized is cancelled only once the hedge is in
+        for order in plan['cancel']:
+            self.ib.cancelOrder(order)
+        
+        # parent and children are placed back to back (the last child transmits the bracket) and awaited together
+        stage, short_contract, short_put_bracket_orders = plan['stages'][1]
+        bracket_trades = []
         for i, ord in enumerate(short_put_bracket_orders):
-            if ord is not None:
-                bracket_trade = self.ib.placeOrder(self.filtered_contracts['short_put'], ord)
-                if i == 0:
-                    self.trade_dict['short_put_parent'] = bracket_trade
-                    self.alerts.info(f"{self.strategy_name} Parent order placed (Short put): {bracket_trade.order.action} {bracket_trade.order.totalQuantity} unit of {bracket_trade.contract.localSymbol}")
-                    self.logger.info(f"{self.strategy_name} Parent order placed (Short put): {bracket_trade.order.action} {bracket_trade.order.totalQuantity} unit of {bracket_trade.contract.localSymbol}")
-                else:
-                    self.trade_dict[f'short_put_child_{i}'] = bracket_trade
-                    self.alerts.info(f"{self.strategy_name} Bracket order placed (Short put): {bracket_trade.order.action} {bracket_trade.order.totalQuantity} unit of {bracket_trade.contract.localSymbol}")
-                    self.logger.info(f"{self.strategy_name} Bracket order placed (Short put): {bracket_trade.order.action} {bracket_trade.order.totalQuantity} unit of {bracket_trade.contract.localSymbol}")
-                    
-                while not bracket_trade.isActive():
-                    self.ib.waitOnUpdate()
+            bracket_trade = self.place_order(short_contract, ord)
+            bracket_trades.append(bracket_trade)
+            if i == 0:
+                self.trade_dict['short_put_parent'] = bracket_trade
+                self.fill_reconciler.watch(bracket_trade)
+                self.alerts.info(f"{self.strategy_name} Parent order placed (Short put): {bracket_trade.order.action} {bracket_trade.order.totalQuantity} unit of {bracket_trade.contract.localSymbol}")
+                self.logger.info(f"{self.strategy_name} Parent order placed (Short put): {bracket_trade.order.action} {bracket_trade.order.totalQuantity} unit of {bracket_trade.contract.localSymbol}")
+            else:
+                self.trade_dict[f'short_put_child_{i}'] = bracket_trade
+                self.alerts.info(f"{self.strategy_name} Bracket order placed (Short put): {bracket_trade.order.action} {bracket_trade.order.totalQuantity} unit of {bracket_trade.contract.localSymbol}")
+                self.logger.info(f"{self.strategy_name} Bracket order placed (Short put): {bracket_trade.order.action} {bracket_trade.order.totalQuantity} unit of {bracket_trade.contract.localSymbol}")
         
-            
-        self.alerts.info(f"{self.strategy_name}: Short put bracket order is now active")
+        with metrics.span('order_submitted', orders = 'short_put_bracket'):
+            _, stuck = await wait_for_orders(bracket_trades, 'Submitted', timeout = self.order_submit_timeout)
+        if stuck:
+            metrics.inc('orders_stuck', len(stuck))
+            for e in stuck:
+                self.logger.error(f"{self.strategy_name}: Order stuck. {e}")
+                self.alerts.error(f"{self.strategy_name}: Order stuck. {e}")
+        else:
+            self.alerts.info(f"{self.strategy_name}: Short put bracket order is now active")
         self.alerts.info(f"{self.strategy_name} completed at {datetime.datetime.now()}")
+    
+    def chain_contract(self, row):
+        """qualified contract of a chain row (conId index), localSymbol parsing as fallback"""
+        contract = self.contracts_by_conId.get(int(row['conId']))
+        if contract is None:
+            contract = specific_option_contract(row['index'])
+        return contract
+    
+    async def place_combo_order_async(self, plan):
+        """place the credit spread (1 short put : HEDGE_RATIO long puts) as one BAG bracket order"""
+        credit = plan['credit']
+        if not plan['stages']:
+            exit_msg = f"{self.strategy_name}: Spread has no credit ({credit:.2f}). No order placed."
+            self.logger.info(exit_msg)
+            self.alerts.info(exit_msg)
+            return
+        stage, spread_contract, spread_orders = plan['stages'][0]
+        spread_trades = []
+        for i, ord in enumerate(spread_orders):
+            spread_trade = self.place_order(spread_contract, ord)
+            spread_trades.append(spread_trade)
+            self.trade_dict['spread_parent' if i == 0 else f'spread_child_{i}'] = spread_trade
+        order_msg = (f"{self.strategy_name} Combo order placed: {plan['short_qty']} x (SELL 1 {self.filtered_contracts['short_put'].localSymbol}"
+                     f" / BUY {self.params['HEDGE_RATIO']} {self.filtered_contracts['long_put'].localSymbol}) @ {credit:.2f} credit")
+        self.alerts.info(order_msg)
+        self.logger.info(order_msg)
+        
+        with metrics.span('order_submitted', orders = 'spread_bracket'):
+            _, stuck = await wait_for_orders(spread_trades, 'Submitted', timeout = self.order_submit_timeout)
+        if stuck:
+            metrics.inc('orders_stuck', len(stuck))
+            for e in stuck:
+                self.logger.error(f"{self.strategy_name}: Order stuck. {e}")
+                self.alerts.error(f"{self.strategy_name}: Order stuck. {e}")
+        else:
+            self.alerts.info(f"{self.strategy_name}: Spread bracket order is now active")
+        self.alerts.info(f"{self.strategy_name} completed at {datetime.datetime.now()}")
+    
+    def place_orders(self):
+        return util.run(self.place_orders_async())
+    
+    def place_order(self, contract: Contract, order: Order) -> Trade:
+        """orders are tagged with the strategy name (orderRef) so strategies sharing a connection tell them apart"""
+        order.orderRef = self.strategy_name
+        return self.ib.placeOrder(contract, order)
+    
+    def owns(self, trade: Trade) -> bool:
+        """order placed by this strategy (untagged orders belong to the first strategy registered for the symbol)"""
+        if trade.order.orderRef:
+            return trade.order.orderRef == self.strategy_name
+        return self.session.symbol_owners.get(trade.contract.symbol) == self.strategy_name
         
     ##################
     # EVENT HANDLERS #
@@ -285,77 +567,46 @@ class ninetyDTE:
 
     def on_order_status_event(self, trade: Trade):
         """OrderStatus Event"""
+        if not self.owns(trade):
+            return
         # if cancelled, replaces order
         if (trade.orderStatus.status == 'Cancelled') or (trade.orderStatus.status == "ApiCancelled"):
-            cancel_msg = f"*Order cancelled*: {trade.order.orderId} {trade.order.action} {trade.order.totalQuantity} of {trade.contract.localSymbol}"
-            self.logger.info(cancel_msg)
-            self.alerts.info(cancel_msg)
+            self.logger.info("%s: Order cancelled: %s %s %s of %s", self.strategy_name, trade.order.orderId,
+                             trade.order.action, trade.order.totalQuantity, trade.contract.localSymbol)
+            self.alerts.info(f"*Order cancelled*: {trade.order.orderId} {trade.order.action} {trade.order.totalQuantity} of {trade.contract.localSymbol}")
 
         if trade.orderStatus.status == "Filled":
             # post fill messages
-            fill_msg = f"*Fills*: {trade.contract.localSymbol} {trade.orderStatus.filled} unit filled at {trade.orderStatus.avgFillPrice}"
-            self.logger.info(f"*Fills*: {trade.contract.localSymbol} {trade.orderStatus.filled} unit filled at {trade.orderStatus.avgFillPrice}")
-            self.alerts.info(fill_msg)
+            self.logger.info("%s: Fills: %s %s unit filled at %s", self.strategy_name, trade.contract.localSymbol,
+                             trade.orderStatus.filled, trade.orderStatus.avgFillPrice)
+            self.alerts.info(f"*Fills*: {trade.contract.localSymbol} {trade.orderStatus.filled} unit filled at {trade.orderStatus.avgFillPrice}")
             
-            # update child order to match the position
-            if trade.order.orderId == self.trade_dict['short_put_parent'].order.orderId:
-                self.ib.sleep(5) # wait for positions to get updated
-                
-                pos = [p for p in self.positions if p.contract.localSymbol == trade.contract.localSymbol]
-                if len(pos) > 0:
-                    pos = pos[0]
-                    open_trades = [t for t in self.ib.openTrades() if t.contract.localSymbol == trade.contract.localSymbol]
-                    for t in open_trades:
-                        if t.order.totalQuantity == abs(pos.position): # if it's the same then don't update child order
-                                continue
-                        self.alerts.info(f"{self.strategy_name}: {t.contract.localSymbol} Update child order qty from {t.order.totalQuantity} to {abs(pos.position)}")
-                        new_order = t.order
-                        new_order.totalQuantity = abs(pos.position)
-                        # check this
-                        new_order.transmit = True
-                        self.ib.placeOrder(t.contract, new_order)
-                    
-
+            # children of the short put parent are resized to the position by the fill reconciler
             
             tdict = util.tree(trade)
-            # save to database
+            # save to database (queued, written in batches by the write behind worker)
             self.db_trades.insert_one(tdict)
     
-    def on_disconnection(self):
-        self.logger.warning("Disconnect Event: Attempting reconnection...")
-        self.connect()
-
-    def on_position(self, position: Position):
-        self.positions = self.ib.positions()
-        
 if __name__ == "__main__":
     
     today = get_date_today()
     auth_config = dotenv_values(".env")
     
     # Services connection (logger, DB, telegram)
-    logger = loggerService(auth_config['papertrail_host'], auth_config['papertrail_port'])
+    logger = loggerService(auth_config['papertrail_host'], auth_config['papertrail_port'], log_file = auth_config.get('log_file'))
     logger.info("Ping.")
-    tlg = telegram(auth_config['telegram_chatid'],auth_config['telegram_token'])
+    tlg = telegram(auth_config['telegram_chatid'],auth_config['telegram_token'], logger = logger)
     mongodb = DBService(auth_config = auth_config, logger = logger)
     mongodb.connect()
     db = mongodb.get_database('trade-buster')
     config = db['configs'].find_one({'strategy':'90dte'})
-    rest_days = mongodb.get_database('trading-utils')['trading_days_halt'].find()
+    # exchange sessions and halt days from the local calendar cache, checked before connecting to IB
+    halts = mongodb.get_database('trading-utils')['trading_days_halt']
+    calendar = tradingCalendar('NYSE', halt_source = lambda start: load_halt_days(halts, start))
+    if not calendar.exact:
+        logger.warning("pandas_market_calendars not installed, exchange holidays are checked with IB after connecting")
   
-    params = {
-        'STRATEGY_NAME':"90DTE", 
-        'HEDGE_RATIO': config['hedge_ratio'], # no. of hedges vs shorts
-        'DAILY_PREMIUM': config['daily_premium'],
-        'SHORT_DELTA_TARGET': config['short_delta_target'],
-        'SHORT_DELTA_TOLERANCE': 0.03, # delta
-        'HEDGE_CREDIT_TARGET': config['hedge_credit_target'], 
-        'HEDGE_CREDIT_TOLERANCE':0.05, #dollar
-        'SHORT_DTE': config['short_dte'],
-        'HEDGE_DTE': config['hedge_dte'],
-        'STOPLOSS': config['stop_loss'],
-        'TAKEPROFIT': config['take_profit'],
-    }
+    params = params_from_config(config)
     print(params)
     services = {
         'db': db,
@@ -363,13 +614,26 @@ if __name__ == "__main__":
         'alerts': tlg,
     }
     
-    for day in rest_days:
-        if today == day['date'].date().strftime("%Y%m%d"):
-            tlg.warning(f"{params['STRATEGY_NAME']}: Skip trading today.")
-            logger.warning(f"{params['STRATEGY_NAME']}: Skip trading today.")
-            sys.exit()
+    if calendar.is_halted(today):
+        tlg.warning(f"{params['STRATEGY_NAME']}: Skip trading today.")
+        logger.warning(f"{params['STRATEGY_NAME']}: Skip trading today.")
+        sys.exit()
+    if not calendar.is_trading_day(today):
+        logger.info(f"{params['STRATEGY_NAME']}: Not trading day today. Program skipped")
+        sys.exit()
             
+    if auth_config.get('metrics_file') or auth_config.get('metrics_port'):
+        metrics.enable()
+        if auth_config.get('metrics_port'):
+            metrics.serve(int(auth_config['metrics_port']))
     app = ninetyDTE(auth_config, services, params)
+    # the weekday fallback calendar knows no holidays: confirm with IB's liquidHours
+    if not calendar.exact and not is_market_open_today(app.ib, app.underlying_contract):
+        logger.info(f"{params['STRATEGY_NAME']}: Not trading day today. Program skipped")
+        app.stop()
+        sys.exit()
+    app.metrics_file = auth_config.get('metrics_file')
+    app.profile_dir = auth_config.get('profile_dir')
     
     try:
         tlg.info(f"Starting {params['STRATEGY_NAME']} script...")
@@ -1,3 +1,111 @@
+import bisect
+import datetime
+from ib_insync import *
+from utils.option_utils import get_date_today, convert_str_date
+
+
 class positionManager:
-    ...
-    
\ No newline at end of file
+    """Positions by conId updated from positionEvent, version changes on every update"""
+    def __init__(self, account: str = None):
+        self.account = account      # only positions of this account if given
+        self.positions = dict()     # conId: Position
+        self.by_symbol = dict()     # localSymbol: conId
+        self.by_expiry = dict()     # (expiry, right): set of conIds
+        self.expiries = []          # sorted expiries with positions (for range queries)
+        self.version = 0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __iter__(self):
+        return iter(list(self.positions.values()))
+
+    def __contains__(self, contract: Contract):
+        return self.get(contract) is not None
+
+    def load(self, positions: list[Position]):
+        """replace the store with a full snapshot (ib.positions())"""
+        self.positions.clear()
+        self.by_symbol.clear()
+        self.by_expiry.clear()
+        self.expiries.clear()
+        for position in positions:
+            if self._accepts(position) and position.position != 0:
+                self._add(position)
+        self.version += 1
+
+    def apply(self, position: Position) -> bool:
+        """apply a position update, returns True if the store changed"""
+        if not self._accepts(position):
+            return False
+        conId = position.contract.conId
+        current = self.positions.get(conId)
+        if position.position == 0:
+            if current is None:
+                return False
+            self._remove(current)
+        elif current is None:
+            self._add(position)
+        elif current.position == position.position and current.avgCost == position.avgCost:
+            return False
+        else:
+            self.positions[conId] = position
+        self.version += 1
+        return True
+
+    def _accepts(self, position):
+        return self.account is None or position.account == self.account
+
+    def _add(self, position):
+        contract = position.contract
+        self.positions[contract.conId] = position
+        if contract.localSymbol:
+            self.by_symbol[contract.localSymbol] = contract.conId
+        if contract.lastTradeDateOrContractMonth:
+            key = (contract.lastTradeDateOrContractMonth, contract.right)
+            if contract.lastTradeDateOrContractMonth not in self.expiries:
+                bisect.insort(self.expiries, contract.lastTradeDateOrContractMonth)
+            self.by_expiry.setdefault(key, set()).add(contract.conId)
+
+    def _remove(self, position):
+        contract = position.contract
+        del self.positions[contract.conId]
+        self.by_symbol.pop(contract.localSymbol, None)
+        expiry = contract.lastTradeDateOrContractMonth
+        key = (expiry, contract.right)
+        if key in self.by_expiry:
+            self.by_expiry[key].discard(contract.conId)
+            if not self.by_expiry[key]:
+                del self.by_expiry[key]
+                if (expiry, 'P') not in self.by_expiry and (expiry, 'C') not in self.by_expiry:
+                    self.expiries.remove(expiry)
+
+    # queries
+    def get(self, contract: Contract) -> Position:
+        """position of the contract (by conId, or localSymbol for unqualified contracts)"""
+        if contract.conId in self.positions:
+            return self.positions[contract.conId]
+        return self.get_by_symbol(contract.localSymbol)
+
+    def get_by_symbol(self, localSymbol: str) -> Position:
+        conId = self.by_symbol.get(localSymbol)
+        return None if conId is None else self.positions[conId]
+
+    def quantity(self, contract: Contract) -> float:
+        position = self.get(contract)
+        return 0.0 if position is None else position.position
+
+    def expiring(self, last_expiry: str, right: str = None, first_expiry: str = '') -> list[Position]:
+        """positions with first_expiry <= expiry <= last_expiry (yyyymmdd)"""
+        lo = bisect.bisect_left(self.expiries, first_expiry)
+        hi = bisect.bisect_right(self.expiries, last_expiry)
+        rights = [right] if right else ['P', 'C']
+        return [self.positions[conId]
+                for expiry in self.expiries[lo:hi] for r in rights
+                for conId in self.by_expiry.get((expiry, r), ())]
+
+    def short_puts_expiring_within(self, days: int, today: str = None) -> list[Position]:
+        """short puts expiring within days (calendar) from today, including today"""
+        today = today or get_date_today()
+        last_expiry = (convert_str_date(today) + datetime.timedelta(days = days)).strftime("%Y%m%d")
+        return [p for p in self.expiring(last_expiry, 'P', first_expiry = today) if p.position < 0]
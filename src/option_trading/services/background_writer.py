@@ -0,0 +1,70 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+from services.metrics import metrics
+
+
+class backgroundWriter:
+    """Queue drained by a daemon worker thread (_process, or an own _run), flushed and stopped at exit.
+    Subclasses call __init__ last, it starts the thread"""
+    error_message = "Background write failure"
+    dropped_metric = None # metrics counter of items dropped on a full queue
+
+    def __init__(self, name: str, queue_size = 0, stats: dict = None, logger: logging.Logger = None):
+        self.logger = logger
+        self.queue = queue.Queue(maxsize = queue_size)
+        self.stats = {'queued': 0, 'dropped': 0, 'errors': 0, **(stats or {})}
+        self._closed = False
+        self._thread = threading.Thread(target = self._run, name = name, daemon = True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, item, block = True) -> bool:
+        """enqueue item, False if closed or dropped (queue full and not block)"""
+        if self._closed:
+            return False
+        try:
+            self.queue.put(item, block = block)
+        except queue.Full:
+            self.stats['dropped'] += 1
+            if self.dropped_metric:
+                metrics.inc(self.dropped_metric)
+            return False
+        self.stats['queued'] += 1
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        """wait until every queued item is processed. Returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout: float = 10):
+        """process what is queued, then stop the worker thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._process(item)
+            except Exception as e:
+                self.stats['errors'] += 1
+                if self.logger is not None:
+                    self.logger.error(f"{self.error_message}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _process(self, item):
+        raise NotImplementedError
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import logging
+import datetime
+from zoneinfo import ZoneInfo
+import numpy as np
+import pandas as pd
+from utils.option_utils import CHAIN_COLUMNS
+from services.metrics import metrics
+from services.background_writer import backgroundWriter
+
+# fixed width strings so partitions can be memory mapped (object arrays can't)
+SNAPSHOT_DTYPE = np.dtype([
+    ('index', 'U24'), ('conId', 'i8'), ('strike', 'f8'), ('right', 'U1'), ('expiration', 'U8'),
+    ('bid', 'f8'), ('ask', 'f8'), ('bid_size', 'f8'), ('ask_size', 'f8'), ('volume', 'f8'),
+    ('IV', 'f8'), ('delta', 'f8'), ('gamma', 'f8'), ('vega', 'f8'), ('theta', 'f8'),
+    ('undprice', 'f8'), ('has_greeks', '?'), ('greeks_source', 'U5'),
+])
+RECORDED_COLUMNS = CHAIN_COLUMNS + ['greeks_source']
+INDEX_FILE = 'index.jsonl'
+
+
+def ib_greeks_source(has_greeks: np.ndarray) -> np.ndarray:
+    """greeks_source of a chain without local greeks ('ib' or '')"""
+    return np.where(has_greeks, 'ib', '')
+
+def to_snapshot_array(df: pd.DataFrame) -> np.ndarray:
+    """chain DataFrame (CHAIN_COLUMNS, greeks_source if filled by utils/greeks.py) into a SNAPSHOT_DTYPE structured array"""
+    arr = np.empty(len(df), dtype = SNAPSHOT_DTYPE)
+    for c in CHAIN_COLUMNS:
+        arr[c] = df[c].to_numpy()
+    arr['greeks_source'] = df['greeks_source'].to_numpy() if 'greeks_source' in df else ib_greeks_source(arr['has_greeks'])
+    return arr
+
+
+class chainRecorder(backgroundWriter):
+    """Append-only store of chain snapshots (root/<date>/<expiry>/<time>-<label>.npy + index.jsonl)
+    written off the caller's thread, dropped if the queue is full. The DataFrame must not be modified after record"""
+    error_message = "Chain snapshot write failure"
+    dropped_metric = 'chain_snapshots_dropped'
+
+    def __init__(self, root: str, queue_size = 1000, tz = "US/Eastern", logger: logging.Logger = None):
+        self.root = root
+        self.tz = tz
+        os.makedirs(self.root, exist_ok = True)
+        super().__init__('chain-recorder', queue_size = queue_size, logger = logger,
+                         stats = {'snapshots': 0, 'partitions': 0, 'rows': 0, 'last_write_ms': 0.0, 'max_write_ms': 0.0})
+
+    def record(self, df: pd.DataFrame, label = '', timestamp: datetime.datetime = None) -> bool:
+        """enqueue a chain snapshot, False if it was dropped"""
+        if self._closed or df is None or df.empty:
+            return False
+        if timestamp is None:
+            timestamp = datetime.datetime.now(datetime.timezone.utc)
+        return self.put((timestamp, label, df), block = False)
+
+    def _process(self, item):
+        self._write(*item)
+
+    def _write(self, timestamp: datetime.datetime, label, df: pd.DataFrame):
+        start = time.perf_counter()
+        local = timestamp.astimezone(ZoneInfo(self.tz))
+        date = local.strftime("%Y%m%d")
+        arr = to_snapshot_array(df)
+        entries = []
+        for expiry in np.unique(arr['expiration']):
+            part = arr[arr['expiration'] == expiry]
+            path = os.path.join(date, str(expiry), f"{local.strftime('%H%M%S%f')}-{label}.npy")
+            full_path = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok = True)
+            tmp = full_path + ".tmp"
+            with open(tmp, 'wb') as f:
+                np.save(f, part)
+            os.replace(tmp, full_path)
+            und = part['undprice'][~np.isnan(part['undprice'])]
+            entries.append({'date': date, 'expiry': str(expiry), 'label': label, 'time': local.isoformat(),
+                            'rows': len(part), 'und_price': float(np.median(und)) if len(und) else None, 'path': path})
+        # index last so readers never see a partition that is not complete
+        with open(os.path.join(self.root, INDEX_FILE), 'a') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+        metrics.observe('chain_record_write', time.perf_counter() - start)
+        elapsed = (time.perf_counter() - start) * 1e3
+        self.stats['snapshots'] += 1
+        self.stats['partitions'] += len(entries)
+        self.stats['rows'] += len(arr)
+        self.stats['last_write_ms'] = elapsed
+        self.stats['max_write_ms'] = max(self.stats['max_write_ms'], elapsed)
+
+
+class chainStore:
+    """Read side of a chainRecorder root, partitions are memory mapped (frame() copies)"""
+    def __init__(self, root: str):
+        self.root = root
+        self.reload()
+
+    def reload(self):
+        """re-read the index (new snapshots of a running recorder)"""
+        path = os.path.join(self.root, INDEX_FILE)
+        self.index = []
+        if os.path.exists(path):
+            with open(path) as f:
+                self.index = [json.loads(line) for line in f if line.strip()]
+        return self
+
+    def dates(self, label = None) -> list[str]:
+        return sorted({e['date'] for e in self.index if label is None or e['label'] == label})
+
+    def entries(self, date = None, start = None, end = None, expiry = None, label = None) -> list[dict]:
+        """index entries matching every given filter (start/end inclusive yyyymmdd)"""
+        return [e for e in self.index
+                if (date is None or e['date'] == date)
+                and (start is None or e['date'] >= start)
+                and (end is None or e['date'] <= end)
+                and (expiry is None or e['expiry'] == expiry)
+                and (label is None or e['label'] == label)]
+
+    def load(self, entry: dict) -> np.memmap:
+        return np.load(os.path.join(self.root, entry['path']), mmap_mode = 'r')
+
+    def arrays(self, date = None, start = None, end = None, expiry = None, label = None) -> list[np.memmap]:
+        return [self.load(e) for e in self.entries(date, start, end, expiry, label)]
+
+    def frame(self, date = None, start = None, end = None, expiry = None, label = None, entries = None) -> pd.DataFrame:
+        """chain DataFrame (RECORDED_COLUMNS + date, time, label) of the matching snapshots"""
+        if entries is None:
+            entries = self.entries(date, start, end, expiry, label)
+        frames = []
+        for e in entries:
+            arr = self.load(e)
+            cols = {c: arr[c].astype(object) if arr.dtype[c].kind == 'U' else np.asarray(arr[c]) for c in CHAIN_COLUMNS}
+            # partitions recorded before greeks_source was stored only had IB greeks
+            source = arr['greeks_source'] if 'greeks_source' in arr.dtype.names else ib_greeks_source(arr['has_greeks'])
+            cols['greeks_source'] = source.astype(object)
+            frames.append(pd.DataFrame({**cols, 'date': e['date'], 'time': pd.Timestamp(e['time']), 'label': e['label']}))
+        if not frames:
+            return pd.DataFrame(columns = RECORDED_COLUMNS + ['date', 'time', 'label'])
+        return pd.concat(frames, ignore_index = True)
@@ -1,7 +1,15 @@
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+from pymongo.errors import ConnectionFailure, BulkWriteError, PyMongoError
+from bson import json_util
+import os
+import time
+import queue
 import logging
+from services.metrics import metrics as metrics_registry
+from services.background_writer import backgroundWriter
+
+DUPLICATE_KEY_ERROR = 11000
 
  
 class DBService:
@@ -37,4 +45,132 @@ class DBService:
     
     def disconnect(self):
         self.client.close()
-        
\ No newline at end of file
+        
+
+class writeBehindCollection(backgroundWriter):
+    """Write-behind (batched insert_many) wrapper of a collection, failed batches are journaled and replayed"""
+    def __init__(self, collection, journal_path: str, batch_size = 100, flush_interval = 1.0,
+                 retry_interval = 30.0, logger: logging.Logger = None):
+        self.collection = collection
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self._pending = 0 # documents taken off the queue but not written yet
+        self._last_replay = 0.0
+        journal_dir = os.path.dirname(self.journal_path)
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok = True)
+        super().__init__('db-write-behind', logger = logger,
+                         stats = {'inserted': 0, 'batches': 0, 'journaled': 0, 'replayed': 0,
+                                  'last_flush_ms': 0.0, 'max_flush_ms': 0.0, 'total_flush_ms': 0.0})
+
+    def insert_one(self, document: dict):
+        if not self.put(document):
+            raise RuntimeError("write behind collection is closed")
+
+    def journal_size(self) -> int:
+        """documents waiting in the journal"""
+        if not os.path.exists(self.journal_path):
+            return 0
+        with open(self.journal_path) as f:
+            return sum(1 for line in f if line.strip())
+
+    def metrics(self) -> dict:
+        batches = self.stats['batches']
+        return {
+            **self.stats,
+            'queue_depth': self.queue.qsize() + self._pending,
+            'avg_flush_ms': self.stats['total_flush_ms'] / batches if batches else 0.0,
+            'journal_size': self.journal_size(),
+        }
+
+    def _run(self):
+        self._replay()
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        stop = False
+        while not stop:
+            try:
+                document = self.queue.get(timeout = max(deadline - time.monotonic(), 0))
+                if document is None:
+                    stop = True
+                    self.queue.task_done()
+                else:
+                    batch.append(document)
+                    self._pending = len(batch)
+            except queue.Empty:
+                pass
+            if batch and (stop or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                for _ in batch:
+                    self.queue.task_done()
+                batch = []
+                self._pending = 0
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+                if time.monotonic() - self._last_replay >= self.retry_interval:
+                    self._replay()
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        try:
+            self.collection.insert_many(batch, ordered = False)
+            self.stats['inserted'] += len(batch)
+        except BulkWriteError as e:
+            # some documents made it, journal the rest (duplicates are already stored)
+            failed = [batch[err['index']] for err in e.details['writeErrors'] if err['code'] != DUPLICATE_KEY_ERROR]
+            self.stats['inserted'] += e.details['nInserted']
+            self._on_error(e, failed)
+        except PyMongoError as e:
+            self._on_error(e, batch)
+        metrics_registry.observe('db_flush', time.perf_counter() - start)
+        elapsed = (time.perf_counter() - start) * 1e3
+        self.stats['batches'] += 1
+        self.stats['last_flush_ms'] = elapsed
+        self.stats['max_flush_ms'] = max(self.stats['max_flush_ms'], elapsed)
+        self.stats['total_flush_ms'] += elapsed
+
+    def _on_error(self, error, documents):
+        self.stats['errors'] += 1
+        if self.logger is not None:
+            self.logger.error(f"MongoDB write failure, {len(documents)} documents journaled: {error}")
+        self._journal(documents)
+        self._last_replay = time.monotonic() # database is down, retry later
+
+    def _journal(self, documents):
+        if not documents:
+            return
+        with open(self.journal_path, 'a') as f:
+            for document in documents:
+                f.write(json_util.dumps(document) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats['journaled'] += len(documents)
+        metrics_registry.inc('db_journaled', len(documents))
+
+    def _replay(self):
+        """insert journaled documents, keep whatever still fails"""
+        self._last_replay = time.monotonic()
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path) as f:
+            documents = [json_util.loads(line) for line in f if line.strip()]
+        if not documents:
+            os.remove(self.journal_path)
+            return
+        failed = []
+        try:
+            self.collection.insert_many(documents, ordered = False)
+        except BulkWriteError as e:
+            failed = [documents[err['index']] for err in e.details['writeErrors'] if err['code'] != DUPLICATE_KEY_ERROR]
+        except PyMongoError:
+            return # still down, journal is kept as is
+        self.stats['replayed'] += len(documents) - len(failed)
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, 'w') as f:
+            for document in failed:
+                f.write(json_util.dumps(document) + "\n")
+        os.replace(tmp, self.journal_path)
+        if not failed:
+            os.remove(self.journal_path)
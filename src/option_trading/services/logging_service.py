@@ -1,26 +1,113 @@
+import json
+import queue
+import atexit
 import logging
-from logging.handlers import SysLogHandler
+from logging.handlers import SysLogHandler, RotatingFileHandler, QueueHandler, QueueListener
 
-def loggerService(host:str, port):
-    
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class jsonFormatter(logging.Formatter):
+    """one json object per record (extra={...} fields are included)"""
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in self.RESERVED})
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, default = str)
+
+
+class boundedQueueHandler(QueueHandler):
+    """QueueHandler that drops records (and counts them) instead of blocking when the queue is full"""
+    def __init__(self, maxsize = 10000):
+        super().__init__(queue.Queue(maxsize = maxsize))
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # only freeze what may change after the call (message args, traceback),
+        # formatting is left to the sinks on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class lazyLogger(logging.LoggerAdapter):
+    """Logger of loggerService with dropped count and stop(). Hot paths pass %-style arguments,
+    logger.info("%s: filled at %s", name, price), formatted only if the level is enabled"""
+    def __init__(self, logger, handler: boundedQueueHandler = None, listener: QueueListener = None):
+        super().__init__(logger, {})
+        self.handler = handler
+        self.listener = listener
+
+    @property
+    def dropped(self):
+        return 0 if self.handler is None else self.handler.dropped
+
+    def stop(self):
+        """flush queued records to the sinks and stop the listener thread"""
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+
+
+def loggerService(host:str = None, port = None, log_file: str = None, max_bytes = 10_000_000, backup_count = 5,
+                  json_format = True, queue_size = 10000, level = logging.INFO, name = "trading_system"):
     """Set up logger
-    Add PAPERTRAIL_HOST and PAPERTRAIL_PORT in .env file
-    """
-    _logger = logging.getLogger("trading_system")
-    _logger.setLevel(logging.INFO)
+    Add PAPERTRAIL_HOST and PAPERTRAIL_PORT in .env file for the syslog sink,
+    log_file adds a local rotating file sink.
 
-    sysloghandler = SysLogHandler(
-        address=(
-            host,
-            int(port),
+    Callers only put records on a bounded queue (records are dropped and counted in
+    logger.dropped when it is full). A QueueListener thread formats and writes them to the sinks.
+    """
+    sinks = []
+    formatter = jsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    if host:
+        sysloghandler = SysLogHandler(
+            address=(
+                host,
+                int(port),
+            )
         )
-    )
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-    sysloghandler.setFormatter(formatter)
+        sysloghandler.setFormatter(formatter)
+        sinks.append(sysloghandler)
+    if log_file:
+        filehandler = RotatingFileHandler(log_file, maxBytes = max_bytes, backupCount = backup_count)
+        filehandler.setFormatter(formatter)
+        sinks.append(filehandler)
+    if not sinks:
+        sinks.append(logging.NullHandler())
+
+    _logger = logging.getLogger(name)
+    _logger.setLevel(level)
+    _logger.propagate = False
+    for handler in [h for h in _logger.handlers if isinstance(h, QueueHandler)]:
+        # calling the factory twice must not duplicate records nor leak the previous listener thread
+        _logger.removeHandler(handler)
+        previous = getattr(handler, 'listener', None)
+        if previous is not None and previous._thread is not None:
+            previous.stop()
 
-    _logger.addHandler(sysloghandler)
+    queuehandler = boundedQueueHandler(queue_size)
+    _logger.addHandler(queuehandler)
+    listener = QueueListener(queuehandler.queue, *sinks, respect_handler_level = True)
+    listener.start()
+    queuehandler.listener = listener
 
-    return _logger
-    
\ No newline at end of file
+    logger = lazyLogger(_logger, queuehandler, listener)
+    atexit.register(logger.stop)
+    return logger
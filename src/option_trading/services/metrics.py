@@ -0,0 +1,294 @@
+"""Latency spans, counters and histograms for the strategy pipeline and the services
+
+Disabled by default: span() then returns a shared no-op context manager and timed()
+wrappers only check one attribute, so instrumented code costs next to nothing.
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import atexit
+import asyncio
+import functools
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds, from an in-memory call to a two minute chain request
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class histogram:
+    """cumulative bucket counts, sum, count and max of observed seconds"""
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """upper bound of the bucket holding the q quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bound, n in zip(self.buckets + (self.max,), self.counts):
+            total += n
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99)}
+
+
+class _noopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP_SPAN = _noopSpan()
+
+
+class _span:
+    __slots__ = ('registry', 'name', 'labels', 'start')
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        labels = self.labels if exc_type is None else {**self.labels, 'error': exc_type.__name__}
+        self.registry.observe(self.name, time.perf_counter() - self.start, **labels)
+        return False
+
+
+class metricsRegistry:
+    """Thread safe registry of histograms (seconds) and counters keyed by name and labels"""
+    def __init__(self, enabled = False, prefix = 'option_trading', buckets = DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.buckets = buckets
+        self.histograms = dict() # (name, labels): histogram
+        self.counters = dict()   # (name, labels): float
+        self._lock = threading.Lock()
+        self._server = None
+
+    def enable(self):
+        self.enabled = True
+        return self
+
+    def disable(self):
+        self.enabled = False
+        return self
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    # recording
+    def span(self, name, **labels):
+        """context manager observing the wall time of its block (labelled error=<type> if it raised)"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _span(self, name, labels)
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = histogram(self.buckets)
+            h.observe(seconds)
+
+    def inc(self, name, value = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def timed(self, name = None, **labels):
+        """decorator observing every call of a function or coroutine function"""
+        def decorator(fn):
+            span_name = name or fn.__name__
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return await fn(*args, **kwargs)
+                    with _span(self, span_name, labels):
+                        return await fn(*args, **kwargs)
+                return async_wrapper
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with _span(self, span_name, labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # export
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'histograms': [{'name': name, 'labels': dict(labels), **h.to_dict()} for (name, labels), h in self.histograms.items()],
+                'counters': [{'name': name, 'labels': dict(labels), 'value': v} for (name, labels), v in self.counters.items()],
+            }
+
+    def to_prometheus(self) -> str:
+        """prometheus text exposition format (histograms in seconds)"""
+        def fmt_labels(labels, extra = ()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ''
+            return '{' + ','.join(f'{k}="{str(v)}"' for k, v in items) + '}'
+        lines = []
+        with self._lock:
+            for name in sorted({n for n, _ in self.histograms}):
+                metric = f"{self.prefix}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for (n, labels), h in self.histograms.items():
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets, h.counts):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{fmt_labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{metric}_bucket{fmt_labels(labels, [('le', '+Inf')])} {h.count}")
+                    lines.append(f"{metric}_sum{fmt_labels(labels)} {h.sum}")
+                    lines.append(f"{metric}_count{fmt_labels(labels)} {h.count}")
+            for name in sorted({n for n, _ in self.counters}):
+                metric = f"{self.prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (n, labels), value in self.counters.items():
+                    if n == name:
+                        lines.append(f"{metric}{fmt_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """atomic write, for the node_exporter textfile collector"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        tmp = path + ".tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, path)
+
+    def write_json(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent = 2)
+
+    def serve(self, port: int, host = '127.0.0.1'):
+        """serve /metrics (prometheus text) and /metrics.json from a background thread"""
+        if self._server is not None:
+            return self._server
+        registry = self
+
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/metrics.json'):
+                    body, content_type = json.dumps(registry.to_dict()).encode(), 'application/json'
+                elif self.path.startswith('/metrics'):
+                    body, content_type = registry.to_prometheus().encode(), 'text/plain; version=0.0.4'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target = self._server.serve_forever, name = 'metrics-http', daemon = True).start()
+        atexit.register(self._server.shutdown)
+        return self._server
+
+
+# process wide registry used by the strategy and the services
+metrics = metricsRegistry()
+
+
+class samplingProfiler:
+    """Opt-in sampling profiler of one thread, collapsed stacks in the folded format (flamegraph.pl, speedscope)"""
+    def __init__(self, interval = 0.005, thread_id: int = None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.stacks = Counter() # "frame;frame;frame": samples
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target = self._run, name = 'sampling-profiler', daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def write_collapsed(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with open(path, 'w') as f:
+            f.write(self.collapsed())
@@ -1,30 +1,130 @@
+import time
+import queue
 import requests
 from services.alerts import baseAlerts
+from services.metrics import metrics
+from services.background_writer import backgroundWriter
 
-class telegram(baseAlerts):
-    def __init__(self, 
-                 tg_chat_id: str , 
-                 tg_api_token: str, 
-                 email_recipient: list = None):
+TELEGRAM_API_URL = 'https://api.telegram.org'
+MAX_MESSAGE_LENGTH = 4096 # telegram limit per message
+
+class telegram(baseAlerts, backgroundWriter):
+    """Telegram alerts sent by a background thread: one HTTPS connection, coalesced and rate limited messages"""
+    dropped_metric = 'alerts_dropped'
+    error_message = "Telegram send failure"
+
+    def __init__(self,
+                 tg_chat_id: str ,
+                 tg_api_token: str,
+                 email_recipient: list = None,
+                 api_url: str = TELEGRAM_API_URL,
+                 max_queue: int = 1000,
+                 coalesce_window: float = 0.5,
+                 min_interval: float = 1.0,
+                 max_retries: int = 3,
+                 timeout: float = 10,
+                 logger = None):
         self.chat_id = tg_chat_id
         self.api_token = tg_api_token
         self.email_recipients = email_recipient
-        self.data_dict = {
+        self.url = f'{api_url}/bot{self.api_token}/sendMessage'
+        self.coalesce_window = coalesce_window
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._last_sent = 0.0
+        backgroundWriter.__init__(self, 'telegram-sender', queue_size = max_queue, logger = logger,
+                                  stats = {'sent': 0, 'processed': 0, 'failed': 0, 'rate_limited': 0})
+
+    def _payload(self, text):
+        # new dict per request, nothing shared between sends
+        return {
             'chat_id': str(self.chat_id),
             'parse_mode': 'markdown',
-            'disable_notification': False,}
-        self.url = f'https://api.telegram.org/bot{self.api_token}/sendMessage'
-    
+            'disable_notification': False,
+            'text': text,}
+
     def info(self, message):
-        self.data_dict['text'] = str(message)
-        return requests.post(self.url, json=self.data_dict)
-    
+        self.put(str(message), block = False)
+
     def warning(self, message):
-        self.data_dict['text'] = "*WARNING*: "+ str(message)
-        return requests.post(self.url, json=self.data_dict)
+        self.put("*WARNING*: "+ str(message), block = False)
 
     def error(self, message):
-        self.data_dict['text'] = "*ERROR*: " + str(message)
-        return requests.post(self.url, json=self.data_dict)
-        
+        self.put("*ERROR*: " + str(message), block = False)
+
+    def close(self, timeout: float = 10):
+        """send what is queued (also done at exit), then stop the sender thread"""
+        if self._closed:
+            return
+        self.flush(timeout)
+        backgroundWriter.close(self, timeout)
+        self.session.close()
+
+    def _run(self):
+        carry = None # message that did not fit into the previous batch
+        stop = False
+        while not stop:
+            first = self.queue.get() if carry is None else carry
+            carry = None
+            if first is None:
+                self.queue.task_done()
+                return
+            batch = [first]
+            size = len(first)
+            # coalesce the burst that arrives within the window
+            deadline = time.monotonic() + self.coalesce_window
+            while True:
+                try:
+                    text = self.queue.get(timeout = max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if text is None:
+                    # close() during a burst: send it, then stop
+                    stop = True
+                    self.queue.task_done()
+                    break
+                if size + len(text) + 1 > MAX_MESSAGE_LENGTH:
+                    carry = text
+                    break
+                batch.append(text)
+                size += len(text) + 1
+            try:
+                self._send("\n".join(batch)[:MAX_MESSAGE_LENGTH])
+                self.stats['processed'] += len(batch)
+            except Exception as e:
+                # keep the sender alive, later alerts must still go out
+                self.stats['errors'] += 1
+                if self.logger is not None:
+                    self.logger.error(f"{self.error_message}: {e!r}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
 
+    def _send(self, text):
+        for _ in range(self.max_retries + 1):
+            wait = self._last_sent + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                with metrics.span('alert_send'):
+                    r = self.session.post(self.url, json = self._payload(text), timeout = self.timeout)
+            except requests.RequestException:
+                self._last_sent = time.monotonic()
+                continue
+            self._last_sent = time.monotonic()
+            if r.status_code == 429:
+                self.stats['rate_limited'] += 1
+                try:
+                    retry_after = r.json().get('parameters', {}).get('retry_after', 1)
+                except ValueError:
+                    retry_after = 1
+                time.sleep(retry_after)
+                continue
+            if r.ok:
+                self.stats['sent'] += 1
+                return
+            if r.status_code < 500:
+                break # bad request, retrying will not help
+        self.stats['failed'] += 1
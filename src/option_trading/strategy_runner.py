@@ -0,0 +1,141 @@
+""" Runs every enabled 90dte config of the configs collection on one IB connection
+
+Each document of configs with strategy '90dte' (and enabled not false) is one ninetyDTE
+instance, e.g. {'strategy': '90dte', 'name': '90DTE-QQQ', 'symbol': 'QQQ', 'primary_exchange': 'NASDAQ', ...}
+(see params_from_config for the keys). Names must be unique, orders are tagged with them.
+"""
+import os
+import sys
+import asyncio
+import datetime
+from ib_insync import *
+from dotenv import dotenv_values
+from zoneinfo import ZoneInfo
+from utils.option_utils import get_date_today
+from utils.trading_calendar import tradingCalendar, load_halt_days
+from utils.trade_utils import is_market_open_today
+from brokerage.session import ibSession
+from services.db_service import DBService
+from services.metrics import metrics, samplingProfiler
+from services.logging_service import loggerService
+from services.telegram_service import telegram
+from ninety_dte_strategy import ninetyDTE, params_from_config
+
+
+class strategyRunner:
+    """ninetyDTE strategies run concurrently on one event loop and one IB connection (brokerage/session.py)"""
+    def __init__(self, auth_config, services, params_list: list[dict], ib: IB = None):
+        names = [p['STRATEGY_NAME'] for p in params_list]
+        duplicates = sorted({n for n in names if names.count(n) > 1})
+        if duplicates:
+            raise ValueError(f"Strategy names must be unique: {duplicates}")
+        self.today = get_date_today()
+        self.logger = services['logger']
+        self.alerts = services['alerts']
+        self.metrics_file = None # prometheus text file written after each run (services/metrics.py)
+        self.profile_dir = None # opt-in: sampled flame graph (folded stacks) of each run
+        self.session = ibSession(auth_config['TWS_HOST'], auth_config['TWS_PORT'], clientId = 0, ib = ib,
+                                 logger = self.logger, alerts = self.alerts)
+        self.session.connect()
+        self.strategies = [ninetyDTE(auth_config, services, params, session = self.session) for params in params_list]
+
+    def run(self):
+        self.session.run()
+
+    def stop(self):
+        self.session.stop()
+
+    def exit_program(self):
+        self.alerts.info(f"{len(self.strategies)} strategies: Program exited at market close")
+        sys.exit()
+
+    async def gather_async(self, method: str):
+        """run method (a coroutine method of ninetyDTE) of every strategy concurrently"""
+        results = await asyncio.gather(*(getattr(s, method)() for s in self.strategies), return_exceptions = True)
+        for strategy, result in zip(self.strategies, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"{strategy.strategy_name}: {method} failed. {result!r}")
+                self.alerts.error(f"{strategy.strategy_name}: {method} failed. {result}")
+        return results
+
+    def prewarm_contracts(self):
+        """fill the contract cache before market open (overlapping chains are requested once)"""
+        util.run(self.gather_async('get_all_contracts_async'))
+        self.logger.info(f"Contract cache warmed for {len(self.strategies)} strategies")
+
+    def run_strategies(self):
+        util.startLoop()
+        profiler = samplingProfiler().start() if self.profile_dir else None
+        try:
+            util.run(self.gather_async('run_strategy_async'))
+        finally:
+            if profiler is not None:
+                path = os.path.join(self.profile_dir, f"run_strategies-{datetime.datetime.now():%Y%m%d-%H%M%S}.folded")
+                profiler.stop().write_collapsed(path)
+                self.logger.info(f"run_strategies profile ({profiler.samples} samples) written to {path}")
+            if self.metrics_file:
+                metrics.write_prometheus(self.metrics_file)
+
+    def schedule_all_tasks(self):
+        # avoid PYTZ (use ZoneInfo instead)
+        day = (int(self.today[:4]), int(self.today[4:6]), int(self.today[6:8]))
+        self.session.ib.schedule(datetime.datetime(*day, 9, 0, 0, tzinfo = ZoneInfo("US/Eastern")), self.prewarm_contracts)
+        self.session.ib.schedule(datetime.datetime(*day, 10, 28, 0, tzinfo = ZoneInfo("US/Eastern")), self.run_strategies)
+        self.session.ib.schedule(datetime.datetime(*day, 17, 0, 0, tzinfo = ZoneInfo("US/Eastern")), self.exit_program)
+        self.alerts.info(f"{', '.join(s.strategy_name for s in self.strategies)}: trade scheduled!")
+
+
+if __name__ == "__main__":
+
+    today = get_date_today()
+    auth_config = dotenv_values(".env")
+
+    # Services connection (logger, DB, telegram)
+    logger = loggerService(auth_config['papertrail_host'], auth_config['papertrail_port'], log_file = auth_config.get('log_file'))
+    logger.info("Ping.")
+    tlg = telegram(auth_config['telegram_chatid'], auth_config['telegram_token'], logger = logger)
+    mongodb = DBService(auth_config = auth_config, logger = logger)
+    mongodb.connect()
+    db = mongodb.get_database('trade-buster')
+    configs = list(db['configs'].find({'strategy': '90dte', 'enabled': {'$ne': False}}))
+    # exchange sessions and halt days from the local calendar cache, checked before connecting to IB
+    halts = mongodb.get_database('trading-utils')['trading_days_halt']
+    calendar = tradingCalendar('NYSE', halt_source = lambda start: load_halt_days(halts, start))
+    if not calendar.exact:
+        logger.warning("pandas_market_calendars not installed, exchange holidays are checked with IB after connecting")
+
+    params_list = [params_from_config(config) for config in configs]
+    logger.info(f"Loaded {len(params_list)} strategies: {', '.join(p['STRATEGY_NAME'] for p in params_list)}")
+    services = {
+        'db': db,
+        'logger': logger,
+        'alerts': tlg,
+    }
+
+    if calendar.is_halted(today):
+        tlg.warning("Strategy runner: Skip trading today.")
+        logger.warning("Strategy runner: Skip trading today.")
+        sys.exit()
+    if not calendar.is_trading_day(today):
+        logger.info("Strategy runner: Not trading day today. Program skipped")
+        sys.exit()
+
+    if auth_config.get('metrics_file') or auth_config.get('metrics_port'):
+        metrics.enable()
+        if auth_config.get('metrics_port'):
+            metrics.serve(int(auth_config['metrics_port']))
+    runner = strategyRunner(auth_config, services, params_list)
+    # the weekday fallback calendar knows no holidays: confirm with IB's liquidHours
+    if not calendar.exact and runner.strategies and not is_market_open_today(runner.session.ib, runner.strategies[0].underlying_contract):
+        logger.info(f"Strategy runner: Not trading day today. Program skipped")
+        runner.stop()
+        sys.exit()
+    runner.metrics_file = auth_config.get('metrics_file')
+    runner.profile_dir = auth_config.get('profile_dir')
+
+    try:
+        tlg.info(f"Starting {len(runner.strategies)} strategies on one connection...")
+        runner.schedule_all_tasks()
+        runner.run()
+    except (KeyboardInterrupt, SystemExit) as e:
+        runner.stop()
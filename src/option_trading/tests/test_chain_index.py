@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils.option_utils import noChainFoundException
+from utils.chain_index import ChainIndex, chain_index
+
+
+def put_chain(n = 41, seed = 0):
+    """strike-sorted puts: delta falls and ask rises with the strike, volume is noise"""
+    rng = np.random.default_rng(seed)
+    strikes = np.arange(n) * 5.0 + 300
+    delta = -np.linspace(0.02, 0.6, n)
+    ask = np.linspace(0.3, 25.0, n)
+    return pd.DataFrame({'strike': strikes, 'delta': delta, 'bid': ask - 0.1, 'ask': ask,
+                         'volume': rng.integers(0, 1000, n).astype(float)})
+
+
+def brute_force(df, col, target):
+    values = df[col].to_numpy()
+    return df.iloc[np.nanargmin(np.abs(values - target))]
+
+
+@pytest.mark.parametrize('col', ['delta', 'ask', 'volume']) # descending, ascending, not monotone (argsort)
+def test_nearest_matches_brute_force(col):
+    df = put_chain()
+    index = ChainIndex(df)
+    lo, hi = df[col].min(), df[col].max()
+    for target in np.linspace(lo - 1, hi + 1, 97):
+        # ties may resolve to either row, compare the distance
+        expected = brute_force(df, col, target)
+        assert abs(index.nearest(col, target)[col] - target) == pytest.approx(abs(expected[col] - target))
+
+
+def test_ties_pick_the_smaller_value():
+    index = ChainIndex(pd.DataFrame({'strike': [1.0, 2.0, 3.0], 'ask': [1.0, 2.0, 3.0]}))
+    assert index.nearest('ask', 1.5)['strike'] == 1.0
+
+
+def test_unsorted_chain_is_sorted_by_strike():
+    df = put_chain().sample(frac = 1, random_state = 1)
+    index = ChainIndex(df)
+    assert index.df['strike'].is_monotonic_increasing
+    assert index.nearest_delta(-0.15)['strike'] == brute_force(df, 'delta', -0.15)['strike']
+
+
+def test_nan_rows_are_ignored():
+    df = put_chain()
+    df.loc[df['delta'].sub(-0.15).abs().idxmin(), 'delta'] = np.nan
+    index = ChainIndex(df)
+    assert not np.isnan(index.nearest_delta(-0.15)['delta'])
+    assert index.nearest_delta(-0.15)['strike'] == brute_force(df, 'delta', -0.15)['strike']
+    with pytest.raises(noChainFoundException):
+        ChainIndex(df.assign(delta = np.nan)).nearest_delta(-0.15)
+
+
+def test_nearest_many_keeps_target_order():
+    index = ChainIndex(put_chain())
+    rows = index.nearest_many('delta', [-0.10, -0.30, -0.20])
+    assert list(rows['delta']) == [index.nearest_delta(t)['delta'] for t in (-0.10, -0.30, -0.20)]
+
+
+def test_within_is_strike_sorted():
+    df = put_chain()
+    rows = ChainIndex(df).within('delta', -0.15, 0.03)
+    expected = df[(df['delta'] - -0.15).abs() <= 0.03]
+    assert list(rows['strike']) == list(expected['strike'])
+    assert rows['strike'].is_monotonic_increasing
+
+
+def test_brackets():
+    index = ChainIndex(put_chain())
+    assert index.brackets('delta', -0.15)
+    assert index.brackets('ask', 0.3) and index.brackets('ask', 25.0)
+    assert not index.brackets('delta', -0.9)
+    assert not index.brackets('ask', 0.1)
+    assert not ChainIndex(put_chain().assign(ask = np.nan)).brackets('ask', 1.0)
+
+
+def test_chain_index_reuses_an_index():
+    index = ChainIndex(put_chain())
+    assert chain_index(index) is index
+    assert isinstance(chain_index(put_chain()), ChainIndex)
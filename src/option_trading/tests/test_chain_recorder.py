@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+from utils.option_utils import CHAIN_COLUMNS
+from services.chain_recorder import chainRecorder, chainStore
+
+
+def chain(greeks_source = None):
+    df = pd.DataFrame({
+        'index': ['SPY 400P', 'SPY 410P'], 'conId': [1, 2], 'strike': [400.0, 410.0], 'right': ['P', 'P'],
+        'expiration': ['20240419', '20240419'], 'bid': [1.0, 2.0], 'ask': [1.1, 2.2], 'bid_size': [1.0, 1.0],
+        'ask_size': [1.0, 1.0], 'volume': [0.0, 0.0], 'IV': [0.2, 0.19], 'delta': [-0.1, -0.15], 'gamma': [0.01, 0.01],
+        'vega': [0.5, 0.6], 'theta': [-0.02, -0.03], 'undprice': [450.0, np.nan], 'has_greeks': [True, False],
+    })[CHAIN_COLUMNS]
+    if greeks_source is not None:
+        df['greeks_source'] = greeks_source
+    return df
+
+
+def test_greeks_source_round_trip(tmp_path):
+    recorder = chainRecorder(str(tmp_path))
+    assert recorder.record(chain(['ib', 'local']), label = 'short')
+    assert recorder.record(chain(), label = 'hedge')
+    recorder.close()
+    store = chainStore(str(tmp_path))
+    assert list(store.frame(label = 'short')['greeks_source']) == ['ib', 'local']
+    # chains without local greeks: IB rows are 'ib', the others unpriced
+    assert list(store.frame(label = 'hedge')['greeks_source']) == ['ib', '']
+    assert list(store.frame(label = 'short')['strike']) == [400.0, 410.0]
@@ -0,0 +1,37 @@
+import time
+import mongomock
+from pymongo.errors import ServerSelectionTimeoutError
+from services.db_service import writeBehindCollection
+
+
+class flakyCollection:
+    """mongomock collection whose insert_many fails while down is True"""
+    def __init__(self):
+        self.collection = mongomock.MongoClient()['test']['trades']
+        self.down = True
+
+    def insert_many(self, documents, ordered = True):
+        if self.down:
+            raise ServerSelectionTimeoutError("database down")
+        return self.collection.insert_many(documents, ordered = ordered)
+
+
+def test_journal_and_replay(tmp_path):
+    flaky = flakyCollection()
+    journal = tmp_path / 'trades.jsonl'
+    trades = writeBehindCollection(flaky, journal_path = str(journal), flush_interval = 0.01, retry_interval = 0.05)
+    for i in range(3):
+        trades.insert_one({'_id': i, 'qty': i})
+    assert trades.flush(timeout = 5)
+    assert trades.journal_size() == 3
+    assert flaky.collection.count_documents({}) == 0
+
+    flaky.down = False
+    trades.insert_one({'_id': 3, 'qty': 3})
+    deadline = time.monotonic() + 5
+    while journal.exists() and time.monotonic() < deadline: # replayed on the next retry_interval
+        time.sleep(0.01)
+    trades.close()
+    assert not journal.exists()
+    assert sorted(d['_id'] for d in flaky.collection.find()) == [0, 1, 2, 3]
+    assert trades.stats['journaled'] == 3 and trades.stats['replayed'] == 3
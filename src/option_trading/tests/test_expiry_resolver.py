@@ -0,0 +1,50 @@
+import pytest
+from utils.option_utils import expiryResolver, get_nearest_expiry
+
+# Fridays, 20240105 is 3 days after 20240102
+EXPIRIES = ['20240119', '20240105', '20240112', '20240216', '20240315', '20240419']
+TODAY = '20240102'
+
+
+def test_expirations_are_sorted_and_unique():
+    resolver = expiryResolver(EXPIRIES + ['20240105'])
+    assert resolver.expirations == sorted(EXPIRIES)
+    assert len(resolver) == len(EXPIRIES)
+
+
+@pytest.mark.parametrize('dte, nearest, before, after', [
+    (3, '20240105', '20240105', '20240105'),    # listed
+    (0, '20240105', None, '20240105'),          # before the first expiration
+    (13, '20240112', '20240112', '20240119'),   # 20240115: 3 days after 20240112, 4 before 20240119
+    (14, '20240119', '20240112', '20240119'),   # 20240116
+    (31, '20240119', '20240119', '20240216'),   # 20240202: tie goes to the earlier expiration
+    (90, '20240315', '20240315', '20240419'),   # 20240401: 17 days after, 18 before
+    (200, '20240419', '20240419', None),        # after the last expiration
+])
+def test_policies(dte, nearest, before, after):
+    resolver = expiryResolver(EXPIRIES)
+    assert resolver.nearest(dte, TODAY) == nearest
+    assert resolver.nearest(dte, TODAY, policy = 'on_or_before') == before
+    assert resolver.nearest(dte, TODAY, policy = 'on_or_after') == after
+
+
+def test_resolve_many_targets_at_once():
+    resolver = expiryResolver(EXPIRIES)
+    assert resolver.resolve([90, 3, 14], today = TODAY) == ['20240315', '20240105', '20240119']
+    assert get_nearest_expiry(EXPIRIES, 90, today = TODAY) == '20240315'
+
+
+def test_no_expirations_and_unknown_policy():
+    assert expiryResolver([]).resolve([90, 7], today = TODAY) == [None, None]
+    with pytest.raises(ValueError):
+        expiryResolver(EXPIRIES).resolve([90], today = TODAY, policy = 'closest')
+
+
+def test_strikes():
+    resolver = expiryResolver(EXPIRIES, strikes = [410, 400, 420, 430])
+    assert list(resolver.strikes('20240419')) == [400, 410, 420, 430]
+    assert list(resolver.strikes('20240419', window = (405, 420))) == [410, 420]
+    resolver.set_strikes('20240419', [405, 415, 405.0])
+    assert list(resolver.strikes('20240419')) == [405, 415]
+    assert list(resolver.strikes('20240315')) == [400, 410, 420, 430] # listed strikes for the others
+    assert len(expiryResolver(EXPIRIES).strikes('20240419')) == 0
@@ -0,0 +1,91 @@
+import math
+import numpy as np
+import pandas as pd
+import pytest
+from utils.greeks import (norm_cdf, norm_ppf, year_fraction, bs_price, bs_greeks, implied_vol,
+                          strike_for_delta, fill_missing_greeks)
+
+# Hull, Options Futures and Other Derivatives, example 15.6: S 42, K 40, r 10%, T 6 months, vol 20%
+S, K, T, R, VOL = 42.0, 40.0, 0.5, 0.1, 0.2
+
+
+def test_norm_cdf_and_ppf():
+    x = np.array([-3.0, -1.0, 0.0, 0.5, 2.0])
+    expected = [0.5 * (1 + math.erf(v / math.sqrt(2))) for v in x]
+    assert norm_cdf(x) == pytest.approx(expected, abs = 1e-7)
+    assert norm_ppf(expected) == pytest.approx(x, abs = 1e-6)
+
+
+def test_bs_price_known_values():
+    assert bs_price(S, K, T, R, 0.0, VOL, True) == pytest.approx(4.76, abs = 5e-3)
+    assert bs_price(S, K, T, R, 0.0, VOL, False) == pytest.approx(0.81, abs = 5e-3)
+    # put-call parity with a dividend yield
+    call, put = bs_price(S, K, T, R, 0.02, VOL, np.array([True, False]))
+    assert call - put == pytest.approx(S * math.exp(-0.02 * T) - K * math.exp(-R * T), abs = 1e-6)
+
+
+def test_bs_greeks_known_values():
+    d1 = (math.log(S / K) + (R + 0.5 * VOL ** 2) * T) / (VOL * math.sqrt(T))
+    pdf = math.exp(-0.5 * d1 * d1) / math.sqrt(2 * math.pi)
+    call, put = (bs_greeks(S, K, T, R, 0.0, VOL, is_call) for is_call in (True, False))
+    assert call['delta'] == pytest.approx(0.7791, abs = 1e-4)
+    assert put['delta'] == pytest.approx(call['delta'] - 1, abs = 1e-9)
+    assert call['gamma'] == pytest.approx(put['gamma']) == pytest.approx(pdf / (S * VOL * math.sqrt(T)))
+    # IB conventions: vega per vol point, theta per calendar day
+    assert call['vega'] == pytest.approx(S * pdf * math.sqrt(T) / 100)
+    d2 = d1 - VOL * math.sqrt(T)
+    n_d2 = 0.5 * (1 + math.erf(d2 / math.sqrt(2)))
+    assert call['theta'] == pytest.approx((-S * pdf * VOL / (2 * math.sqrt(T)) - R * K * math.exp(-R * T) * n_d2) / 365)
+    # price moves by vega for a 1 point vol change
+    bump = bs_price(S, K, T, R, 0.0, VOL + 0.005, True) - bs_price(S, K, T, R, 0.0, VOL - 0.005, True)
+    assert bump == pytest.approx(call['vega'], rel = 1e-3)
+
+
+def test_implied_vol_round_trip():
+    strikes = np.array([300.0, 380.0, 420.0, 450.0, 500.0])
+    vols = np.array([0.35, 0.24, 0.19, 0.16, 0.14])
+    is_call = np.array([False, False, False, True, True])
+    prices = bs_price(430.0, strikes, 0.25, 0.05, 0.013, vols, is_call)
+    assert implied_vol(prices, 430.0, strikes, 0.25, 0.05, 0.013, is_call) == pytest.approx(vols, abs = 1e-5)
+    # below intrinsic / above the underlying: no implied vol
+    bad = implied_vol(np.array([60.0, 440.0]), 430.0, np.array([500.0, 400.0]), 0.25, 0.05, 0.013, np.array([False, True]))
+    assert np.isnan(bad).all()
+
+
+def test_strike_for_delta():
+    targets = np.array([-0.30, -0.15, -0.05, 0.25])
+    strikes = strike_for_delta(targets, 430.0, 0.2, 0.25, 0.05, 0.013)
+    deltas = bs_greeks(430.0, strikes, 0.25, 0.05, 0.013, 0.2, targets > 0)['delta']
+    assert deltas == pytest.approx(targets, abs = 1e-6)
+    assert strikes[0] > strikes[1] > strikes[2] # further out of the money for smaller put deltas
+
+
+def test_year_fraction_has_a_floor():
+    assert year_fraction(['20240402', '20240102'], today = '20240102') == pytest.approx([91 / 365, 1 / 365])
+
+
+def test_fill_missing_greeks_tags_the_source():
+    today, expiry, und = '20240102', '20240402', 470.0
+    T = year_fraction([expiry], today)[0]
+    strikes = np.array([440.0, 450.0, 460.0, 520.0])
+    model = bs_price(und, strikes, T, 0.05, 0.0, 0.2, False)
+    df = pd.DataFrame({
+        'strike': strikes, 'right': 'P', 'expiration': expiry,
+        'bid': model - 0.05, 'ask': model + 0.05,
+        'IV': [0.21, np.nan, 0.2, np.nan], 'delta': [-0.2, np.nan, -0.35, np.nan], 'gamma': [0.01, np.nan, 0.01, np.nan],
+        'vega': [0.8, np.nan, 0.9, np.nan], 'theta': [-0.1, np.nan, -0.1, np.nan],
+        # IB greeks of 460 were computed off a stale underlying price
+        'undprice': [und, np.nan, und * 0.95, np.nan],
+        'has_greeks': [True, False, True, False],
+    })
+    df.loc[3, ['bid', 'ask']] = [40.0, 40.1] # below intrinsic value, cannot be priced
+    filled = fill_missing_greeks(df, und_price = und, rate = 0.05, max_und_drift = 0.02, today = today)
+    assert list(filled['greeks_source']) == ['ib', 'local', 'local', '']
+    assert filled.loc[0, 'delta'] == -0.2 # IB greeks are kept
+    local = bs_greeks(und, strikes[1:3], T, 0.05, 0.0, filled.loc[1:2, 'IV'].to_numpy(), False)['delta']
+    assert filled.loc[1:2, 'delta'].to_numpy() == pytest.approx(local)
+    assert filled.loc[1, 'IV'] == pytest.approx(0.2, abs = 2e-3)
+    assert (filled.loc[1:2, 'undprice'] == und).all()
+    assert np.isnan(filled.loc[3, 'delta'])
+    # default reference: median undprice of the rows with IB greeks
+    assert fill_missing_greeks(df, today = today).loc[1, 'undprice'] == pytest.approx(np.median([und, und * 0.95]))
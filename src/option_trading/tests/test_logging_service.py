@@ -0,0 +1,26 @@
+import logging
+import threading
+from services.logging_service import loggerService
+
+
+class notFormatted:
+    def __str__(self):
+        raise AssertionError("formatted although the level is filtered out")
+
+
+def test_percent_args_are_lazy(tmp_path):
+    path = tmp_path / 'log.txt'
+    logger = loggerService(log_file = str(path), json_format = False, name = 'test-lazy', level = logging.INFO)
+    logger.debug("%s", notFormatted())
+    logger.info("%s: filled at %.2f", "90DTE", 1.234)
+    logger.stop()
+    assert path.read_text().strip().endswith("90DTE: filled at 1.23")
+
+
+def test_second_service_stops_previous_listener(tmp_path):
+    before = threading.active_count()
+    first = loggerService(log_file = str(tmp_path / 'a.txt'), name = 'test-listener')
+    second = loggerService(log_file = str(tmp_path / 'b.txt'), name = 'test-listener')
+    assert first.listener._thread is None
+    assert threading.active_count() == before + 1
+    second.stop()
@@ -0,0 +1,30 @@
+import pytest
+from ib_insync import Option, Trade, Order, OrderStatus
+from brokerage.order_book import orderBook
+
+SHORT = Option('SPY', '20240419', 400, 'P', 'SMART', conId = 1)
+
+
+def trade(order_id, status, parent_id = 0):
+    return Trade(SHORT, Order(clientId = 0, orderId = order_id, parentId = parent_id), OrderStatus(status = status))
+
+
+def test_live_trades_are_indexed():
+    book = orderBook()
+    book.update(trade(1, 'Submitted'))
+    book.update(trade(2, 'PreSubmitted', parent_id = 1))
+    assert len(book) == 2
+    assert [t.order.orderId for t in book.open_orders(SHORT)] == [1, 2]
+    assert [t.order.orderId for t in book.children(1)] == [2]
+
+
+@pytest.mark.parametrize('status', ['Filled', 'Cancelled', 'ApiCancelled', 'Inactive'])
+def test_done_and_inactive_trades_are_dropped(status):
+    book = orderBook()
+    book.update(trade(1, 'Submitted'))
+    book.update(trade(2, 'Submitted', parent_id = 1))
+    book.update(trade(2, status, parent_id = 1))
+    assert [t.order.orderId for t in book] == [1]
+    assert book.children(1) == []
+    book.update(trade(3, status))
+    assert len(book) == 1
@@ -0,0 +1,123 @@
+import itertools
+import pytest
+import pandas as pd
+from ib_insync import Option, Position, Trade, Order, OrderStatus
+from portfolio.position_manager import positionManager
+from brokerage.orders import entry_orders, combo_bracket_order, bracketOrderException
+
+PARAMS = {'DAILY_PREMIUM': 600, 'HEDGE_RATIO': 2, 'COMBO_ORDER': True, 'STOPLOSS': 2, 'TAKEPROFIT': 0.5}
+
+
+class stubClient:
+    def __init__(self):
+        self.ids = itertools.count(100)
+
+    def getReqId(self):
+        return next(self.ids)
+
+
+class stubIB:
+    """order id reservation and open trades only, records anything sent"""
+    def __init__(self, trades = ()):
+        self.client = stubClient()
+        self.trades = list(trades)
+        self.sent = []
+
+    def openTrades(self):
+        return self.trades
+
+    def placeOrder(self, contract, order):
+        self.sent.append(('place', order))
+
+    def cancelOrder(self, order):
+        self.sent.append(('cancel', order))
+
+
+def option(conId, strike):
+    return Option('SPY', '20240419', strike, 'P', 'SMART', multiplier = '100', conId = conId,
+                  localSymbol = f"SPY   240419P00{strike}000")
+
+SHORT = option(1, 400)
+LONG = option(2, 350)
+SHORT_PUT = pd.Series({'bid': 3.0, 'ask': 3.1})
+LONG_PUT = pd.Series({'bid': 0.5, 'ask': 0.6})
+
+
+def positions(*held):
+    store = positionManager()
+    store.load([Position('DU1', contract, qty, avg_cost) for contract, qty, avg_cost in held])
+    return store
+
+def child_trade(order_id, parent_id, qty, contract = SHORT):
+    return Trade(contract, Order(orderId = order_id, parentId = parent_id, totalQuantity = qty, action = 'BUY'), OrderStatus(status = 'Submitted'))
+
+
+def test_combo_entry_is_one_bracket_on_the_bag():
+    ib = stubIB()
+    plan = entry_orders(ib, SHORT, LONG, SHORT_PUT, LONG_PUT, PARAMS, positions())
+    assert not plan['modify_position']
+    assert plan['credit'] == pytest.approx(3.0 - 2 * 0.6)
+    [(name, bag, [parent, take_profit, stop_loss])] = plan['stages']
+    assert name == 'spread'
+    assert [(leg.conId, leg.action, leg.ratio) for leg in bag.comboLegs] == [(1, 'SELL', 1), (2, 'BUY', 2)]
+    # buying the combo at a negative price receives the credit, children buy it back by selling
+    assert (parent.action, parent.orderType, parent.totalQuantity, parent.lmtPrice) == ('BUY', 'LMT', 2, -1.8)
+    assert (take_profit.action, take_profit.orderType, take_profit.lmtPrice) == ('SELL', 'LMT', -0.9)
+    assert (stop_loss.action, stop_loss.orderType, stop_loss.auxPrice) == ('SELL', 'STP', -5.4)
+    assert [o.orderId for o in (parent, take_profit, stop_loss)] == [100, 101, 102]
+    assert take_profit.parentId == stop_loss.parentId == parent.orderId
+    # only the last order of the bracket transmits the group
+    assert [o.transmit for o in (parent, take_profit, stop_loss)] == [False, False, True]
+    assert ib.sent == []
+
+
+def test_combo_bracket_without_children_transmits_parent():
+    [parent, take_profit, stop_loss] = combo_bracket_order(stubIB(), 1, 1.0, None, None)
+    assert parent.transmit and take_profit is None and stop_loss is None
+
+
+def test_no_credit_no_orders():
+    plan = entry_orders(stubIB(), SHORT, LONG, SHORT_PUT, pd.Series({'bid': 1.4, 'ask': 1.5}), PARAMS, positions())
+    assert plan['credit'] <= 0 and plan['stages'] == []
+
+
+def test_legs_entry_reserves_long_put_id_first():
+    ib = stubIB()
+    plan = entry_orders(ib, SHORT, LONG, SHORT_PUT, LONG_PUT, {**PARAMS, 'COMBO_ORDER': False}, positions())
+    [(long_name, long_contract, [long_order]), (short_name, short_contract, [parent, take_profit, stop_loss])] = plan['stages']
+    assert (long_name, long_contract, short_name, short_contract) == ('long_put', LONG, 'short_put', SHORT)
+    assert (long_order.action, long_order.orderType, long_order.totalQuantity) == ('BUY', 'MKT', 4)
+    assert (parent.action, parent.orderType, parent.totalQuantity) == ('SELL', 'LMT', 2)
+    assert take_profit.action == stop_loss.action == 'BUY'
+    assert take_profit.parentId == stop_loss.parentId == parent.orderId
+    assert long_order.orderId < parent.orderId < take_profit.orderId < stop_loss.orderId
+    assert [o.transmit for o in (parent, take_profit, stop_loss)] == [False, False, True]
+    assert plan['cancel'] == [] and ib.sent == []
+
+
+def test_position_with_working_bracket_is_resized():
+    children = [child_trade(10, 9, 2), child_trade(11, 9, 2)]
+    ib = stubIB(children)
+    plan = entry_orders(ib, SHORT, LONG, SHORT_PUT, LONG_PUT, PARAMS, positions((SHORT, -2, 290.0)))
+    assert plan['modify_position'] and plan['credit'] is None
+    assert plan['cancel'] == [t.order for t in children]
+    [_, (_, _, [parent, take_profit, stop_loss])] = plan['stages']
+    assert (parent.action, parent.orderType, parent.totalQuantity) == ('SELL', 'MKT', 2)
+    assert take_profit.totalQuantity == stop_loss.totalQuantity == 4
+    assert take_profit.parentId == stop_loss.parentId == parent.orderId
+    # the caller cancels the working bracket right before placing the new one
+    assert ib.sent == []
+
+
+def test_position_opened_by_combo_gets_a_new_spread():
+    # children of a combo bracket are on the BAG contract, nothing works on the short put itself
+    plan = entry_orders(stubIB(), SHORT, LONG, SHORT_PUT, LONG_PUT, PARAMS, positions((SHORT, -2, 290.0)))
+    assert not plan['modify_position']
+    assert [name for name, _, _ in plan['stages']] == ['spread']
+
+
+def test_unresizable_bracket_raises_before_sending():
+    ib = stubIB([child_trade(10, 9, 2), child_trade(11, 9, 3)])
+    with pytest.raises(bracketOrderException):
+        entry_orders(ib, SHORT, LONG, SHORT_PUT, LONG_PUT, PARAMS, positions((SHORT, -2, 290.0)))
+    assert ib.sent == []
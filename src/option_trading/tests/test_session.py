@@ -0,0 +1,14 @@
+import pytest
+from ib_insync import IB
+from brokerage.session import ibSession
+
+
+def test_connect_gives_up_when_connect_returns_disconnected(tmp_path):
+    ib = IB()
+    calls = []
+    ib.connect = lambda *args: calls.append(args) # returns without raising, never connected
+    ib.sleep = lambda delay: None
+    session = ibSession('127.0.0.1', 7497, ib = ib, connect_attempt = 3, contract_cache_dir = str(tmp_path))
+    with pytest.raises(SystemExit):
+        session.connect() # no logger
+    assert len(calls) == 4
@@ -0,0 +1,37 @@
+import time
+from services.telegram_service import telegram
+
+
+def sender(**kwargs):
+    # unroutable api_url: _send is replaced in every test
+    return telegram('1', 'TOKEN', api_url = 'http://127.0.0.1:9', min_interval = 0, **kwargs)
+
+
+def test_close_during_burst_stops_sender():
+    tlg = sender(coalesce_window = 1.0)
+    sent = []
+    tlg._send = sent.append
+    tlg.info("a")
+    time.sleep(0.05)
+    tlg.info("b")
+    tlg.close(timeout = 0.05) # the stop sentinel arrives while "a" and "b" are being coalesced
+    tlg._thread.join(2)
+    assert not tlg._thread.is_alive()
+    assert tlg.queue.unfinished_tasks == 0
+    assert sent == ["a\nb"]
+
+
+def test_send_error_keeps_sender_alive():
+    tlg = sender(coalesce_window = 0.01)
+    def fail(text):
+        raise KeyError(text)
+    tlg._send = fail
+    tlg.error("first")
+    assert tlg.flush(timeout = 2)
+    sent = []
+    tlg._send = sent.append
+    tlg.info("second")
+    assert tlg.flush(timeout = 2)
+    tlg.close()
+    assert tlg.stats['errors'] == 1
+    assert sent == ["second"]
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+from utils.option_utils import noChainFoundException
+
+
+class ChainIndex:
+    """Binary search index over a strike-sorted option chain, non monotone columns are argsorted once"""
+    def __init__(self, df: pd.DataFrame):
+        if not df['strike'].is_monotonic_increasing:
+            df = df.sort_values('strike')
+        self.df = df.reset_index(drop = True)
+        self._keys = dict() # column: (sorted values, row positions)
+
+    def __len__(self):
+        return len(self.df)
+
+    def _key(self, col):
+        if col not in self._keys:
+            values = self.df[col].to_numpy(dtype = np.float64)
+            positions = np.flatnonzero(~np.isnan(values))
+            values = values[positions]
+            diff = np.diff(values)
+            if (diff >= 0).all():
+                pass
+            elif (diff <= 0).all():
+                values, positions = values[::-1], positions[::-1]
+            else:
+                order = np.argsort(values, kind = 'stable')
+                values, positions = values[order], positions[order]
+            self._keys[col] = (values, positions)
+        return self._keys[col]
+
+    def nearest_positions(self, col, targets) -> np.ndarray:
+        """row positions (in self.df) of the value closest to each target"""
+        values, positions = self._key(col)
+        if len(values) == 0:
+            raise noChainFoundException(f"No {col} values in chain")
+        targets = np.atleast_1d(np.asarray(targets, dtype = np.float64))
+        right = np.clip(np.searchsorted(values, targets), 0, len(values) - 1)
+        left = np.maximum(right - 1, 0)
+        pick_left = np.abs(values[left] - targets) <= np.abs(values[right] - targets)
+        return positions[np.where(pick_left, left, right)]
+
+    def nearest(self, col, target) -> pd.Series:
+        """chain row with col closest to target"""
+        return self.df.iloc[self.nearest_positions(col, target)[0]]
+
+    def nearest_many(self, col, targets) -> pd.DataFrame:
+        """chain rows with col closest to each target (one row per target, in target order)"""
+        return self.df.iloc[self.nearest_positions(col, targets)]
+
+    def nearest_delta(self, target_delta = -0.15) -> pd.Series:
+        return self.nearest('delta', target_delta)
+
+    def nearest_premium(self, target_premium, side = 'ask') -> pd.Series:
+        if side not in ['bid','ask']:
+            raise ValueError(f"side must be bid or ask, got {side}")
+        return self.nearest(side, target_premium)
+
+    def within(self, col, target, tolerance) -> pd.DataFrame:
+        """all chain rows with |col - target| <= tolerance, sorted by strike"""
+        values, positions = self._key(col)
+        lo = np.searchsorted(values, target - tolerance, side = 'left')
+        hi = np.searchsorted(values, target + tolerance, side = 'right')
+        return self.df.iloc[np.sort(positions[lo:hi])]
+
+    def brackets(self, col, target) -> bool:
+        """True if target lies between the smallest and largest value of col"""
+        values, _ = self._key(col)
+        return len(values) > 0 and values[0] <= target <= values[-1]
+
+
+def chain_index(chain) -> ChainIndex:
+    """chain itself if it is already indexed, else an index of the chain DataFrame"""
+    return chain if isinstance(chain, ChainIndex) else ChainIndex(chain)
@@ -0,0 +1,176 @@
+"""Vectorized Black-Scholes(-Merton) pricer, implied vol solver and greeks
+Used to fill the option chain when IB modelGreeks are missing or stale.
+
+Conventions follow IB modelGreeks: vega per 1 vol point (0.01), theta per calendar day.
+"""
+import numpy as np
+import pandas as pd
+from utils.option_utils import get_date_today, GREEK_COLUMNS
+
+SQRT_2PI = np.sqrt(2 * np.pi)
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / SQRT_2PI
+
+def norm_cdf(x):
+    """Standard normal CDF (Abramowitz & Stegun 26.2.17, |error| < 7.5e-8)"""
+    x = np.asarray(x, dtype = np.float64)
+    z = np.abs(x)
+    t = 1 / (1 + 0.2316419 * z)
+    poly = t * (0.319381530 + t * (-0.356563782 + t * (1.781477937 + t * (-1.821255978 + t * 1.330274429))))
+    upper = norm_pdf(z) * poly # P(Z > |x|)
+    return np.where(x >= 0, 1 - upper, upper)
+
+def norm_ppf(p):
+    """Inverse standard normal CDF (Acklam's rational approximation, relative error < 1.2e-9)"""
+    a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01, -1.328068155288572e+01]
+    c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+    d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00]
+    p = np.asarray(p, dtype = np.float64)
+    p_low = 0.02425
+    q_tail = np.sqrt(-2 * np.log(np.where(p < 0.5, p, 1 - p)))
+    tail = (((((c[0]*q_tail + c[1])*q_tail + c[2])*q_tail + c[3])*q_tail + c[4])*q_tail + c[5]) / ((((d[0]*q_tail + d[1])*q_tail + d[2])*q_tail + d[3])*q_tail + 1)
+    tail = np.where(p < 0.5, tail, -tail)
+    q = p - 0.5
+    r = q * q
+    central = (((((a[0]*r + a[1])*r + a[2])*r + a[3])*r + a[4])*r + a[5]) * q / (((((b[0]*r + b[1])*r + b[2])*r + b[3])*r + b[4])*r + 1)
+    return np.where((p < p_low) | (p > 1 - p_low), tail, central)
+
+def year_fraction(expirations, today: str = None, min_days = 1):
+    """years to expiry from yyyymmdd expirations (lastTradeDateOrContractMonth)"""
+    today = today or get_date_today()
+    # numpy parses ISO days only, much cheaper than pd.to_datetime on a few expirations
+    expiry = np.array([f"{e[:4]}-{e[4:6]}-{e[6:8]}" for e in expirations], dtype = 'datetime64[D]')
+    days = (expiry - np.datetime64(f"{today[:4]}-{today[4:6]}-{today[6:8]}", 'D')).astype(np.int64)
+    return np.maximum(days, min_days) / 365
+
+def _d1_d2(S, K, T, r, q, sigma):
+    vol_sqrt_t = sigma * np.sqrt(T)
+    d1 = (np.log(S / K) + (r - q + 0.5 * sigma ** 2) * T) / vol_sqrt_t
+    return d1, d1 - vol_sqrt_t
+
+def bs_price(S, K, T, r, q, sigma, is_call):
+    """Black-Scholes-Merton price (arrays broadcast)"""
+    d1, d2 = _d1_d2(S, K, T, r, q, sigma)
+    df_q, df_r = np.exp(-q * T), np.exp(-r * T)
+    call = S * df_q * norm_cdf(d1) - K * df_r * norm_cdf(d2)
+    put = K * df_r * norm_cdf(-d2) - S * df_q * norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+def bs_greeks(S, K, T, r, q, sigma, is_call) -> dict:
+    """delta, gamma, vega (per vol point) and theta (per day)"""
+    d1, d2 = _d1_d2(S, K, T, r, q, sigma)
+    df_q, df_r = np.exp(-q * T), np.exp(-r * T)
+    pdf_d1 = norm_pdf(d1)
+    sqrt_t = np.sqrt(T)
+    delta = np.where(is_call, df_q * norm_cdf(d1), -df_q * norm_cdf(-d1))
+    gamma = df_q * pdf_d1 / (S * sigma * sqrt_t)
+    vega = S * df_q * pdf_d1 * sqrt_t / 100
+    decay = -S * df_q * pdf_d1 * sigma / (2 * sqrt_t)
+    call_theta = decay - r * K * df_r * norm_cdf(d2) + q * S * df_q * norm_cdf(d1)
+    put_theta = decay + r * K * df_r * norm_cdf(-d2) - q * S * df_q * norm_cdf(-d1)
+    theta = np.where(is_call, call_theta, put_theta) / 365
+    return {'delta': delta, 'gamma': gamma, 'vega': vega, 'theta': theta}
+
+def implied_vol(price, S, K, T, r, q, is_call, lo = 1e-4, hi = 5.0, tol = 1e-6, max_iter = 100):
+    """Solve implied vol for the whole chain at once (Newton steps safeguarded by bisection)
+    NaN where price is outside the no-arbitrage bounds"""
+    price, S, K, T, r, q, is_call = np.broadcast_arrays(*[np.asarray(a, dtype = np.float64) for a in (price, S, K, T, r, q)], np.asarray(is_call, dtype = bool))
+    fwd_S, fwd_K = S * np.exp(-q * T), K * np.exp(-r * T)
+    lower = np.where(is_call, np.maximum(fwd_S - fwd_K, 0), np.maximum(fwd_K - fwd_S, 0))
+    upper = np.where(is_call, fwd_S, fwd_K)
+    valid = (price > lower) & (price < upper)
+
+    lo = np.full(price.shape, lo)
+    hi = np.full(price.shape, hi)
+    sigma = np.full(price.shape, 0.2)
+    active = valid.copy()
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        diff = bs_price(S, K, T, r, q, sigma, is_call) - price
+        active &= np.abs(diff) > tol
+        # keep bracket around the root (price is increasing in sigma)
+        hi = np.where(active & (diff > 0), sigma, hi)
+        lo = np.where(active & (diff < 0), sigma, lo)
+        vega = bs_greeks(S, K, T, r, q, sigma, is_call)['vega'] * 100
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            newton = sigma - diff / vega
+        bisect = 0.5 * (lo + hi)
+        step = np.where((newton > lo) & (newton < hi), newton, bisect)
+        sigma = np.where(active, step, sigma)
+    return np.where(valid, sigma, np.nan)
+
+def compute_chain_greeks(df: pd.DataFrame, und_price, rate = 0.0, dividend = 0.0, today: str = None) -> pd.DataFrame:
+    """Implied vol from mid price and greeks for every row of the chain in one call
+    Returns a frame (same index as df) with IV, delta, gamma, vega, theta, undprice"""
+    mid = 0.5 * (df['bid'].to_numpy(dtype = np.float64) + df['ask'].to_numpy(dtype = np.float64))
+    K = df['strike'].to_numpy(dtype = np.float64)
+    T = year_fraction(df['expiration'], today)
+    is_call = (df['right'] == 'C').to_numpy()
+    iv = implied_vol(mid, und_price, K, T, rate, dividend, is_call)
+    greeks = bs_greeks(und_price, K, T, rate, dividend, iv, is_call)
+    return pd.DataFrame({'IV': iv, **greeks, 'undprice': np.full(len(df), float(und_price))}, index = df.index)
+
+def fill_missing_greeks(df: pd.DataFrame, und_price = None, rate = 0.0, dividend = 0.0, max_und_drift = None, today: str = None) -> pd.DataFrame:
+    """Fill rows without IB greeks (or with stale ones) from the local pricer
+    and tag each row with greeks_source ('ib', 'local', or '' if it could not be priced)
+
+    Args:
+        und_price (float): underlying price, defaults to the median IB undprice of the chain
+        max_und_drift (float): IB greeks computed off an underlying price more than this
+            fraction away from und_price are considered stale and recomputed
+    """
+    df = df.copy()
+    has_ib = df['has_greeks'].to_numpy(dtype = bool) if 'has_greeks' in df else ~df['delta'].isna().to_numpy()
+    if und_price is None:
+        und_price = df.loc[has_ib, 'undprice'].median()
+    if und_price is None or np.isnan(und_price):
+        raise ValueError("No underlying price available to compute greeks")
+    stale = np.zeros(len(df), dtype = bool)
+    if max_und_drift is not None:
+        stale = has_ib & (np.abs(df['undprice'].to_numpy(dtype = np.float64) / und_price - 1) > max_und_drift)
+    refill = ~has_ib | stale
+    source = np.where(has_ib, 'ib', '').astype(object)
+    if refill.any():
+        local = compute_chain_greeks(df.loc[refill], und_price, rate, dividend, today)
+        priced = local['delta'].notna().to_numpy()
+        rows = df.index[refill][priced]
+        df.loc[rows, GREEK_COLUMNS] = local.loc[rows, GREEK_COLUMNS].to_numpy()
+        source[np.flatnonzero(refill)[priced]] = 'local'
+        # stale rows that could not be repriced keep IB greeks
+    df['greeks_source'] = source
+    return df
+
+def strike_for_delta(delta, und_price, iv, T, rate = 0.0, dividend = 0.0):
+    """Black-Scholes strike with the given delta (negative for puts, positive for calls)"""
+    delta = np.asarray(delta, dtype = np.float64)
+    is_call = delta > 0
+    # call delta = e^-qT N(d1), put delta = -e^-qT N(-d1)
+    n_d1 = np.where(is_call, delta * np.exp(dividend * T), 1 + delta * np.exp(dividend * T))
+    d1 = norm_ppf(np.clip(n_d1, 1e-9, 1 - 1e-9))
+    return und_price * np.exp(-d1 * iv * np.sqrt(T) + (rate - dividend + 0.5 * iv ** 2) * T)
+
+def delta_strike_window(delta_lo, delta_hi, und_price, iv, T, rate = 0.0, dividend = 0.0):
+    """(low strike, high strike) covering deltas between delta_lo and delta_hi"""
+    strikes = strike_for_delta([delta_lo, delta_hi], und_price, iv, T, rate, dividend)
+    return float(strikes.min()), float(strikes.max())
+
+def premium_strike_window(strikes, target_premium, band, und_price, iv, T, right = 'P', rate = 0.0, dividend = 0.0):
+    """(low strike, high strike) of strikes whose model premium lies within target_premium +/- band
+    falls back to the single strike with the closest model premium"""
+    strikes = np.asarray(strikes, dtype = np.float64)
+    premium = bs_price(und_price, strikes, T, rate, dividend, iv, right == 'C')
+    inside = strikes[np.abs(premium - target_premium) <= band]
+    if len(inside) == 0:
+        inside = strikes[[np.argmin(np.abs(premium - target_premium))]]
+    return float(inside.min()), float(inside.max())
+
+def widen_strike_window(window, factor = 2.0):
+    """widen the window around its centre by factor"""
+    lo, hi = window
+    centre, half = 0.5 * (lo + hi), 0.5 * (hi - lo) * factor
+    half = max(half, 0.01 * centre) # a single strike window still has to grow
+    return centre - half, centre + half
@@ -1,6 +1,7 @@
 from zoneinfo import ZoneInfo
 import datetime
-from dateutil.relativedelta import relativedelta
+import functools
+import numpy as np
 import pandas as pd
 from ib_insync import *
 
@@ -17,52 +18,146 @@ def convert_str_date(date):
     """convert string (format: 20230623) to date"""
     return datetime.datetime.strptime(date,'%Y%m%d')
 
-def get_nearest_expiry(expiries, dte):
+def to_datetime64(dates) -> np.ndarray:
+    """yyyymmdd strings to a datetime64[D] array"""
+    return np.array([f"{d[:4]}-{d[4:6]}-{d[6:8]}" for d in dates], dtype = 'datetime64[D]')
+
+class expiryResolver:
+    """Listed expirations resolved from DTE targets with one searchsorted, and their strike grid.
+    policy: 'nearest' (ties to the earlier expiration), 'on_or_before' or 'on_or_after' (None if none qualifies)"""
+    POLICIES = ('nearest', 'on_or_before', 'on_or_after')
+
+    def __init__(self, expirations, strikes = None):
+        self.expirations = sorted(set(expirations))
+        self.dates = to_datetime64(self.expirations)
+        self.listed_strikes = np.array(sorted(strikes), dtype = float) if strikes is not None else None
+        self.strike_grid = dict() # expiry: sorted strikes array
+
+    def __len__(self):
+        return len(self.expirations)
+
+    def resolve(self, dtes, today: str = None, policy = 'nearest') -> list:
+        """expiration (yyyymmdd) of each DTE target from today"""
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown expiry policy {policy}, use one of {self.POLICIES}")
+        n = len(self.dates)
+        if n == 0:
+            return [None] * len(dtes)
+        targets = to_datetime64([today or get_date_today()])[0] + np.asarray(dtes, dtype = 'timedelta64[D]')
+        after = np.searchsorted(self.dates, targets, side = 'left')   # first expiration on or after target
+        if policy == 'on_or_after':
+            idx, valid = after, after < n
+        elif policy == 'on_or_before':
+            idx = np.searchsorted(self.dates, targets, side = 'right') - 1
+            valid = idx >= 0
+        else:
+            hi = np.minimum(after, n - 1)
+            lo = np.maximum(after - 1, 0)
+            idx = np.where(np.abs(targets - self.dates[lo]) <= np.abs(self.dates[hi] - targets), lo, hi)
+            valid = np.ones(len(idx), dtype = bool)
+        return [self.expirations[i] if ok else None for i, ok in zip(idx.tolist(), valid.tolist())]
+
+    def nearest(self, dte, today: str = None, policy = 'nearest'):
+        return self.resolve([dte], today, policy)[0]
+
+    def set_strikes(self, expiry: str, strikes):
+        self.strike_grid[expiry] = np.unique(np.asarray(strikes, dtype = float))
+
+    def strikes(self, expiry: str, window: tuple = None) -> np.ndarray:
+        """sorted strikes of an expiration (inside window (low, high) inclusive if given)"""
+        grid = self.strike_grid.get(expiry, self.listed_strikes)
+        if grid is None:
+            return np.array([], dtype = float)
+        if window is None:
+            return grid
+        return grid[np.searchsorted(grid, window[0], side = 'left'):np.searchsorted(grid, window[1], side = 'right')]
+
+@functools.lru_cache(maxsize = 32)
+def expiry_resolver(expirations: tuple) -> expiryResolver:
+    """resolver of an expiration list, parsed once per distinct list"""
+    return expiryResolver(expirations)
+
+def get_nearest_expiry(expiries, dte, today: str = None):
     """Given DTE from today, find the date from the list of expiration date"""
-    date = convert_str_date(get_date_today())
-    target_date = date + relativedelta(days = dte)
-    nearest_date = min(expiries, key=lambda x: abs(convert_str_date(x) - target_date))
-    difference = convert_str_date(nearest_date) - target_date
-    return nearest_date
+    return expiry_resolver(tuple(expiries)).nearest(dte, today)
 
 def round_to(n, precision):
     correction = 0.5 if n >= 0 else -0.5
     return int( n/precision+correction ) * precision
 
-def convert_tickers_to_full_chain(tickers: list[Ticker], need_greeks = True):
-    full_chain = {}
-    for ticker in tickers:
-        if ticker.contract.localSymbol not in full_chain:
-            full_chain[ticker.contract.localSymbol] = {}
-            full_chain[ticker.contract.localSymbol]['strike'] = ticker.contract.strike
-            full_chain[ticker.contract.localSymbol]['right'] = ticker.contract.right
-            full_chain[ticker.contract.localSymbol]['expiration'] = ticker.contract.lastTradeDateOrContractMonth
-            full_chain[ticker.contract.localSymbol]['bid'] = ticker.bid
-            full_chain[ticker.contract.localSymbol]['ask'] = ticker.ask
-            full_chain[ticker.contract.localSymbol]['bid_size'] = ticker.bidSize
-            full_chain[ticker.contract.localSymbol]['ask_size'] = ticker.askSize
-            full_chain[ticker.contract.localSymbol]['volume'] = ticker.volume
-            # full_chain[ticker.contract.localSymbol]['put_OI'] = ticker.putOpenInterest
-            # full_chain[ticker.contract.localSymbol]['call_OI'] = ticker.callOpenInterest
-
-            # handle missing greeks
-            if ticker.modelGreeks is None:
-                if need_greeks:               
-                    raise noChainFoundException
-                else:
-                    continue
-            else:
-                full_chain[ticker.contract.localSymbol]['IV'] = ticker.modelGreeks.impliedVol
-                full_chain[ticker.contract.localSymbol]['delta'] = ticker.modelGreeks.delta
-                full_chain[ticker.contract.localSymbol]['gamma'] = ticker.modelGreeks.gamma
-                full_chain[ticker.contract.localSymbol]['vega'] = ticker.modelGreeks.vega
-                full_chain[ticker.contract.localSymbol]['theta'] = ticker.modelGreeks.theta
-                full_chain[ticker.contract.localSymbol]['undprice'] = ticker.modelGreeks.undPrice
+FLOAT_COLUMNS = ['strike', 'bid', 'ask', 'bid_size', 'ask_size', 'volume',
+                 'IV', 'delta', 'gamma', 'vega', 'theta', 'undprice']
+GREEK_COLUMNS = ['IV', 'delta', 'gamma', 'vega', 'theta', 'undprice']
+CHAIN_COLUMNS = ['index', 'conId', 'strike', 'right', 'expiration', 'bid', 'ask', 'bid_size', 'ask_size',
+                 'volume', 'IV', 'delta', 'gamma', 'vega', 'theta', 'undprice', 'has_greeks']
 
-        else:
+def build_chain_columns(tickers: list[Ticker], need_greeks = True, partial = False) -> dict:
+    """Single pass over tickers into preallocated typed numpy columns
+    
+    Args:
+        tickers (list[Ticker]): option tickers (duplicated localSymbols are skipped)
+        need_greeks (bool): raise noChainFoundException on the first ticker without modelGreeks
+        partial (bool): keep tickers without modelGreeks (NaN greeks, has_greeks = False) instead of raising
+
+    Returns:
+        dict of column name: numpy array (float64 / int64 / bool / object)
+    """
+    n = len(tickers)
+    cols = {c: np.full(n, np.nan, dtype = np.float64) for c in FLOAT_COLUMNS}
+    cols['index'] = np.empty(n, dtype = object) # localSymbol
+    cols['conId'] = np.zeros(n, dtype = np.int64)
+    cols['right'] = np.empty(n, dtype = object)
+    cols['expiration'] = np.empty(n, dtype = object)
+    cols['has_greeks'] = np.zeros(n, dtype = bool)
+    seen = set()
+    i = 0
+    for ticker in tickers:
+        contract = ticker.contract
+        if contract.localSymbol in seen:
             continue
+        greeks = ticker.modelGreeks
+        if greeks is None and need_greeks and not partial:
+            raise noChainFoundException(f"Missing greeks for {contract.localSymbol}")
+        seen.add(contract.localSymbol)
+        cols['index'][i] = contract.localSymbol
+        cols['conId'][i] = contract.conId
+        cols['strike'][i] = contract.strike
+        cols['right'][i] = contract.right
+        cols['expiration'][i] = contract.lastTradeDateOrContractMonth
+        cols['bid'][i] = ticker.bid
+        cols['ask'][i] = ticker.ask
+        cols['bid_size'][i] = ticker.bidSize
+        cols['ask_size'][i] = ticker.askSize
+        cols['volume'][i] = ticker.volume
+        if greeks is not None:
+            cols['has_greeks'][i] = True
+            cols['IV'][i] = greeks.impliedVol
+            cols['delta'][i] = greeks.delta
+            cols['gamma'][i] = greeks.gamma
+            cols['vega'][i] = greeks.vega
+            cols['theta'][i] = greeks.theta
+            cols['undprice'][i] = greeks.undPrice
+        i += 1
+    # trim rows skipped as duplicates
+    return {k: v[:i] for k, v in cols.items()}
+
+def convert_tickers_to_full_chain(tickers: list[Ticker], need_greeks = True, partial = False) -> pd.DataFrame:
+    """Convert tickers into a typed option chain (float64 prices/greeks, int64 conId)
+    one row per localSymbol in column 'index'. See build_chain_columns"""
+    cols = build_chain_columns(tickers, need_greeks = need_greeks, partial = partial)
+    return pd.DataFrame(cols, columns = CHAIN_COLUMNS)
+
+def convert_tickers_to_chain_records(tickers: list[Ticker], need_greeks = True, partial = False) -> np.recarray:
+    """Same as convert_tickers_to_full_chain but returns a numpy record array"""
+    cols = build_chain_columns(tickers, need_greeks = need_greeks, partial = partial)
+    return np.rec.fromarrays([cols[c] for c in CHAIN_COLUMNS], names = CHAIN_COLUMNS)
 
-    return pd.DataFrame(full_chain).T.reset_index()
+def filter_strike_window(contracts: list[Contract], strike_window = None) -> list[Contract]:
+    """contracts with strike inside (low, high) window (all contracts if no window)"""
+    if strike_window is None:
+        return list(contracts)
+    lo, hi = strike_window
+    return [c for c in contracts if lo <= c.strike <= hi]
 
 def dist_from_ITM(contract: Contract, und_price):
     """if +ve, it will be ITM """
@@ -0,0 +1,36 @@
+"""Leg selection and sizing of the short put / long put (hedge) spread
+
+Pure functions of chain snapshots and params, shared by the live strategy (ninetyDTE)
+and the replay backtest so both trade exactly the same rules.
+"""
+import math
+import pandas as pd
+from utils.chain_index import ChainIndex
+
+
+def select_short_put(short_chain: ChainIndex, params) -> pd.Series:
+    """put closest to SHORT_DELTA_TARGET, None if outside SHORT_DELTA_TOLERANCE"""
+    short_put = short_chain.nearest_delta(params['SHORT_DELTA_TARGET'])
+    if abs(short_put['delta'] - params['SHORT_DELTA_TARGET']) > params['SHORT_DELTA_TOLERANCE']:
+        return None
+    return short_put
+
+def hedge_credit_target(short_put: pd.Series, params) -> float:
+    """ask of each long put, HEDGE_CREDIT_TARGET of the short put bid spread over HEDGE_RATIO hedges"""
+    return short_put['bid'] * params['HEDGE_CREDIT_TARGET'] / (params['HEDGE_RATIO'])
+
+def select_long_put(hedge_chain: ChainIndex, target, params) -> pd.Series:
+    """put with ask closest to the hedge credit target, None if outside HEDGE_CREDIT_TOLERANCE"""
+    long_put = hedge_chain.nearest_premium(target, side = 'ask')
+    if abs(long_put['ask'] - target) > params['HEDGE_CREDIT_TOLERANCE']:
+        return None
+    return long_put
+
+def order_quantities(short_put: pd.Series, params, multiplier = 100):
+    """(short qty, hedge qty) collecting about DAILY_PREMIUM, at least 1 short"""
+    short_qty = max(math.floor(params['DAILY_PREMIUM'] / (short_put['bid'] * multiplier)), 1)
+    return short_qty, short_qty * params['HEDGE_RATIO']
+
+def spread_credit(short_put: pd.Series, long_put: pd.Series, params) -> float:
+    """net credit of 1 short put and HEDGE_RATIO long puts"""
+    return short_put['bid'] - params['HEDGE_RATIO'] * long_put['ask']
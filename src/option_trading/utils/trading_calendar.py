@@ -0,0 +1,127 @@
+"""Local trading calendar: exchange sessions merged with our halt days, cached on disk
+
+Sessions come from pandas_market_calendars (requirements.txt). Without it every weekday is a
+09:30-16:00 session (source 'weekdays', exact is False): holidays and early closes are unknown,
+so callers confirm the day with IB (utils/trade_utils.is_market_open_today). The calendar covers today to
+horizon_days ahead and is rebuilt only when it is older than max_age_days or does not cover today.
+Halt days are re-read once a day (they are added at short notice), so "is today tradable" is a
+dict lookup that needs neither IB nor a scan of the halt collection.
+Ref:
+https://pypi.org/project/pandas-market-calendars/
+"""
+import os
+import json
+import datetime
+from zoneinfo import ZoneInfo
+from utils.date_utils import get_date_today, convert_str_date
+
+try:
+    import pandas_market_calendars as mcal
+except ImportError:
+    mcal = None
+
+
+def exchange_sessions(exchange: str, start: str, end: str, tz = "US/Eastern") -> tuple[dict, str]:
+    """{yyyymmdd: [open, close]} (isoformat in tz) of start to end inclusive, and the source used"""
+    if mcal is not None:
+        schedule = mcal.get_calendar(exchange).schedule(start_date = convert_str_date(start), end_date = convert_str_date(end))
+        sessions = {day.strftime("%Y%m%d"): [row.market_open.tz_convert(tz).isoformat(), row.market_close.tz_convert(tz).isoformat()]
+                    for day, row in schedule.iterrows()}
+        return sessions, 'pandas_market_calendars'
+    sessions = dict()
+    day, last = convert_str_date(start).date(), convert_str_date(end).date()
+    while day <= last:
+        if day.weekday() < 5:
+            sessions[day.strftime("%Y%m%d")] = [datetime.datetime.combine(day, datetime.time(9, 30), ZoneInfo(tz)).isoformat(),
+                                                datetime.datetime.combine(day, datetime.time(16, 0), ZoneInfo(tz)).isoformat()]
+        day += datetime.timedelta(days = 1)
+    return sessions, 'weekdays'
+
+
+def load_halt_days(collection, start: str) -> list[str]:
+    """yyyymmdd halt days from start on, of a collection of {'date': datetime} documents (trading_days_halt)"""
+    return [d['date'].date().strftime("%Y%m%d") for d in collection.find({'date': {'$gte': convert_str_date(start)}}, {'date': 1})]
+
+
+class tradingCalendar:
+    """Exchange sessions and our halt days by yyyymmdd, halt_source(start) returns the halt days from start on"""
+    def __init__(self, exchange = 'NYSE', cache_dir = '.cache/calendar', halt_source = None, tz = "US/Eastern",
+                 horizon_days = 366, max_age_days = 7, today: str = None):
+        self.exchange = exchange
+        self.path = os.path.join(cache_dir, f"{exchange}.json")
+        self.halt_source = halt_source
+        self.tz = tz
+        self.horizon_days = horizon_days
+        self.max_age_days = max_age_days
+        self.today = today or get_date_today(tz)
+        self._halts = None
+        self.data = self._read()
+        if self.is_stale():
+            self.refresh()
+        elif self.halt_source is not None and self.data['halts_updated'] != self.today:
+            self.refresh_halts()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_stale(self) -> bool:
+        if self.data is None:
+            return True
+        age = convert_str_date(self.today) - convert_str_date(self.data['created'])
+        return age > datetime.timedelta(days = self.max_age_days) or not (self.data['start'] <= self.today <= self.data['end'])
+
+    def refresh(self):
+        """rebuild sessions and halt days from today to the horizon and write the cache"""
+        end = (convert_str_date(self.today) + datetime.timedelta(days = self.horizon_days)).strftime("%Y%m%d")
+        sessions, source = exchange_sessions(self.exchange, self.today, end, self.tz)
+        self.data = {'created': self.today, 'exchange': self.exchange, 'source': source,
+                     'start': self.today, 'end': end, 'sessions': sessions, 'halts': [], 'halts_updated': None}
+        return self.refresh_halts()
+
+    def refresh_halts(self):
+        if self.halt_source is not None:
+            self.data['halts'] = sorted(set(self.halt_source(self.today)))
+            self.data['halts_updated'] = self.today
+        self._write()
+        self._halts = None
+        return self
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok = True)
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+    @property
+    def source(self) -> str:
+        return self.data['source']
+
+    @property
+    def exact(self) -> bool:
+        """sessions are the exchange's (holidays and early closes included)"""
+        return self.source != 'weekdays'
+
+    @property
+    def halts(self) -> set:
+        if self._halts is None:
+            self._halts = set(self.data['halts'])
+        return self._halts
+
+    def is_halted(self, date: str = None) -> bool:
+        return (date or self.today) in self.halts
+
+    def is_trading_day(self, date: str = None) -> bool:
+        date = date or self.today
+        return date in self.data['sessions'] and date not in self.halts
+
+    def session(self, date: str = None):
+        """(open, close) timezone aware datetimes of the exchange session, None if closed"""
+        session = self.data['sessions'].get(date or self.today)
+        if session is None:
+            return None
+        return tuple(datetime.datetime.fromisoformat(t) for t in session)